@@ -0,0 +1,95 @@
+"""
+Measures the cost of redacting the request body of each type of Humbug report with the default
+redactor (see humbug.redaction), next to the cost of serializing the same body.
+
+Usage:
+    python benchmarks/redaction.py [-n NUMBER]
+"""
+import argparse
+import os
+import sys
+import timeit
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from humbug import consent, redaction, report, serialization  # noqa: E402
+
+
+def bodies() -> Dict[str, Dict[str, Any]]:
+    reporter = report.HumbugReporter(
+        "benchmark",
+        consent.HumbugConsent(True),
+        client_id="benchmark-client",
+        mode=report.Modes.SYNCHRONOUS,
+        redact=False,
+    )
+    try:
+        raise ValueError("benchmark error")
+    except ValueError as error:
+        error_report = reporter.error_report(error, publish=False)
+    reports = {
+        "system": reporter.system_report(publish=False),
+        "error": error_report,
+        "feature": reporter.feature_report(
+            "benchmark_feature",
+            {"path": "/tmp/data.csv", "rows": "100000", "mode": "fast"},
+            publish=False,
+        ),
+        "env": reporter.env_report(publish=False),
+        "packages": reporter.packages_report(publish=False),
+    }
+    return {
+        report_type: reporter._post_body(generated)
+        for report_type, generated in reports.items()
+        if generated is not None
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark Humbug redaction")
+    parser.add_argument(
+        "-n", "--number", type=int, default=1000, help="Redactions per measurement"
+    )
+    args = parser.parse_args()
+
+    redactor = redaction.default_redactor()
+    serializer = serialization.default_serializer()
+    print(
+        "{:<10} {:>8} {:>12} {:>10} {:>14}".format(
+            "report", "bytes", "us/redact", "ns/byte", "us/serialize"
+        )
+    )
+    for report_type, body in bodies().items():
+        size = len(body["content"])
+        # redact_body replaces the values in the body it is given, so each run redacts a shallow
+        # copy. The time taken to copy the body is subtracted.
+        copy_seconds = min(
+            timeit.repeat(lambda: dict(body), number=args.number, repeat=3)
+        )
+        redact_seconds = (
+            min(
+                timeit.repeat(
+                    lambda: redactor.redact_body(dict(body)),
+                    number=args.number,
+                    repeat=3,
+                )
+            )
+            - copy_seconds
+        )
+        serialize_seconds = min(
+            timeit.repeat(lambda: serializer.dumps(body), number=args.number, repeat=3)
+        )
+        print(
+            "{:<10} {:>8} {:>12.2f} {:>10.1f} {:>14.2f}".format(
+                report_type,
+                size,
+                redact_seconds / args.number * 1e6,
+                redact_seconds / args.number / max(size, 1) * 1e9,
+                serialize_seconds / args.number * 1e6,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Compares the serializers in humbug.serialization on the request bodies of each type of Humbug
+report: bytes on the wire and encode time per report.
+
+Usage:
+    python benchmarks/serialization.py [-n NUMBER]
+"""
+import argparse
+import os
+import sys
+import timeit
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from humbug import consent, report, serialization  # noqa: E402
+
+
+def bodies(markdown: bool) -> Dict[str, Dict[str, Any]]:
+    reporter = report.HumbugReporter(
+        "benchmark",
+        consent.HumbugConsent(True),
+        client_id="benchmark-client",
+        mode=report.Modes.SYNCHRONOUS,
+        markdown=markdown,
+    )
+    try:
+        raise ValueError("benchmark error")
+    except ValueError as error:
+        error_report = reporter.error_report(error, publish=False)
+    reports = {
+        "system": reporter.system_report(publish=False),
+        "error": error_report,
+        "feature": reporter.feature_report(
+            "benchmark_feature",
+            {"path": "/tmp/data.csv", "rows": "100000", "mode": "fast"},
+            publish=False,
+        ),
+        "packages": reporter.packages_report(publish=False),
+        "memory": reporter.memory_report(publish=False),
+    }
+    return {
+        report_type: reporter._post_body(generated)
+        for report_type, generated in reports.items()
+        if generated is not None
+    }
+
+
+def serializers() -> List[serialization.Serializer]:
+    available: List[serialization.Serializer] = [
+        serialization.JSONSerializer(use_orjson=False)
+    ]
+    if serialization.orjson is not None:
+        available.append(serialization.JSONSerializer())
+    if serialization.msgpack is not None:
+        available.append(serialization.MsgpackSerializer())
+    return available
+
+
+def label(serializer: serialization.Serializer) -> str:
+    if isinstance(serializer, serialization.JSONSerializer):
+        return "json (orjson)" if serializer.use_orjson else "json (stdlib)"
+    return serializer.name
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark Humbug serializers")
+    parser.add_argument(
+        "-n", "--number", type=int, default=2000, help="Encodes per measurement"
+    )
+    args = parser.parse_args()
+
+    print(
+        "{:<10} {:<9} {:<14} {:>8} {:>12}".format(
+            "report", "content", "serializer", "bytes", "us/encode"
+        )
+    )
+    for markdown in (True, False):
+        for report_type, body in bodies(markdown).items():
+            for serializer in serializers():
+                size = len(serializer.dumps(body))
+                seconds = min(
+                    timeit.repeat(
+                        lambda: serializer.dumps(body), number=args.number, repeat=3
+                    )
+                )
+                print(
+                    "{:<10} {:<9} {:<14} {:>8} {:>12.2f}".format(
+                        report_type,
+                        "markdown" if markdown else "compact",
+                        label(serializer),
+                        size,
+                        seconds / args.number * 1e6,
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
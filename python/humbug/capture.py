@@ -0,0 +1,102 @@
+"""
+This module implements the queue through which Humbug's thread and asyncio exception hooks hand
+exceptions off to be reported in the background.
+"""
+from collections import deque
+import os
+import threading
+from typing import Any, Callable, Deque, List, Optional, Tuple
+import weakref
+
+
+class ExceptionQueue:
+    """
+    ExceptionQueue collects exceptions captured by exception hooks and passes them to on_exception
+    (with the tags they were captured with) from a background daemon thread.
+
+    capture() only appends the exception to a queue and wakes the background thread, so hooks which
+    call it return immediately: building and publishing reports never blocks an event loop or holds
+    up the teardown of a thread. At most max_pending exceptions are queued; when the queue is full,
+    the oldest exception is dropped and counted in dropped.
+
+    The background thread is started on the first capture (and again, after a fork, on the first
+    capture in the child). Call flush() to process captured exceptions on the calling thread.
+    """
+
+    def __init__(
+        self,
+        on_exception: Callable[[BaseException, List[str]], Any],
+        max_pending: int = 100,
+    ) -> None:
+        self.on_exception = on_exception
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._reset()
+        _queues.add(self)
+
+    def _reset(self) -> None:
+        self._pending: Deque[Tuple[BaseException, List[str]]] = deque(
+            maxlen=self.max_pending
+        )
+        self._ready = threading.Event()
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _after_fork_in_child(self) -> None:
+        # Exceptions captured by the parent are reported by the parent.
+        self._reset()
+
+    def capture(self, error: BaseException, tags: List[str]) -> None:
+        if len(self._pending) == self.max_pending:
+            self.dropped += 1
+        self._pending.append((error, tags))
+        self._ready.set()
+        if self._thread is None:
+            self._start()
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="humbug_exception_reporter", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._ready.wait()
+            self._ready.clear()
+            self.flush()
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def flush(self) -> None:
+        """
+        Passes every queued exception to on_exception. If the background thread is already doing
+        so, waits for it to finish.
+        """
+        with self._flush_lock:
+            while True:
+                try:
+                    error, tags = self._pending.popleft()
+                except IndexError:
+                    return
+                try:
+                    self.on_exception(error, tags)
+                except Exception:
+                    pass
+
+
+_queues: "weakref.WeakSet[ExceptionQueue]" = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    for queue in list(_queues):
+        queue._after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,144 @@
+"""
+This module implements limits on the cardinality of the parameter tags Humbug attaches to feature
+reports.
+"""
+from collections import Counter, deque
+import hashlib
+import reprlib
+import threading
+from typing import Any, Callable, Collection, Dict, Optional, Sequence, Set
+
+OTHER = "other"
+
+Bucketer = Callable[[Any], str]
+
+_CONTAINER_TYPES = (list, tuple, set, frozenset, dict, deque)
+
+# Represents containers without visiting more than a few of their elements.
+_bounded_repr = reprlib.Repr()
+_bounded_repr.maxstring = 100
+_bounded_repr.maxother = 100
+
+
+def bounded_str(value: Any, max_length: int) -> str:
+    """
+    Returns the string representation of a value, truncated to max_length characters. Strings,
+    bytes and containers are truncated before they are converted, so that the cost of representing
+    a large argument does not grow with its size.
+    """
+    if isinstance(value, str):
+        return value[:max_length]
+    if isinstance(value, (bytes, bytearray)):
+        return str(value[:max_length])[:max_length]
+    if isinstance(value, _CONTAINER_TYPES):
+        return _bounded_repr.repr(value)[:max_length]
+    return str(value)[:max_length]
+
+
+def hash_value(value: Any) -> str:
+    """
+    Replaces a value with a short, stable hash of its string representation. Useful for values like
+    file paths or IDs, where you want to count distinct values without seeing them.
+    """
+    return hashlib.sha256(str(value).encode("utf-8")).hexdigest()[:12]
+
+
+def numeric_buckets(boundaries: Sequence[float]) -> Bucketer:
+    """
+    Returns a bucketer which maps numeric values to the range between consecutive boundaries that
+    they fall into, e.g. with boundaries [10, 100]: 5 -> "<10", 50 -> "10-100", 500 -> ">=100".
+    Values which are not numbers are mapped to "other".
+    """
+    if not boundaries:
+        raise ValueError("numeric_buckets requires at least one boundary")
+    boundaries = sorted(boundaries)
+
+    def bucketer(value: Any) -> str:
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return OTHER
+        if number < boundaries[0]:
+            return "<{}".format(boundaries[0])
+        for low, high in zip(boundaries, boundaries[1:]):
+            if number < high:
+                return "{}-{}".format(low, high)
+        return ">={}".format(boundaries[-1])
+
+    return bucketer
+
+
+class CardinalityLimiter:
+    """
+    CardinalityLimiter maps feature parameters to parameter:<key>=<value> tags while bounding the
+    number of distinct tags they can generate.
+
+    For each parameter, in order:
+    1. If its key has a bucketer (see hash_value and numeric_buckets), the value is replaced by the
+       bucketer's output.
+    2. If its key has an allowlist, values which are not on the allowlist become "other".
+    3. Each key may take at most max_distinct_values distinct values. Once that budget is spent,
+       new values become "other".
+    4. Tags longer than max_tag_length characters are truncated.
+
+    Values which became "other" in steps 2 and 3 are counted per key in dropped, and truncated tags
+    are counted per key in truncated (see counts).
+    """
+
+    def __init__(
+        self,
+        allowlists: Optional[Dict[str, Collection[str]]] = None,
+        bucketers: Optional[Dict[str, Bucketer]] = None,
+        max_distinct_values: int = 50,
+        max_tag_length: int = 128,
+    ) -> None:
+        self.allowlists = {
+            key: set(values) for key, values in (allowlists or {}).items()
+        }
+        self.bucketers = dict(bucketers or {})
+        self.max_distinct_values = max_distinct_values
+        self.max_tag_length = max_tag_length
+        self.dropped: Counter = Counter()
+        self.truncated: Counter = Counter()
+        self._seen: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def value(self, key: str, value: Any) -> str:
+        """
+        Returns the value under which the given parameter should be tagged.
+        """
+        bucketer = self.bucketers.get(key)
+        if bucketer is not None:
+            tag_value = bucketer(value)
+        else:
+            tag_value = bounded_str(value, self.max_tag_length)
+
+        allowlist = self.allowlists.get(key)
+        if allowlist is not None and tag_value not in allowlist:
+            with self._lock:
+                self.dropped[key] += 1
+            return OTHER
+
+        with self._lock:
+            seen = self._seen.setdefault(key, set())
+            if tag_value not in seen:
+                if len(seen) >= self.max_distinct_values:
+                    self.dropped[key] += 1
+                    return OTHER
+                seen.add(tag_value)
+        return tag_value
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the number of values tagged as "other" and of tags truncated so far, per key.
+        """
+        with self._lock:
+            return {"dropped": dict(self.dropped), "truncated": dict(self.truncated)}
+
+    def tag(self, key: str, value: Any) -> str:
+        tag = "parameter:{}={}".format(key, self.value(key, value))
+        if len(tag) > self.max_tag_length:
+            with self._lock:
+                self.truncated[key] += 1
+            tag = tag[: self.max_tag_length]
+        return tag
@@ -0,0 +1,103 @@
+"""
+This module implements the cache Humbug reporters use to avoid delivering the same report twice.
+"""
+from collections import OrderedDict
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+
+class DedupCache:
+    """
+    DedupCache remembers the idempotency keys of recently delivered reports.
+
+    At most max_entries keys are remembered - when the cache is full, the least recently used key
+    is forgotten - and each key is forgotten ttl_seconds after it was added. If a path is given, the
+    cache is loaded from that file when it is created and written back to it by save(), so that
+    reports replayed by a later process (for example, from the shutdown spool) are not delivered
+    again.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        ttl_seconds: float = 24 * 60 * 60,
+        path: Optional[str] = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        # Maps keys to the (wall clock) time at which they were added, least recently used first.
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        with self._lock:
+            added = self._entries.get(key)
+            if added is None:
+                return False
+            if time.time() - added >= self.ttl_seconds:
+                del self._entries[key]
+                return False
+            self._entries.move_to_end(key)
+            return True
+
+    def add(self, key: str) -> None:
+        with self._lock:
+            self._entries[key] = time.time()
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def load(self) -> None:
+        """
+        Adds the unexpired keys stored in the cache's file, if it exists, to the cache.
+        """
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as ifp:
+                stored = json.load(ifp)
+        except (OSError, ValueError):
+            return
+        if not isinstance(stored, dict):
+            return
+        cutoff = time.time() - self.ttl_seconds
+        entries = sorted(
+            (added, key)
+            for key, added in stored.items()
+            if isinstance(added, (int, float)) and added > cutoff
+        )
+        with self._lock:
+            for added, key in entries[-self.max_entries :]:
+                self._entries.setdefault(key, added)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self) -> None:
+        """
+        Writes the cache to its file (atomically), if it has one.
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            stored = dict(self._entries)
+        temporary_path = "{}.{}.tmp".format(self.path, os.getpid())
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(temporary_path, "w") as ofp:
+                json.dump(stored, ofp)
+            os.replace(temporary_path, self.path)
+        except OSError:
+            pass
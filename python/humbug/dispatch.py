@@ -0,0 +1,655 @@
+"""
+This module implements the background machinery Humbug uses to deliver reports to the Bugout API.
+"""
+from collections import deque
+from dataclasses import dataclass, replace
+import heapq
+import itertools
+import os
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .redaction import Redactor
+from .serialization import Serializer, default_serializer
+
+# Each priority has its own lane in a Dispatcher. Deliveries with a lower priority value are always
+# sent first, and deliveries with the highest priority value are the first to be shed when a
+# dispatcher is full.
+PRIORITY_ERROR = 0
+PRIORITY_LOGGING = 1
+PRIORITY_DEFAULT = 2
+PRIORITIES = (PRIORITY_ERROR, PRIORITY_LOGGING, PRIORITY_DEFAULT)
+
+
+@dataclass
+class Delivery:
+    """
+    A single HTTP request that delivers a report to the Bugout API. The body is encoded by the
+    delivery's serializer when it is sent (by default, as JSON).
+
+    If the delivery has an idempotency key, it is sent in the Idempotency-Key header, so that the
+    backend can recognize the same report delivered more than once. on_sent, if set, is called
+    after the request succeeds.
+
+    If the delivery has a redactor, the body is redacted (once) before it is sent or spooled, so
+    that the cost of redaction is paid by the dispatcher's workers rather than by the threads that
+    publish reports.
+    """
+
+    url: str
+    headers: Dict[str, str]
+    body: Dict[str, Any]
+    timeout: float
+    priority: int = PRIORITY_DEFAULT
+    submitted_at: float = 0.0
+    serializer: Optional[Serializer] = None
+    idempotency_key: Optional[str] = None
+    on_sent: Optional[Callable[["Delivery"], Any]] = None
+    redactor: Optional[Redactor] = None
+
+    def redact(self) -> None:
+        if self.redactor is not None:
+            self.redactor.redact_body(self.body)
+            self.redactor = None
+
+
+@dataclass
+class LaneStats:
+    """
+    Statistics for a single priority lane of a Dispatcher. Latencies are measured in seconds from
+    the time a delivery is submitted to the time its request completes.
+    """
+
+    submitted: int = 0
+    sent: int = 0
+    shed: int = 0
+    hedged: int = 0
+    latency: float = 0.0
+    max_latency: float = 0.0
+
+    def observe(self, latency: float) -> None:
+        if self.sent == 0:
+            self.latency = latency
+        else:
+            self.latency = 0.8 * self.latency + 0.2 * latency
+        self.max_latency = max(self.max_latency, latency)
+        self.sent += 1
+
+
+class LatencyEstimator:
+    """
+    Estimates quantiles of send latency (in seconds) from the last window observations. No estimate
+    is made until min_samples latencies have been observed.
+    """
+
+    def __init__(self, window: int = 256, min_samples: int = 20) -> None:
+        self.min_samples = min_samples
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._sorted: Optional[List[float]] = None
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+    def observe(self, latency: float) -> None:
+        self._latencies.append(latency)
+        self._sorted = None
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self._latencies) < self.min_samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._latencies)
+        index = min(len(self._sorted) - 1, int(q * len(self._sorted)))
+        return self._sorted[index]
+
+
+def send(
+    delivery: Delivery,
+    session: Optional[requests.Session] = None,
+    timeout: Optional[float] = None,
+) -> None:
+    """
+    Performs the HTTP request described by the given delivery, over the given session's connection
+    pool if one is provided. The request times out after timeout seconds, or after the delivery's
+    own timeout if none is given. Raises an exception if the request fails, including when the
+    response has an error status.
+    """
+    delivery.redact()
+    serializer = delivery.serializer
+    if serializer is None:
+        serializer = default_serializer()
+    headers = {**delivery.headers, "Content-Type": serializer.content_type}
+    if delivery.idempotency_key is not None:
+        headers["Idempotency-Key"] = delivery.idempotency_key
+    poster = requests.post if session is None else session.post
+    response = poster(
+        url=delivery.url,
+        headers=headers,
+        data=serializer.dumps(delivery.body),
+        timeout=delivery.timeout if timeout is None else timeout,
+    )
+    response.raise_for_status()
+    if delivery.on_sent is not None:
+        delivery.on_sent(delivery)
+
+
+class Dispatcher:
+    """
+    Dispatcher sends deliveries from a pool of background daemon threads.
+
+    Deliveries are queued in one lane per priority (see PRIORITIES). Workers always pick up the
+    oldest delivery from the highest-priority non-empty lane, so error reports are never stuck behind
+    usage reports. At most max_pending deliveries are queued at a time. When a dispatcher is full,
+    the oldest delivery in the lowest-priority lane is shed to make room for a delivery of higher
+    priority; a delivery which has no lower-priority delivery to displace is shed itself.
+
+    The pool scales between min_workers and max_workers threads. A new worker is started when the
+    backlog of deliveries that no idle worker can pick up would take the current workers longer
+    than scale_up_seconds to clear, as estimated from a moving average of observed send latency.
+    Workers which have been idle for idle_timeout_seconds exit, down to min_workers - by default,
+    an idle process holds no reporter threads at all.
+
+    Within a lane, deliveries are picked up in the order in which they were submitted, but with more
+    than one worker they may complete out of order.
+
+    All workers share a single requests.Session, so connections to the Bugout API are pooled and
+    reused across deliveries.
+
+    If thread_buffers is set, submit() does not take the dispatcher's lock: each thread appends its
+    deliveries to a buffer of its own, and a background drainer thread moves the deliveries from all
+    buffers into the lanes every drain_interval_seconds, taking the lock once per batch. This keeps
+    many threads which publish at once from contending for the lock, at the cost of up to
+    drain_interval_seconds of extra latency per delivery. The drainer exits after
+    idle_timeout_seconds without deliveries, and is restarted by the next submit().
+
+    If adaptive_timeouts is set, requests time out after timeout_factor times the 99th percentile of
+    recently successful send latencies, clamped between min_timeout_seconds and the delivery's own
+    timeout, so that a degraded backend does not hold every worker for the full timeout. If
+    hedge_errors is set, a second, identical request is scheduled for an error report when its first
+    request is sent, and is sent by another worker if the first request has not completed within the
+    95th percentile of successful send latency. Hedged error reports may be recorded twice.
+
+    Worker threads are daemon threads so that they never hold up interpreter shutdown. Reports
+    that are still pending when the process exits are handled by the process-wide shutdown
+    coordinator (see humbug.shutdown).
+    """
+
+    def __init__(
+        self,
+        thread_name: str = "humbug_reporter",
+        min_workers: int = 0,
+        max_workers: int = 4,
+        idle_timeout_seconds: float = 5.0,
+        scale_up_seconds: float = 0.5,
+        max_pending: int = 10000,
+        adaptive_timeouts: bool = False,
+        timeout_factor: float = 3.0,
+        min_timeout_seconds: float = 1.0,
+        hedge_errors: bool = False,
+        thread_buffers: bool = False,
+        drain_interval_seconds: float = 0.01,
+    ) -> None:
+        self.thread_name = thread_name
+        self.min_workers = min_workers
+        self.max_workers = max(1, max_workers, min_workers)
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.scale_up_seconds = scale_up_seconds
+        self.max_pending = max_pending
+        self.adaptive_timeouts = adaptive_timeouts
+        self.timeout_factor = timeout_factor
+        self.min_timeout_seconds = min_timeout_seconds
+        self.hedge_errors = hedge_errors
+        self.thread_buffers = thread_buffers
+        self.drain_interval_seconds = drain_interval_seconds
+        # Exponentially weighted moving average of send latency, in seconds. Until the first send
+        # completes, it is assumed to be scale_up_seconds.
+        self._latency = scale_up_seconds
+        self._reset()
+        _dispatchers.add(self)
+
+    def _reset(self) -> None:
+        """
+        Initializes the dispatcher's queues, worker bookkeeping, locks, and connection pool.
+        """
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        # Workers wait on _work_available for deliveries; flush() waits on _work_done.
+        self._work_available = threading.Condition(self._lock)
+        self._work_done = threading.Condition(self._lock)
+        self._lanes: Dict[int, Deque[Delivery]] = {
+            priority: deque() for priority in PRIORITIES
+        }
+        self._lane_stats: Dict[int, LaneStats] = {
+            priority: LaneStats() for priority in PRIORITIES
+        }
+        self._latencies = LatencyEstimator()
+        # Hedged requests which have been scheduled but not yet sent, as a heap of (time at which to
+        # send, sequence number, hedge) triples.
+        self._hedges: List[Tuple[float, int, _Hedge]] = []
+        self._hedge_sequence = itertools.count()
+        self._num_pending = 0
+        self._in_flight = 0
+        self._workers = 0
+        self._worker_sequence = 0
+
+        # Per-thread buffers of submitted deliveries (if thread_buffers is set), registered with the
+        # thread that owns them so that the buffers of finished threads can be forgotten.
+        self._local = threading.local()
+        self._buffers_lock = threading.Lock()
+        self._buffers: List[Tuple[threading.Thread, Deque[Delivery]]] = []
+        self._drainer: Optional[threading.Thread] = None
+
+        with self._lock:
+            while self._workers < self.min_workers:
+                self._start_worker()
+
+    def _after_fork_in_child(self) -> None:
+        """
+        A forked child inherits the dispatcher's state but none of its worker threads. Its locks may
+        have been held by those threads at the time of the fork, and its pending deliveries and
+        pooled connections still belong to the parent. The child starts over with an empty
+        dispatcher of its own.
+        """
+        self._reset()
+
+    def workers(self) -> int:
+        """
+        Number of worker threads currently running.
+        """
+        with self._lock:
+            return self._workers
+
+    def latency(self) -> float:
+        """
+        Moving average of the time (in seconds) each delivery has taken to send.
+        """
+        with self._lock:
+            return self._latency
+
+    def timeout(self, delivery: Delivery) -> float:
+        """
+        The timeout (in seconds) with which the given delivery would be sent right now.
+        """
+        with self._lock:
+            return self._timeout(delivery)
+
+    def _timeout(self, delivery: Delivery) -> float:
+        # Must be called with self._lock held.
+        if not self.adaptive_timeouts:
+            return delivery.timeout
+        p99 = self._latencies.quantile(0.99)
+        if p99 is None:
+            return delivery.timeout
+        return min(
+            delivery.timeout, max(self.min_timeout_seconds, p99 * self.timeout_factor)
+        )
+
+    def _hedge_after(self, delivery: Delivery) -> Optional[float]:
+        # Must be called with self._lock held.
+        if not self.hedge_errors or delivery.priority != PRIORITY_ERROR:
+            return None
+        return self._latencies.quantile(0.95)
+
+    def stats(self) -> Dict[int, LaneStats]:
+        """
+        Returns a snapshot of the statistics for each priority lane.
+        """
+        with self._lock:
+            return {
+                priority: replace(lane_stats)
+                for priority, lane_stats in self._lane_stats.items()
+            }
+
+    def submit(self, delivery: Delivery) -> None:
+        if delivery.priority not in self._lanes:
+            delivery.priority = PRIORITY_DEFAULT
+        delivery.submitted_at = time.monotonic()
+        if self.thread_buffers:
+            self._buffer().append(delivery)
+            if self._drainer is None:
+                self._start_drainer()
+            return
+        with self._lock:
+            if self._enqueue(delivery):
+                self._work_available.notify()
+
+    def _enqueue(self, delivery: Delivery) -> bool:
+        """
+        Adds a delivery to its lane, shedding a delivery if the dispatcher is full. Returns False if
+        the delivery itself was shed.
+
+        Must be called with self._lock held.
+        """
+        self._lane_stats[delivery.priority].submitted += 1
+        if self._num_pending >= self.max_pending and not self._shed(delivery.priority):
+            self._lane_stats[delivery.priority].shed += 1
+            return False
+        self._lanes[delivery.priority].append(delivery)
+        self._num_pending += 1
+        if self._should_add_worker():
+            self._start_worker()
+        return True
+
+    def _buffer(self) -> Deque[Delivery]:
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            buffer = deque()
+            self._local.buffer = buffer
+            with self._buffers_lock:
+                self._buffers.append((threading.current_thread(), buffer))
+        return buffer
+
+    def _start_drainer(self) -> None:
+        with self._buffers_lock:
+            if self._drainer is not None:
+                return
+            drainer = threading.Thread(
+                target=self._run_drainer,
+                name="{}_drainer".format(self.thread_name),
+                daemon=True,
+            )
+            try:
+                drainer.start()
+            except RuntimeError:
+                # Buffered deliveries are merged by the next flush() or drain() (see _start_worker).
+                return
+            self._drainer = drainer
+
+    def _run_drainer(self) -> None:
+        idle_since = time.monotonic()
+        while True:
+            time.sleep(self.drain_interval_seconds)
+            if self._merge_buffers():
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= self.idle_timeout_seconds:
+                with self._buffers_lock:
+                    self._drainer = None
+                # A thread which submitted a delivery before the drainer was unset did not start a
+                # new drainer, so its delivery must be merged here.
+                self._merge_buffers()
+                return
+
+    def _merge_buffers(self) -> int:
+        """
+        Moves the deliveries from every thread's buffer into the lanes, in the order in which they
+        were submitted, and forgets the empty buffers of threads which have finished. Returns the
+        number of deliveries moved.
+
+        Deliveries are taken out of the buffers and added to the lanes under self._lock, so that
+        pending(), flush() and drain() never miss a delivery which is in neither. Threads which
+        submit deliveries do not take the lock, so holding it for the batch only delays the workers.
+        """
+        with self._lock:
+            with self._buffers_lock:
+                buffers = list(self._buffers)
+            batch: List[Delivery] = []
+            for _, buffer in buffers:
+                while True:
+                    try:
+                        batch.append(buffer.popleft())
+                    except IndexError:
+                        break
+            batch.sort(key=lambda delivery: delivery.submitted_at)
+            for delivery in batch:
+                self._enqueue(delivery)
+            if batch:
+                self._work_available.notify(len(batch))
+        if any(not thread.is_alive() for thread, _ in buffers):
+            with self._buffers_lock:
+                self._buffers = [
+                    (thread, buffer)
+                    for thread, buffer in self._buffers
+                    if thread.is_alive() or buffer
+                ]
+        return len(batch)
+
+    def _shed(self, priority: int) -> bool:
+        """
+        Drops the oldest delivery from the lowest-priority non-empty lane if that lane has a lower
+        priority than the given one. Returns True if a delivery was dropped.
+
+        Must be called with self._lock held.
+        """
+        for lane_priority in reversed(PRIORITIES):
+            if lane_priority <= priority:
+                return False
+            lane = self._lanes[lane_priority]
+            if lane:
+                lane.popleft()
+                self._num_pending -= 1
+                self._lane_stats[lane_priority].shed += 1
+                return True
+        return False
+
+    def _next_delivery(self) -> Optional[Delivery]:
+        # Must be called with self._lock held.
+        for priority in PRIORITIES:
+            lane = self._lanes[priority]
+            if lane:
+                self._num_pending -= 1
+                return lane.popleft()
+        return None
+
+    def _schedule_hedge(self, delivery: Delivery, hedge_after: float) -> "_Hedge":
+        """
+        Schedules a second request for the given delivery in hedge_after seconds, and makes sure
+        that a worker other than the calling one will be around to send it.
+
+        Must be called with self._lock held.
+        """
+        hedge = _Hedge(replace(delivery))
+        heapq.heappush(
+            self._hedges,
+            (time.monotonic() + hedge_after, next(self._hedge_sequence), hedge),
+        )
+        if self._workers - self._in_flight <= 0 and self._workers < self.max_workers:
+            self._start_worker()
+        # Idle workers recompute how long to wait for.
+        self._work_available.notify()
+        return hedge
+
+    def _next_hedge(self) -> Optional["_Hedge"]:
+        # Must be called with self._lock held.
+        now = time.monotonic()
+        while self._hedges:
+            send_at, _, hedge = self._hedges[0]
+            if not hedge.cancelled and send_at > now:
+                return None
+            heapq.heappop(self._hedges)
+            if not hedge.cancelled:
+                self._lane_stats[hedge.delivery.priority].hedged += 1
+                return hedge
+        return None
+
+    def _wait_seconds(self) -> float:
+        # Must be called with self._lock held.
+        if not self._hedges:
+            return self.idle_timeout_seconds
+        return max(
+            0.0, min(self.idle_timeout_seconds, self._hedges[0][0] - time.monotonic())
+        )
+
+    def _settle(self, delivery: Delivery, hedge: Optional["_Hedge"]) -> None:
+        """
+        Records that the given delivery has completed - once, even if it was hedged and both of its
+        requests complete.
+
+        Must be called with self._lock held.
+        """
+        if hedge is not None:
+            if hedge.settled:
+                return
+            hedge.settled = True
+        self._lane_stats[delivery.priority].observe(
+            time.monotonic() - delivery.submitted_at
+        )
+        self._in_flight -= 1
+
+    def _should_add_worker(self) -> bool:
+        # Must be called with self._lock held.
+        if self._workers < self.min_workers:
+            return True
+        if self._workers >= self.max_workers:
+            return False
+        idle_workers = self._workers - self._in_flight
+        backlog = self._num_pending - idle_workers
+        if backlog <= 0:
+            return False
+        if self._workers == 0:
+            return True
+        return backlog * self._latency / self._workers > self.scale_up_seconds
+
+    def _start_worker(self) -> None:
+        # Must be called with self._lock held.
+        self._worker_sequence += 1
+        worker = threading.Thread(
+            target=self._run,
+            name="{}_{}".format(self.thread_name, self._worker_sequence),
+            daemon=True,
+        )
+        try:
+            worker.start()
+        except RuntimeError:
+            # No new threads can be started, for example while the interpreter shuts down (from
+            # Python 3.12 on). Queued deliveries are left to running workers or to the shutdown
+            # coordinator, which sends them from its own thread.
+            return
+        self._workers += 1
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                hedge = self._next_hedge()
+                delivery = None if hedge is None else hedge.delivery
+                if delivery is None:
+                    delivery = self._next_delivery()
+                while delivery is None:
+                    idle = not self._work_available.wait(self._wait_seconds())
+                    hedge = self._next_hedge()
+                    delivery = None if hedge is None else hedge.delivery
+                    if delivery is None:
+                        delivery = self._next_delivery()
+                    if (
+                        delivery is None
+                        and idle
+                        and not self._hedges
+                        and self._workers > self.min_workers
+                    ):
+                        self._workers -= 1
+                        return
+                timeout = self._timeout(delivery)
+                is_hedge = hedge is not None
+                hedge_after = None
+                if not is_hedge:
+                    # A hedged request does not count as a delivery of its own: the delivery was
+                    # already counted in flight when its first request was sent.
+                    self._in_flight += 1
+                    hedge_after = self._hedge_after(delivery)
+            if not is_hedge and hedge_after is not None:
+                # The hedge shares the delivery's body, so the body is redacted first.
+                delivery.redact()
+                with self._lock:
+                    hedge = self._schedule_hedge(delivery, hedge_after)
+            started = time.monotonic()
+            succeeded = False
+            try:
+                send(delivery, self.session, timeout)
+                succeeded = True
+            except Exception:
+                pass
+            finally:
+                finished = time.monotonic()
+                with self._lock:
+                    self._latency = 0.8 * self._latency + 0.2 * (finished - started)
+                    # Only successful requests inform timeouts and hedging, so that failures (which
+                    # may be fast errors or timeouts) do not skew the estimate.
+                    if succeeded:
+                        self._latencies.observe(finished - started)
+                    if not is_hedge:
+                        if hedge is not None:
+                            hedge.cancelled = True
+                        self._settle(delivery, hedge)
+                    elif succeeded:
+                        # The delivery completes as soon as either of its requests succeeds.
+                        self._settle(delivery, hedge)
+                    self._work_done.notify_all()
+
+    def pending(self) -> int:
+        """
+        Number of deliveries which have been submitted but not yet completed.
+        """
+        with self._lock:
+            with self._buffers_lock:
+                buffered = sum(len(buffer) for _, buffer in self._buffers)
+            return buffered + self._num_pending + self._in_flight
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until every submitted delivery has completed or until the timeout (in seconds)
+        expires. Returns True if all deliveries completed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._merge_buffers()
+        with self._lock:
+            while self._num_pending or self._in_flight:
+                if deadline is None:
+                    self._work_done.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._work_done.wait(remaining)
+        return True
+
+    def drain(self) -> List[Delivery]:
+        """
+        Removes and returns all deliveries which have not yet been picked up by a worker thread, in
+        priority order. Deliveries which are already in flight are left alone.
+        """
+        deliveries: List[Delivery] = []
+        self._merge_buffers()
+        with self._lock:
+            for priority in PRIORITIES:
+                deliveries.extend(self._lanes[priority])
+                self._lanes[priority].clear()
+            self._num_pending = 0
+            self._work_done.notify_all()
+        return deliveries
+
+
+class _Hedge:
+    """
+    A second request for a delivery whose first request is slow. The original delivery and the
+    hedge share a body, so the body is redacted before the hedge is scheduled.
+    """
+
+    __slots__ = ("delivery", "cancelled", "settled")
+
+    def __init__(self, delivery: Delivery) -> None:
+        self.delivery = delivery
+        # Set when the first request completes, so that the hedge is not sent if it has not been
+        # already.
+        self.cancelled = False
+        # Set when the delivery has been counted as completed by one of its requests.
+        self.settled = False
+
+
+_dispatchers: "weakref.WeakSet[Dispatcher]" = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    for dispatcher in list(_dispatchers):
+        dispatcher._after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,153 @@
+"""
+This module implements the monitor Humbug uses to detect asyncio event loops which are blocked by
+the code running on them.
+"""
+import asyncio
+from bisect import bisect_right
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .profiling import frame_label
+
+LAG_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+MAX_STACK_DEPTH = 64
+
+
+class LoopMonitor:
+    """
+    LoopMonitor measures how late an asyncio event loop runs its callbacks, and detects stalls in
+    which the loop is blocked altogether.
+
+    A probe callback is scheduled on the loop every probe_interval_seconds. Each time it runs, it
+    records how late it ran in a histogram (see LAG_BUCKETS_MS) and reschedules itself - it does
+    nothing else, so the loop barely notices it.
+
+    A watchdog daemon thread checks on the probe. If the probe is overdue by more than
+    stall_threshold_seconds, the watchdog captures the stack of the loop's thread (which shows the
+    code blocking the loop) and calls on_stall with a description of the stall. on_stall is called at
+    most once per stall and at most once every min_report_interval_seconds, and always from the
+    watchdog thread.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        on_stall: Callable[[Dict[str, Any]], Any],
+        probe_interval_seconds: float = 0.1,
+        stall_threshold_seconds: float = 1.0,
+        min_report_interval_seconds: float = 60.0,
+    ) -> None:
+        self.loop = loop
+        self.on_stall = on_stall
+        self.probe_interval_seconds = probe_interval_seconds
+        self.stall_threshold_seconds = stall_threshold_seconds
+        self.min_report_interval_seconds = min_report_interval_seconds
+
+        self._counts: List[int] = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self._max_lag = 0.0
+        self._loop_thread_id: Optional[int] = None
+        self._expected: Optional[float] = None
+        self._stall_reported = False
+        self._last_report: Optional[float] = None
+        self._stopped = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Starts probing the loop and watching for stalls. Safe to call from any thread.
+        """
+        self._stopped.clear()
+        self._expected = time.monotonic()
+        self.loop.call_soon_threadsafe(self._probe)
+        if self._watchdog is None or not self._watchdog.is_alive():
+            self._watchdog = threading.Thread(
+                target=self._watch, name="humbug_loop_monitor", daemon=True
+            )
+            self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _probe(self) -> None:
+        if self._stopped.is_set():
+            return
+        now = time.monotonic()
+        if self._loop_thread_id is None:
+            self._loop_thread_id = threading.get_ident()
+        if self._expected is not None:
+            lag = max(0.0, now - self._expected)
+            self._counts[bisect_right(LAG_BUCKETS_MS, lag * 1000)] += 1
+            if lag > self._max_lag:
+                self._max_lag = lag
+        self._stall_reported = False
+        self._expected = now + self.probe_interval_seconds
+        self.loop.call_later(self.probe_interval_seconds, self._probe)
+
+    def histogram(self) -> Dict[str, Any]:
+        """
+        Returns the number of probes which ran with lags (in milliseconds) in each bucket, and the
+        largest lag observed so far.
+        """
+        counts = list(self._counts)
+        labels = ["<{}".format(LAG_BUCKETS_MS[0])]
+        labels.extend(
+            "{}-{}".format(low, high)
+            for low, high in zip(LAG_BUCKETS_MS, LAG_BUCKETS_MS[1:])
+        )
+        labels.append(">={}".format(LAG_BUCKETS_MS[-1]))
+        return {
+            "buckets_ms": dict(zip(labels, counts)),
+            "probes": sum(counts),
+            "max_lag_ms": int(self._max_lag * 1000),
+        }
+
+    def _watch(self) -> None:
+        check_interval = min(self.probe_interval_seconds, self.stall_threshold_seconds)
+        while not self._stopped.wait(check_interval):
+            expected = self._expected
+            if expected is None or self._stall_reported:
+                continue
+            blocked = time.monotonic() - expected
+            if blocked < self.stall_threshold_seconds:
+                continue
+            if self.loop.is_closed():
+                return
+            # A loop which is not running at all (for example, between calls to
+            # run_until_complete) is not blocked.
+            if not self.loop.is_running():
+                continue
+            now = time.monotonic()
+            if (
+                self._last_report is not None
+                and now - self._last_report < self.min_report_interval_seconds
+            ):
+                continue
+            self._stall_reported = True
+            self._last_report = now
+            fields = {
+                "user_time": int(time.time()),
+                "blocked_ms": int(blocked * 1000),
+                "threshold_ms": int(self.stall_threshold_seconds * 1000),
+                "stack": self._loop_stack(),
+                "lag_histogram": self.histogram(),
+            }
+            try:
+                self.on_stall(fields)
+            except Exception:
+                pass
+
+    def _loop_stack(self) -> List[str]:
+        """
+        The stack of the loop's thread, from outermost to innermost frame.
+        """
+        if self._loop_thread_id is None:
+            return []
+        frame = sys._current_frames().get(self._loop_thread_id)
+        labels: List[str] = []
+        while frame is not None and len(labels) < MAX_STACK_DEPTH:
+            labels.append(frame_label(frame))
+            frame = frame.f_back
+        labels.reverse()
+        return labels
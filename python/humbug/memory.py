@@ -0,0 +1,239 @@
+"""
+This module implements the memory measurements (RSS, garbage collector statistics, and tracemalloc
+allocation profiles) that Humbug includes in memory reports, and the background monitor which
+generates those reports on demand, on a signal, or when RSS crosses a threshold.
+"""
+import gc
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+import weakref
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore
+
+MAX_LOCATION_LENGTH = 200
+
+TRIGGER_API = "api"
+TRIGGER_SIGNAL = "signal"
+TRIGGER_RSS = "rss"
+
+
+def rss_bytes() -> Optional[int]:
+    """
+    Current resident set size of this process, in bytes, or None if it cannot be determined on this
+    platform.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """
+    Peak resident set size of this process, in bytes, or None if it cannot be determined on this
+    platform.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes everywhere else.
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+
+def gc_stats() -> Dict[str, Any]:
+    """
+    Per-generation garbage collector statistics: the current allocation counts, and the number of
+    collections, collected objects, and uncollectable objects so far.
+    """
+    return {
+        "counts": list(gc.get_count()),
+        "thresholds": list(gc.get_threshold()),
+        "generations": gc.get_stats(),
+    }
+
+
+class AllocationTracker:
+    """
+    AllocationTracker summarizes tracemalloc snapshots. Each summary lists the top allocation sites
+    by change in size and by change in number of allocations since the previous summary (or by
+    absolute size and count, for the first summary).
+
+    At most top_n sites are listed in each ranking, and each site's location is truncated to
+    MAX_LOCATION_LENGTH characters, so that a summary has a bounded size.
+    """
+
+    def __init__(self, top_n: int = 10) -> None:
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        self._previous: Optional[tracemalloc.Snapshot] = None
+
+    def summary(self) -> Optional[Dict[str, Any]]:
+        """
+        Takes a tracemalloc snapshot and summarizes it against the previous one. Returns None if
+        tracemalloc is not tracing.
+        """
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            )
+        )
+        traced, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            previous = self._previous
+            self._previous = snapshot
+
+        # Snapshot statistics (for the first summary) and statistic diffs have the same shape.
+        statistics: List[Any]
+        by_size: List[Any]
+        by_count: List[Any]
+        if previous is None:
+            statistics = snapshot.statistics("lineno")
+            by_size = statistics[: self.top_n]
+            by_count = sorted(statistics, key=lambda stat: stat.count, reverse=True)
+        else:
+            statistics = snapshot.compare_to(previous, "lineno")
+            by_size = statistics[: self.top_n]
+            by_count = sorted(
+                statistics,
+                key=lambda stat: (abs(stat.count_diff), stat.count),
+                reverse=True,
+            )
+        return {
+            "traced_bytes": traced,
+            "peak_traced_bytes": peak,
+            "compared_to_previous": previous is not None,
+            "top_by_size": [self._site(stat) for stat in by_size],
+            "top_by_count": [self._site(stat) for stat in by_count[: self.top_n]],
+        }
+
+    def _site(self, stat: Any) -> Dict[str, Any]:
+        frame = stat.traceback[0]
+        location = "{}:{}".format(frame.filename, frame.lineno)
+        return {
+            "location": location[-MAX_LOCATION_LENGTH:],
+            "size": stat.size,
+            "size_diff": getattr(stat, "size_diff", stat.size),
+            "count": stat.count,
+            "count_diff": getattr(stat, "count_diff", stat.count),
+        }
+
+
+class MemoryMonitor:
+    """
+    MemoryMonitor calls on_trigger (with the name of the trigger - see TRIGGER_API, TRIGGER_SIGNAL
+    and TRIGGER_RSS) from a background daemon thread whenever a memory report is requested.
+
+    Reports can be requested by calling request(), by sending the process the signal passed to
+    install_signal_handler(), or (if rss_threshold_bytes is set) automatically, whenever RSS is
+    found above the threshold. The RSS trigger fires at most once every cooldown_seconds.
+
+    Requests are only flagged where they are made, so that signal handlers and the threads which
+    call request() never do any work. The monitor thread picks them up within poll_interval_seconds.
+    All the work of generating a report (snapshotting, diffing, formatting, and publishing) happens
+    in on_trigger, on the monitor thread.
+
+    The monitor thread does not survive a fork. In a forked child, call start() to restart it.
+    """
+
+    def __init__(
+        self,
+        on_trigger: Callable[[str], Any],
+        rss_threshold_bytes: Optional[int] = None,
+        poll_interval_seconds: float = 1.0,
+        cooldown_seconds: float = 300.0,
+    ) -> None:
+        self.on_trigger = on_trigger
+        self.rss_threshold_bytes = rss_threshold_bytes
+        self.poll_interval_seconds = poll_interval_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self._requested: List[str] = []
+        self._last_rss_trigger: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        _monitors.add(self)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="humbug_memory_monitor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def request(self, trigger: str = TRIGGER_API) -> None:
+        """
+        Requests a memory report. This only flags the request, and is safe to call from a signal
+        handler.
+        """
+        self._requested.append(trigger)
+
+    def install_signal_handler(self, signum: int) -> None:
+        """
+        Requests a memory report whenever the process receives the given signal (for example,
+        signal.SIGUSR2). Must be called from the main thread.
+        """
+        signal.signal(signum, lambda *_: self.request(TRIGGER_SIGNAL))
+
+    def _rss_exceeded(self) -> bool:
+        if self.rss_threshold_bytes is None:
+            return False
+        now = time.monotonic()
+        if (
+            self._last_rss_trigger is not None
+            and now - self._last_rss_trigger < self.cooldown_seconds
+        ):
+            return False
+        rss = rss_bytes()
+        if rss is None or rss < self.rss_threshold_bytes:
+            return False
+        self._last_rss_trigger = now
+        return True
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.poll_interval_seconds):
+            triggers = []
+            while self._requested:
+                triggers.append(self._requested.pop(0))
+            if self._rss_exceeded():
+                triggers.append(TRIGGER_RSS)
+            # Repeated requests made between polls are served by a single report.
+            for trigger in dict.fromkeys(triggers):
+                try:
+                    self.on_trigger(trigger)
+                except Exception:
+                    pass
+
+    def _after_fork_in_child(self) -> None:
+        self._thread = None
+        self._requested = []
+
+
+_monitors: "weakref.WeakSet[MemoryMonitor]" = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    for monitor in list(_monitors):
+        monitor._after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
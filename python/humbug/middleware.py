@@ -0,0 +1,373 @@
+"""
+This module implements WSGI and ASGI middleware which aggregate request latencies and response
+statuses per route, and capture unhandled exceptions, for Humbug reporters.
+"""
+from bisect import bisect_right
+from collections import Counter
+from functools import lru_cache
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+import weakref
+
+from .cardinality import CardinalityLimiter
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Numeric IDs, hexadecimal IDs (UUIDs, hashes) and dates, and long tokens - each with a digit.
+_ID_SEGMENT = re.compile(r"^(?=.*\d)(?:[0-9a-fA-F-]{8,}|\d+|[0-9A-Za-z_-]{20,})$")
+
+
+@lru_cache(maxsize=1024)
+def default_route(method: str, path: str) -> str:
+    """
+    Groups requests by method and path, with every path segment that looks like an identifier
+    (numbers, UUIDs, hashes, dates, long tokens) replaced by "{id}". For example,
+    "GET /api/v1/users/42/posts" becomes "GET /api/v1/users/{id}/posts". The routes of recently
+    requested paths are cached.
+    """
+    segments = [
+        "{id}" if _ID_SEGMENT.match(segment) else segment for segment in path.split("/")
+    ]
+    return "{} {}".format(method, "/".join(segments))
+
+
+class RouteStats:
+    """
+    Request count, latency histogram (see LATENCY_BUCKETS_MS), and response status counts for a
+    single route.
+    """
+
+    __slots__ = ("count", "total_ms", "max_ms", "buckets", "statuses")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.statuses: Counter = Counter()
+
+    def observe(self, duration_ms: float, status: int) -> None:
+        self.count += 1
+        self.total_ms += duration_ms
+        if duration_ms > self.max_ms:
+            self.max_ms = duration_ms
+        self.buckets[bisect_right(LATENCY_BUCKETS_MS, duration_ms)] += 1
+        self.statuses[status] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        labels = ["<{}".format(LATENCY_BUCKETS_MS[0])]
+        labels.extend(
+            "{}-{}".format(low, high)
+            for low, high in zip(LATENCY_BUCKETS_MS, LATENCY_BUCKETS_MS[1:])
+        )
+        labels.append(">={}".format(LATENCY_BUCKETS_MS[-1]))
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "max_ms": self.max_ms,
+            "buckets_ms": {
+                label: count for label, count in zip(labels, self.buckets) if count
+            },
+            "statuses": {
+                str(status): count for status, count in sorted(self.statuses.items())
+            },
+        }
+
+
+class RequestMetrics:
+    """
+    RequestMetrics aggregates request latencies and response statuses per route in memory. Every
+    flush_interval_seconds, a background daemon thread calls on_flush with the metrics aggregated
+    since the previous flush (if any requests were observed) and starts over.
+
+    observe() only updates a few counters under a lock, so it adds microseconds to each request;
+    on_flush is only ever called from the background thread or from flush().
+
+    At most max_routes distinct routes are tracked; requests to any other routes are counted under
+    the route "other". The background thread is started on the first observation (and again, after
+    a fork, on the first observation in the child).
+    """
+
+    def __init__(
+        self,
+        on_flush: Callable[[Dict[str, Any]], Any],
+        flush_interval_seconds: float = 60.0,
+        max_routes: int = 100,
+    ) -> None:
+        self.on_flush = on_flush
+        self.flush_interval_seconds = flush_interval_seconds
+        self.routes = CardinalityLimiter(max_distinct_values=max_routes)
+        self._stopped = threading.Event()
+        self._reset()
+        _metrics.add(self)
+
+    def _reset(self) -> None:
+        self._lock = threading.Lock()
+        self._stats: Dict[str, RouteStats] = {}
+        self._started_at = int(time.time())
+        self._started = time.monotonic()
+        self._thread: Optional[threading.Thread] = None
+
+    def _after_fork_in_child(self) -> None:
+        # Requests served by the parent are reported by the parent.
+        self._reset()
+
+    def limit_route(self, route: str) -> str:
+        """
+        Returns the name under which requests to the given route are counted: the route itself, or
+        "other" once max_routes routes are being tracked.
+        """
+        return self.routes.value("route", route)
+
+    def observe(self, route: str, duration_ms: float, status: int) -> None:
+        """
+        Records a request to a route (as returned by limit_route) which took duration_ms and was
+        answered with the given status.
+        """
+        with self._lock:
+            stats = self._stats.get(route)
+            if stats is None:
+                stats = RouteStats()
+                self._stats[route] = stats
+            stats.observe(duration_ms, status)
+        if self._thread is None:
+            self.start()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="humbug_request_metrics", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the background thread. Metrics observed since the last flush are kept until the next
+        call to flush().
+        """
+        self._stopped.set()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.flush_interval_seconds):
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Passes the metrics aggregated since the previous flush, if there are any, to on_flush.
+        """
+        now = time.monotonic()
+        with self._lock:
+            stats, self._stats = self._stats, {}
+            started_at, self._started_at = self._started_at, int(time.time())
+            started, self._started = self._started, now
+        if not stats:
+            return
+        fields = {
+            "started_at": started_at,
+            "duration_ms": int((now - started) * 1000),
+            "requests": sum(route_stats.count for route_stats in stats.values()),
+            "routes": {route: stats[route].summary() for route in sorted(stats)},
+        }
+        try:
+            self.on_flush(fields)
+        except Exception:
+            pass
+
+
+class HumbugWSGIMiddleware:
+    """
+    WSGI middleware which records the latency (until the server closes the response, after its body
+    has been produced) and response status of every request in a RequestMetrics, and passes
+    unhandled exceptions - whether raised by the application itself or while its response body is
+    produced - to on_exception, with "site:wsgi", "route:<route>" and tags, before re-raising them.
+
+    on_exception should only queue the exception (see HumbugReporter.wsgi_middleware), so that no
+    request waits on a report being sent.
+
+    route, if given, maps a WSGI environ to the name of the route it should be counted under. By
+    default, requests are grouped by default_route.
+    """
+
+    def __init__(
+        self,
+        app: Callable,
+        metrics: RequestMetrics,
+        on_exception: Callable[[BaseException, List[str]], Any],
+        route: Optional[Callable[[Dict[str, Any]], str]] = None,
+        tags: Optional[List[str]] = None,
+    ) -> None:
+        self.app = app
+        self.metrics = metrics
+        self.on_exception = on_exception
+        self.route = route
+        self.tags = ["site:wsgi"]
+        if tags is not None:
+            self.tags.extend(tags)
+
+    def _route(self, environ: Dict[str, Any]) -> str:
+        if self.route is not None:
+            return self.route(environ)
+        return default_route(
+            environ.get("REQUEST_METHOD", "GET"),
+            environ.get("SCRIPT_NAME", "") + environ.get("PATH_INFO", ""),
+        )
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable) -> Any:
+        started = time.perf_counter()
+        route = self.metrics.limit_route(self._route(environ))
+        status = [500]
+
+        def _start_response(response_status, headers, exc_info=None):
+            try:
+                status[0] = int(response_status.split(" ", 1)[0])
+            except ValueError:
+                pass
+            return start_response(response_status, headers, exc_info)
+
+        try:
+            iterable = self.app(environ, _start_response)
+        except Exception as error:
+            status[0] = 500
+            self.on_exception(error, [*self.tags, "route:{}".format(route)])
+            self.metrics.observe(
+                route, (time.perf_counter() - started) * 1000, status[0]
+            )
+            raise
+        return _WSGIResponse(self, iterable, route, started, status)
+
+
+class _WSGIResponse:
+    """
+    Wraps the iterable returned by a WSGI application. Applications which return generators only
+    call start_response once iteration begins, so the request is observed when the server closes
+    the response (as WSGI servers must), rather than when the application returns.
+    """
+
+    def __init__(
+        self,
+        middleware: HumbugWSGIMiddleware,
+        iterable: Iterable[bytes],
+        route: str,
+        started: float,
+        status: List[int],
+    ) -> None:
+        self.middleware = middleware
+        self.iterable = iterable
+        self.route = route
+        self.started = started
+        self.status = status
+        self.observed = False
+
+    def _capture(self, error: BaseException) -> None:
+        self.status[0] = 500
+        self.middleware.on_exception(
+            error, [*self.middleware.tags, "route:{}".format(self.route)]
+        )
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            for chunk in self.iterable:
+                yield chunk
+        except Exception as error:
+            self._capture(error)
+            raise
+
+    def close(self) -> None:
+        try:
+            close = getattr(self.iterable, "close", None)
+            if close is not None:
+                close()
+        except Exception as error:
+            self._capture(error)
+            raise
+        finally:
+            if not self.observed:
+                self.observed = True
+                self.middleware.metrics.observe(
+                    self.route,
+                    (time.perf_counter() - self.started) * 1000,
+                    self.status[0],
+                )
+
+
+class HumbugASGIMiddleware:
+    """
+    ASGI middleware which records the latency (until the application has sent its response) and
+    response status of every HTTP request in a RequestMetrics, and passes unhandled exceptions to
+    on_exception, with "site:asgi", "route:<route>" and tags, before re-raising them. Other
+    connections (websockets, lifespan events) are passed through untouched.
+
+    on_exception should only queue the exception (see HumbugReporter.asgi_middleware), so that the
+    event loop never waits on a report being sent.
+
+    route, if given, maps an ASGI scope to the name of the route it should be counted under. By
+    default, requests are grouped by default_route.
+    """
+
+    def __init__(
+        self,
+        app: Callable,
+        metrics: RequestMetrics,
+        on_exception: Callable[[BaseException, List[str]], Any],
+        route: Optional[Callable[[Dict[str, Any]], str]] = None,
+        tags: Optional[List[str]] = None,
+    ) -> None:
+        self.app = app
+        self.metrics = metrics
+        self.on_exception = on_exception
+        self.route = route
+        self.tags = ["site:asgi"]
+        if tags is not None:
+            self.tags.extend(tags)
+
+    def _route(self, scope: Dict[str, Any]) -> str:
+        if self.route is not None:
+            return self.route(scope)
+        return default_route(
+            scope.get("method", "GET"), scope.get("root_path", "") + scope["path"]
+        )
+
+    async def __call__(
+        self, scope: Dict[str, Any], receive: Callable, send: Callable
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        route = self.metrics.limit_route(self._route(scope))
+        status = [500]
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        except Exception as error:
+            status[0] = 500
+            self.on_exception(error, [*self.tags, "route:{}".format(route)])
+            raise
+        finally:
+            self.metrics.observe(
+                route, (time.perf_counter() - started) * 1000, status[0]
+            )
+
+
+_metrics: "weakref.WeakSet[RequestMetrics]" = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    for metrics in list(_metrics):
+        metrics._after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
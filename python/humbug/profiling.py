@@ -0,0 +1,220 @@
+"""
+This module implements the sampling stack profiler Humbug uses to explain slow function calls.
+"""
+from collections import Counter
+from functools import wraps
+import itertools
+import os
+import sys
+import threading
+import time
+from types import FrameType
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import weakref
+
+Stack = Tuple[str, ...]
+SlowCallHandler = Callable[
+    [float, Tuple[Any, ...], Dict[str, Any], List[Tuple[Stack, int]]], None
+]
+
+
+def frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return "{} ({}:{})".format(code.co_name, code.co_filename, frame.f_lineno)
+
+
+class StackSampler:
+    """
+    StackSampler times calls to the callables it watches and, for calls which take longer than a
+    threshold, reports a profile of the stacks those calls were sampled in.
+
+    Each watched call records its thread, its frame, and its start time in a dictionary of active
+    calls, without taking a lock. A single background daemon thread wakes up every
+    interval_seconds and samples the stacks of the active calls which have been running for at least
+    half of their thresholds, so that calls which finish well under their thresholds are never
+    sampled. Only code locations (function names, files and line numbers) are read from the frames
+    of other threads - never their local variables. A call which finishes under its threshold costs
+    two clock reads and two dictionary operations.
+
+    The sampling thread is started by the first watched call, and exits once no watched call has
+    been active for idle_timeout_seconds.
+
+    Only the max_depth innermost frames of each stack are kept, and only the max_stacks most
+    frequently sampled stacks of each call are reported. Sampling is best-effort: calls shorter than
+    interval_seconds are usually not sampled at all.
+    """
+
+    def __init__(
+        self,
+        interval_seconds: float = 0.01,
+        max_depth: int = 32,
+        max_stacks: int = 20,
+        idle_timeout_seconds: float = 60.0,
+    ) -> None:
+        self.interval_seconds = interval_seconds
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self._call_ids = itertools.count()
+        self._reset()
+        _samplers.add(self)
+
+    def _reset(self) -> None:
+        self._lock = threading.Lock()
+        self._running = False
+        # Maps the ID of each running watched call to its thread, its frame, and the time (from
+        # time.perf_counter) from which it is sampled. Watched calls add and remove their own
+        # entries, which is atomic without a lock.
+        self._active: Dict[int, Tuple[int, FrameType, float]] = {}
+        # Maps call IDs to the number of times each stack was sampled in that call.
+        self._samples: Dict[int, Counter] = {}
+
+    def _after_fork_in_child(self) -> None:
+        # The sampling thread does not survive a fork, and the calls it was sampling belong to the
+        # parent.
+        self._reset()
+
+    def watch(
+        self,
+        callable: Callable,
+        threshold_seconds: float,
+        on_slow: SlowCallHandler,
+    ) -> Callable:
+        """
+        Wraps the given callable so that, whenever a call to it takes at least threshold_seconds,
+        on_slow is called with the duration of the call (in seconds), its positional and keyword
+        arguments, and its sampled stacks as (stack, count) pairs, most frequent first. Each stack
+        lists frames from outermost to innermost.
+        """
+        sample_after = threshold_seconds / 2
+
+        def watched(*args, **kwargs):
+            call_id = next(self._call_ids)
+            started = time.perf_counter()
+            self._active[call_id] = (
+                threading.get_ident(),
+                sys._getframe(),
+                started + sample_after,
+            )
+            if not self._running:
+                self._start()
+            try:
+                return callable(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - started
+                del self._active[call_id]
+                if duration >= threshold_seconds:
+                    stacks = self.collect(call_id)
+                    try:
+                        on_slow(duration, args, kwargs, stacks)
+                    except Exception:
+                        pass
+
+        return wraps(callable)(watched)
+
+    def collect(self, call_id: int) -> List[Tuple[Stack, int]]:
+        """
+        Removes and returns the stacks sampled in the given watched call.
+        """
+        with self._lock:
+            counts = self._samples.pop(call_id, None)
+        if not counts:
+            return []
+        return counts.most_common(self.max_stacks)
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        sampler = threading.Thread(
+            target=self._run, name="humbug_stack_sampler", daemon=True
+        )
+        sampler.start()
+
+    def _run(self) -> None:
+        idle_since = time.monotonic()
+        finished: Set[int] = set()
+        while True:
+            time.sleep(self.interval_seconds)
+            finished = self._sample(finished)
+            now = time.monotonic()
+            if self._active:
+                idle_since = now
+            elif now - idle_since >= self.idle_timeout_seconds:
+                with self._lock:
+                    self._running = False
+                    # A watched call which started before _running was unset did not start a new
+                    # sampling thread, so this one keeps running for it.
+                    if self._active:
+                        self._running = True
+                        continue
+                    self._samples.clear()
+                return
+
+    def _sample(self, finished: Set[int]) -> Set[int]:
+        """
+        Takes one sample of the stacks of the watched calls which are due to be sampled. Samples of
+        calls in finished, which had already finished by the previous sample without collecting
+        them, are discarded. Returns the calls which have finished without collecting their samples
+        since.
+        """
+        now = time.perf_counter()
+        active = list(self._active.items())
+        due = [
+            (call_id, ident, watched_frame)
+            for call_id, (ident, watched_frame, sample_from) in active
+            if sample_from <= now
+        ]
+        samples: List[Tuple[int, Stack]] = []
+        if due:
+            frames = sys._current_frames()
+            for call_id, ident, watched_frame in due:
+                labels: List[str] = []
+                frame: Optional[FrameType] = frames.get(ident)
+                while frame is not None and frame is not watched_frame:
+                    if len(labels) < self.max_depth:
+                        labels.append(frame_label(frame))
+                    frame = frame.f_back
+                # If the watched frame is no longer on its thread's stack, the call has finished.
+                if frame is not None:
+                    samples.append((call_id, tuple(reversed(labels))))
+
+        active_ids = {call_id for call_id, _ in active}
+        with self._lock:
+            for call_id, stack in samples:
+                self._samples.setdefault(call_id, Counter())[stack] += 1
+            # Samples of calls which have finished under their thresholds are discarded. A call is
+            # given until the next sample to collect its samples.
+            for call_id in finished:
+                self._samples.pop(call_id, None)
+            return {call_id for call_id in self._samples if call_id not in active_ids}
+
+
+_shared_sampler: Optional[StackSampler] = None
+_shared_sampler_lock = threading.Lock()
+
+
+def shared_sampler() -> StackSampler:
+    """
+    Returns the process-wide stack sampler, creating it on first use.
+    """
+    global _shared_sampler
+    with _shared_sampler_lock:
+        if _shared_sampler is None:
+            _shared_sampler = StackSampler()
+        return _shared_sampler
+
+
+_samplers: "weakref.WeakSet[StackSampler]" = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    global _shared_sampler_lock
+    _shared_sampler_lock = threading.Lock()
+    for sampler in list(_samplers):
+        sampler._after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -2,24 +2,57 @@
 This module implements all Humbug methods related to generating reports and publishing them to
 Bugout knowledge bases.
 """
-import atexit
-import concurrent.futures
-from dataclasses import dataclass, field
+import asyncio
+from contextlib import contextmanager
+import contextvars
 from enum import Enum
 from functools import wraps
-
+import json
 import logging
 import os
 import pkg_resources
 import sys
 import time
 import traceback
-from typing import Any, Callable, Dict, List, Optional
+import threading
+import tracemalloc
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 import uuid
+import weakref
 
-import requests
-
+from . import shutdown
+from .capture import ExceptionQueue
+from .cardinality import CardinalityLimiter, bounded_str
 from .consent import HumbugConsent
+from .dedup import DedupCache
+from .dispatch import (
+    Delivery,
+    Dispatcher,
+    PRIORITY_DEFAULT,
+    PRIORITY_ERROR,
+    PRIORITY_LOGGING,
+    send,
+)
+from .loop_monitor import LoopMonitor
+from .memory import (
+    AllocationTracker,
+    MemoryMonitor,
+    TRIGGER_API,
+    gc_stats,
+    peak_rss_bytes,
+    rss_bytes,
+)
+from .middleware import HumbugASGIMiddleware, HumbugWSGIMiddleware, RequestMetrics
+from .profiling import Stack, StackSampler, shared_sampler
+from .redaction import Redactor, default_redactor
+from .resources import ResourceSampler
+from .sampling import Sampler
+from .serialization import Serializer, check_endpoint
+from .timeline import (
+    MAX_EVENT_PARAMETERS,
+    MAX_PARAMETER_VALUE_LENGTH,
+    SessionTimeline,
+)
 from .system_information import (
     SystemInformation,
     generate as generate_system_information,
@@ -35,11 +68,390 @@ class BugoutUnexpectedStatusResponse(Exception):
     """
 
 
-@dataclass
+Renderer = Callable[[Dict[str, Any]], str]
+
+
 class Report:
-    title: str
-    content: str
-    tags: List[str] = field(default_factory=list)
+    """
+    A single Humbug report.
+
+    Reports generated by a HumbugReporter carry their information as structured fields. The
+    markdown content of such a report is only rendered (once) when it is first requested. Tags are
+    stored as a tuple, with duplicates removed.
+
+    Every report has a report_id, which is generated when it is first requested unless one is
+    given. It is sent as the idempotency key of every delivery of the report, so that the report can
+    be recognized if it is delivered more than once.
+    """
+
+    __slots__ = ("title", "tags", "fields", "_content", "_renderer", "_report_id")
+
+    def __init__(
+        self,
+        title: str,
+        content: Optional[str] = None,
+        tags: Iterable[str] = (),
+        fields: Optional[Dict[str, Any]] = None,
+        renderer: Optional[Renderer] = None,
+        report_id: Optional[str] = None,
+    ) -> None:
+        self.title = title
+        self.tags: Tuple[str, ...] = tuple(dict.fromkeys(tags))
+        self.fields = fields
+        self._content = content
+        self._renderer = renderer
+        self._report_id = report_id
+
+    @property
+    def report_id(self) -> str:
+        if self._report_id is None:
+            self._report_id = uuid.uuid4().hex
+        return self._report_id
+
+    @property
+    def content(self) -> str:
+        if self._content is None:
+            if self._renderer is not None and self.fields is not None:
+                self._content = self._renderer(self.fields)
+            else:
+                self._content = ""
+        return self._content
+
+    @content.setter
+    def content(self, value: str) -> None:
+        self._content = value
+
+    def compact_content(self) -> str:
+        """
+        Serializes the structured fields of the report as compact JSON. Reports which do not have
+        structured fields fall back to their content.
+        """
+        if self.fields is None:
+            return self.content
+        return json.dumps(self.fields, separators=(",", ":"), default=str)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Report):
+            return NotImplemented
+        return (self.title, self.content, self.tags) == (
+            other.title,
+            other.content,
+            other.tags,
+        )
+
+    def __repr__(self) -> str:
+        return "Report(title={!r}, tags={!r})".format(self.title, self.tags)
+
+
+def _code_section(heading: str, value: Any) -> str:
+    return "".join(("### ", heading, "\n```\n", str(value), "\n```"))
+
+
+def render_system(fields: Dict[str, Any]) -> str:
+    return "\n\n".join(
+        (
+            _code_section("User timestamp", fields["user_time"]),
+            _code_section("OS", fields["os"]),
+            "".join(("Release: `", fields["os_release"], "`")),
+            _code_section("Processor", fields["machine"]),
+            _code_section("Python", fields["python_version"]),
+        )
+    )
+
+
+def render_error(fields: Dict[str, Any]) -> str:
+    return "\n\n".join(
+        (
+            _code_section("User timestamp", fields["user_time"]),
+            _code_section("Exception summary", fields["exception"]),
+            _code_section("Traceback", fields["traceback"]),
+        )
+    )
+
+
+def render_logging(fields: Dict[str, Any]) -> str:
+    return "\n\n".join(
+        (
+            _code_section("User timestamp", fields["user_time"]),
+            _code_section("Module name", fields["module"]),
+            _code_section("Error message", fields["message"]),
+        )
+    )
+
+
+def render_feature(fields: Dict[str, Any]) -> str:
+    parameters_content = "\n".join(
+        "".join(("- `", str(key), "` = `", str(value), "`"))
+        for key, value in fields["parameters"].items()
+    )
+    limits_content = ""
+    limits = fields.get("parameter_limits")
+    if limits is not None:
+        limits_content = "".join(
+            "".join(("\n- `", key, "`: ", str(count), " ", description))
+            for counts, description in (
+                (limits["dropped"], "value(s) tagged as other"),
+                (limits["truncated"], "tag(s) truncated"),
+            )
+            for key, count in counts.items()
+        )
+        limits_content = "".join(("\n### Parameter limits\n", limits_content, "\n"))
+    return "".join(
+        (
+            _code_section("User timestamp", fields["user_time"]),
+            "\n\n### Information\n\nFeature: ",
+            fields["feature"],
+            "\n\n",
+            parameters_content,
+            "\n",
+            limits_content,
+        )
+    )
+
+
+def render_lines(fields: Dict[str, Any]) -> str:
+    return "".join(("```\n", "\n".join(fields["lines"]), "\n```"))
+
+
+def render_session_summary(fields: Dict[str, Any]) -> str:
+    feature_counts = "\n".join(
+        "".join(("- `", feature, "`: ", str(count)))
+        for feature, count in zip(fields["features"], fields["counts"])
+    )
+    sections = [
+        _code_section("Session started", fields["started_at"]),
+        _code_section("Duration (ms)", fields["duration_ms"]),
+        "".join(("### Feature usage\n", feature_counts)),
+    ]
+    if fields["tags"]:
+        sections.append(
+            "".join(
+                (
+                    "### Event tags\n",
+                    "\n".join("".join(("- `", tag, "`")) for tag in fields["tags"]),
+                )
+            )
+        )
+    sections.append(
+        _code_section(
+            "Timeline (zlib-compressed, base64-encoded JSON list of [feature index, "
+            "ms since previous event, parameters, event tag indices])",
+            fields["events"],
+        )
+    )
+    return "\n\n".join(sections)
+
+
+def render_slow_call(fields: Dict[str, Any]) -> str:
+    parameters_content = "\n".join(
+        "".join(("- `", str(key), "` = `", str(value), "`"))
+        for key, value in fields["parameters"].items()
+    )
+    profile = "\n\n".join(
+        "".join(
+            (
+                "Sampled ",
+                str(sample["count"]),
+                " time(s):\n```\n",
+                "\n".join(sample["stack"]),
+                "\n```",
+            )
+        )
+        for sample in fields["profile"]
+    )
+    return "\n\n".join(
+        (
+            _code_section("User timestamp", fields["user_time"]),
+            "".join(
+                (
+                    "### Information\n\nFunction: ",
+                    fields["function"],
+                    "\n\nDuration (ms): ",
+                    str(fields["duration_ms"]),
+                    "\n\nThreshold (ms): ",
+                    str(fields["threshold_ms"]),
+                )
+            ),
+            "".join(("### Parameters\n", parameters_content)),
+            "".join(
+                (
+                    "### Profile (sampled every ",
+                    str(fields["sample_interval_ms"]),
+                    " ms)\n\n",
+                    profile,
+                )
+            ),
+        )
+    )
+
+
+def _allocation_sites(heading: str, sites: List[Dict[str, Any]]) -> str:
+    rows = "\n".join(
+        "".join(
+            (
+                "| `",
+                site["location"],
+                "` | ",
+                str(site["size"]),
+                " | ",
+                str(site["size_diff"]),
+                " | ",
+                str(site["count"]),
+                " | ",
+                str(site["count_diff"]),
+                " |",
+            )
+        )
+        for site in sites
+    )
+    return "".join(
+        (
+            "### ",
+            heading,
+            "\n\n| Location | Size (B) | Size change (B) | Count | Count change |\n",
+            "|---|---|---|---|---|\n",
+            rows,
+        )
+    )
+
+
+def render_memory(fields: Dict[str, Any]) -> str:
+    sections = [
+        _code_section("User timestamp", fields["user_time"]),
+        _code_section("Trigger", fields["trigger"]),
+        _code_section("RSS (bytes)", fields["rss_bytes"]),
+        _code_section("Peak RSS (bytes)", fields["peak_rss_bytes"]),
+        _code_section("Garbage collector", json.dumps(fields["gc"], indent=2)),
+    ]
+    allocations = fields["allocations"]
+    if allocations is None:
+        sections.append("### Allocations\n\ntracemalloc is not tracing.")
+    else:
+        sections.append(
+            _code_section(
+                "Traced memory (bytes)",
+                "current: {}, peak: {}".format(
+                    allocations["traced_bytes"], allocations["peak_traced_bytes"]
+                ),
+            )
+        )
+        sections.append(
+            _allocation_sites(
+                "Top allocation sites by size", allocations["top_by_size"]
+            )
+        )
+        sections.append(
+            _allocation_sites(
+                "Top allocation sites by count", allocations["top_by_count"]
+            )
+        )
+    return "\n\n".join(sections)
+
+
+def render_resource(fields: Dict[str, Any]) -> str:
+    rows = []
+    for heading, key in (
+        ("CPU (%)", "cpu_percent"),
+        ("RSS (bytes)", "rss_bytes"),
+        ("Open file descriptors", "open_file_descriptors"),
+        ("Threads", "threads"),
+    ):
+        summary = fields[key]
+        if summary is None:
+            rows.append("".join(("| ", heading, " | - | - | - |")))
+        else:
+            rows.append(
+                "".join(
+                    (
+                        "| ",
+                        heading,
+                        " | ",
+                        str(summary["min"]),
+                        " | ",
+                        "{:.2f}".format(summary["mean"]),
+                        " | ",
+                        str(summary["max"]),
+                        " |",
+                    )
+                )
+            )
+    return "\n\n".join(
+        (
+            _code_section("Period started", fields["started_at"]),
+            _code_section("Duration (ms)", fields["duration_ms"]),
+            _code_section("CPU time (s)", "{:.3f}".format(fields["cpu_seconds"])),
+            "".join(
+                (
+                    "### Usage\n\n| Metric | Min | Mean | Max |\n|---|---|---|---|\n",
+                    "\n".join(rows),
+                )
+            ),
+            _code_section("Garbage collector", json.dumps(fields["gc"])),
+        )
+    )
+
+
+def render_loop_stall(fields: Dict[str, Any]) -> str:
+    return "\n\n".join(
+        (
+            _code_section("User timestamp", fields["user_time"]),
+            _code_section("Blocked for (ms)", fields["blocked_ms"]),
+            _code_section("Threshold (ms)", fields["threshold_ms"]),
+            _code_section("Event loop thread stack", "\n".join(fields["stack"])),
+            _code_section(
+                "Loop lag histogram", json.dumps(fields["lag_histogram"], indent=2)
+            ),
+        )
+    )
+
+
+def render_requests(fields: Dict[str, Any]) -> str:
+    rows = "\n".join(
+        "".join(
+            (
+                "| `",
+                route,
+                "` | ",
+                str(stats["count"]),
+                " | ",
+                "{:.2f}".format(stats["mean_ms"]),
+                " | ",
+                "{:.2f}".format(stats["max_ms"]),
+                " | ",
+                ", ".join(
+                    "{}: {}".format(status, count)
+                    for status, count in stats["statuses"].items()
+                ),
+                " |",
+            )
+        )
+        for route, stats in fields["routes"].items()
+    )
+    return "\n\n".join(
+        (
+            _code_section("Period started", fields["started_at"]),
+            _code_section("Duration (ms)", fields["duration_ms"]),
+            _code_section("Requests", fields["requests"]),
+            "".join(
+                (
+                    "### Routes\n\n",
+                    "| Route | Requests | Mean (ms) | Max (ms) | Statuses |\n",
+                    "|---|---|---|---|---|\n",
+                    rows,
+                )
+            ),
+            _code_section(
+                "Latency histograms (ms)",
+                json.dumps(
+                    {
+                        route: stats["buckets_ms"]
+                        for route, stats in fields["routes"].items()
+                    },
+                    indent=2,
+                ),
+            ),
+        )
+    )
 
 
 class Modes(Enum):
@@ -47,6 +459,48 @@ class Modes(Enum):
     SYNCHRONOUS = 1
 
 
+_shared_dispatcher: Optional[Dispatcher] = None
+_shared_dispatcher_lock = threading.Lock()
+
+
+def shared_dispatcher() -> Dispatcher:
+    """
+    Returns the process-wide dispatcher, creating it on first use.
+
+    Reporters which are created with dispatcher=shared_dispatcher() publish through a single queue,
+    worker pool, and connection pool, so the number of threads and sockets Humbug uses stays
+    constant no matter how many libraries in a process use Humbug.
+    """
+    global _shared_dispatcher
+    with _shared_dispatcher_lock:
+        if _shared_dispatcher is None:
+            _shared_dispatcher = Dispatcher(thread_name="humbug_shared")
+            shutdown.coordinator.register(_shared_dispatcher)
+        return _shared_dispatcher
+
+
+def report_type(report: Report) -> Optional[str]:
+    """
+    Returns the value of a report's "type:" tag, or None if it does not have one.
+    """
+    for tag in report.tags:
+        if tag.startswith("type:"):
+            return tag[len("type:") :]
+    return None
+
+
+def report_priority(report: Report) -> int:
+    """
+    Determines the dispatcher lane for a report from its type: error reports are sent first, then
+    logging reports, then all other (usage and system) reports.
+    """
+    if "type:error" in report.tags:
+        return PRIORITY_ERROR
+    if "type:logging" in report.tags:
+        return PRIORITY_LOGGING
+    return PRIORITY_DEFAULT
+
+
 class HumbugReporter:
     def __init__(
         self,
@@ -60,6 +514,23 @@ class HumbugReporter:
         mode: Modes = Modes.DEFAULT,
         url: Optional[str] = None,
         tags: Optional[List[str]] = None,
+        markdown: bool = True,
+        session_summary: bool = False,
+        session_summary_max_events: int = 1000,
+        min_workers: int = 0,
+        max_workers: int = 4,
+        dispatcher: Optional[Dispatcher] = None,
+        new_session_on_fork: bool = False,
+        sample_rates: Optional[Dict[str, float]] = None,
+        sample_by: str = "client",
+        parameter_limiter: Optional[CardinalityLimiter] = None,
+        adaptive_timeouts: bool = False,
+        hedge_errors: bool = False,
+        serializer: Optional[Serializer] = None,
+        dedup_cache: Optional[DedupCache] = None,
+        thread_buffers: bool = False,
+        redact: bool = True,
+        redactor: Optional[Redactor] = None,
     ):
         if url is None:
             url = DEFAULT_URL
@@ -77,30 +548,160 @@ class HumbugReporter:
         self.bugout_token = bugout_token
         self.timeout_seconds = timeout_seconds
 
-        self.report_futures: List[concurrent.futures.Future] = []
-        atexit.register(self.wait)
-
-        self.executor: Optional[concurrent.futures.Executor] = None
+        # In DEFAULT mode, reports are sent from a pool of between min_workers and max_workers
+        # background daemon threads, which grows with the backlog of reports and shrinks when idle.
+        # With more than one thread, reports may be delivered out of the order in which they were
+        # published; max_workers=1 keeps the order. Any reports which are still pending when the
+        # process exits are flushed by the process-wide shutdown coordinator against a single
+        # deadline, so that no reporter can hold up interpreter exit for its full timeout.
+        #
+        # If adaptive_timeouts is True, requests time out after a multiple of the recently observed
+        # send latency (never more than timeout_seconds). If hedge_errors is True, slow error
+        # reports are sent a second time by another worker. If thread_buffers is True, each thread
+        # publishes into a buffer of its own, so that threads which publish at the same time do not
+        # contend for the dispatcher's lock. See Dispatcher for details.
+        #
+        # Reporters may instead share a dispatcher (for example, the process-wide one returned by
+        # shared_dispatcher()), in which case min_workers, max_workers, adaptive_timeouts,
+        # hedge_errors and thread_buffers are ignored.
+        self.dispatcher: Optional[Dispatcher] = None
         if mode == Modes.DEFAULT:
-            self.executor = concurrent.futures.ThreadPoolExecutor(
-                max_workers=1, thread_name_prefix="humbug_reporter"
-            )
+            if dispatcher is None:
+                dispatcher = Dispatcher(
+                    thread_name="humbug_reporter",
+                    min_workers=min_workers,
+                    max_workers=max_workers,
+                    adaptive_timeouts=adaptive_timeouts,
+                    hedge_errors=hedge_errors,
+                    thread_buffers=thread_buffers,
+                )
+            self.dispatcher = dispatcher
+            shutdown.coordinator.register(self.dispatcher)
 
         self.is_excepthook_set = False
         self.is_loggerhook_set = False
+        self.is_thread_excepthook_set = False
+
+        # Exceptions captured by the thread and asyncio exception hooks are reported from a
+        # background thread (see humbug.capture).
+        self.exception_queue: Optional[ExceptionQueue] = None
+        self._handled_loops: "weakref.WeakSet[asyncio.AbstractEventLoop]" = (
+            weakref.WeakSet()
+        )
 
         self.tags: List[str] = []
         if tags is not None:
             self.tags = tags
 
-    def wait(self) -> None:
-        concurrent.futures.wait(
-            self.report_futures, timeout=float(self.timeout_seconds)
+        # System tags are generated once per session and client ID (see system_tags).
+        self._system_tags: Optional[
+            Tuple[Tuple[str, Optional[str]], Tuple[str, ...]]
+        ] = None
+
+        # Tags added by tags_scope are held in a context variable, so that each thread and each
+        # asyncio task sees only the scopes it has entered itself.
+        self._scoped_tags: "contextvars.ContextVar[Tuple[str, ...]]" = (
+            contextvars.ContextVar("humbug_scoped_tags", default=())
         )
-        if self.executor is not None:
-            self.executor.shutdown()
+
+        # If markdown is False, reports with structured fields are published with those fields
+        # serialized as compact JSON in place of their rendered markdown content.
+        self.markdown = markdown
+
+        # serializer encodes the bodies of this reporter's requests. By default, they are sent as
+        # JSON (see humbug.serialization). The Bugout API only accepts JSON, so other serializers
+        # can only be used with a url which points elsewhere (for example, a local collector).
+        if serializer is not None:
+            check_endpoint(serializer, self.url)
+        self.serializer = serializer
+
+        # Unless redact is False, the titles, contents, and tags of reports are passed through
+        # redactor (by default, humbug.redaction.default_redactor()) before they are sent, to remove
+        # secrets and personal information such as tokens, passwords and home directories. Reports
+        # are redacted by the dispatcher's workers, not by the threads that publish them.
+        self.redactor: Optional[Redactor] = None
+        if redact:
+            self.redactor = redactor if redactor is not None else default_redactor()
+
+        # If set, dedup_cache remembers the idempotency keys of reports this reporter has
+        # delivered, and deliveries of reports it remembers are skipped. If the cache has a file,
+        # it is saved when the process shuts down.
+        self.dedup_cache = dedup_cache
+        if dedup_cache is not None and dedup_cache.path is not None:
+            shutdown.coordinator.register_hook(dedup_cache.save, after=True)
+
+        # In session summary mode, published feature reports are recorded in a timeline instead of
+        # being sent one by one. The timeline is published as a single session summary report when
+        # it fills up, when wait() is called, and when the process shuts down.
+        self.session_timeline: Optional[SessionTimeline] = None
+        if session_summary:
+            self.session_timeline = SessionTimeline(
+                max_events=session_summary_max_events
+            )
+            shutdown.coordinator.register_hook(self.session_summary_report)
+
+        # If the process forks, the dispatcher resets itself in the child (see humbug.dispatch).
+        # The reporter discards session events recorded by the parent and, if
+        # new_session_on_fork is set, starts a new session.
+        self.new_session_on_fork = new_session_on_fork
+        _reporters.add(self)
+
+        # sample_rates maps report types (e.g. "feature") to the fraction of clients (or sessions,
+        # if sample_by is "session") whose reports of that type are published. The decision is
+        # made once, from a hash of the client (or session) ID, so a sampled-out client does not
+        # even construct those reports.
+        self.sample_rates = sample_rates
+        self.sample_by = sample_by
+        self.sampler: Optional[Sampler] = None
+        self._configure_sampler()
+
+        # If set, parameter_limiter bounds the number of distinct parameter:* tags that
+        # feature_report (and so record_call) can generate.
+        self.parameter_limiter = parameter_limiter
+
+        # Memory reports compare each tracemalloc snapshot with the one taken for the previous
+        # memory report. See watch_memory for reports on signals and RSS thresholds.
+        self.allocation_tracker = AllocationTracker()
+        self.memory_monitor: Optional[MemoryMonitor] = None
+        self.resource_sampler: Optional[ResourceSampler] = None
+        self.loop_monitor: Optional[LoopMonitor] = None
+
+    def _configure_sampler(self) -> None:
+        if not self.sample_rates:
+            self.sampler = None
+            return
+        key = self.session_id
+        if self.sample_by == "client" and self.client_id is not None:
+            key = self.client_id
+        self.sampler = Sampler(key, self.sample_rates, salt=self.name)
+
+    def _after_fork_in_child(self) -> None:
+        if self.new_session_on_fork:
+            self.session_id = str(uuid.uuid4())
+            self._configure_sampler()
+        if self.session_timeline is not None:
+            self.session_timeline.clear()
+
+    def wait(self) -> None:
+        """
+        Blocks until all reports published by this reporter have been sent, or until
+        timeout_seconds have passed. If the reporter uses a shared dispatcher, this waits for the
+        reports published by all the reporters that share it.
+        """
+        if self.exception_queue is not None:
+            self.exception_queue.flush()
+        if self.session_timeline is not None:
+            self.session_summary_report()
+        if self.dispatcher is not None:
+            self.dispatcher.flush(timeout=float(self.timeout_seconds))
 
     def system_tags(self) -> List[str]:
+        key = (self.session_id, self.client_id)
+        if self._system_tags is None or self._system_tags[0] != key:
+            self._system_tags = (key, tuple(self._generate_system_tags()))
+        return list(self._system_tags[1])
+
+    def _generate_system_tags(self) -> List[str]:
         tags = [
             "humbug",
             "source:{}".format(self.name),
@@ -119,11 +720,35 @@ class HumbugReporter:
 
         return tags
 
+    @contextmanager
+    def tags_scope(self, *tags: str) -> Iterator[None]:
+        """
+        Adds the given tags to every report this reporter publishes from the current context (thread
+        or asyncio task) until the with block exits. Scopes can be nested. For example:
+
+            with reporter.tags_scope("request:{}".format(request_id), "route:/users"):
+                handle(request)
+        """
+        token = self._scoped_tags.set(self._scoped_tags.get() + tags)
+        try:
+            yield
+        finally:
+            self._scoped_tags.reset(token)
+
+    def scoped_tags(self) -> Tuple[str, ...]:
+        """
+        The tags added by the tags_scope blocks the current context is in.
+        """
+        return self._scoped_tags.get()
+
     def _post_body(self, report: Report) -> Dict[str, Any]:
+        tags = [*report.tags, *self.tags, *self._scoped_tags.get()]
+        if self.sampler is not None:
+            tags.extend(self.sampler.tags(report_type(report)))
         return {
             "title": report.title,
-            "content": report.content,
-            "tags": report.tags + self.tags,
+            "content": report.content if self.markdown else report.compact_content(),
+            "tags": tags,
         }
 
     def publish(self, report: Report, wait: bool = False) -> None:
@@ -131,6 +756,8 @@ class HumbugReporter:
             return
         if self.bugout_token is None:
             return
+        if self.sampler is not None and not self.sampler.keep(report_type(report)):
+            return
 
         json = self._post_body(report)
         headers = {
@@ -138,23 +765,76 @@ class HumbugReporter:
         }
         url = "{}/humbug/reports".format(self.url)
 
+        self._deliver(
+            Delivery(
+                url=url,
+                headers=headers,
+                body=json,
+                timeout=self.timeout_seconds,
+                priority=report_priority(report),
+                serializer=self.serializer,
+                idempotency_key=report.report_id,
+                redactor=self.redactor,
+            ),
+            wait=wait,
+        )
+
+    def _delivered(self, delivery: Delivery) -> None:
+        if self.dedup_cache is not None and delivery.idempotency_key is not None:
+            self.dedup_cache.add(delivery.idempotency_key)
+
+    def _deliver(self, delivery: Delivery, wait: bool = False) -> None:
+        if self.dedup_cache is not None and delivery.idempotency_key is not None:
+            if delivery.idempotency_key in self.dedup_cache:
+                return
+            delivery.on_sent = self._delivered
         try:
-            report.tags = list(set(report.tags))
-            if wait or self.executor is None:
-                requests.post(
-                    url=url, headers=headers, json=json, timeout=self.timeout_seconds
+            if self.dispatcher is None:
+                send(delivery)
+            elif wait:
+                send(
+                    delivery,
+                    self.dispatcher.session,
+                    self.dispatcher.timeout(delivery),
                 )
             else:
-                report_future = self.executor.submit(
-                    requests.post,
+                self.dispatcher.submit(delivery)
+        except Exception:
+            pass
+
+    def publish_spooled(self, spool_directory: Optional[str] = None) -> int:
+        """
+        Re-publishes reports which were spooled to disk because they could not be sent before a
+        previous process shut down. Only reports addressed to this reporter's Bugout API URL are
+        published. Returns the number of reports which were re-published.
+        """
+        if spool_directory is None:
+            spool_directory = shutdown.coordinator.spool_directory
+        if spool_directory is None:
+            return 0
+        if not self.consent.check():
+            return 0
+        if self.bugout_token is None:
+            return 0
+
+        headers = {
+            "Authorization": "Bearer {}".format(self.bugout_token),
+        }
+        num_published = 0
+        for url, body, idempotency_key in shutdown.read_spool(spool_directory):
+            if not url.startswith(self.url):
+                continue
+            self._deliver(
+                Delivery(
                     url=url,
                     headers=headers,
-                    json=json,
+                    body=body,
                     timeout=self.timeout_seconds,
+                    idempotency_key=idempotency_key,
                 )
-                self.report_futures.append(report_future)
-        except Exception:
-            pass
+            )
+            num_published += 1
+        return num_published
 
     def custom_report(
         self,
@@ -179,37 +859,20 @@ class HumbugReporter:
         self, tags: Optional[List[str]] = None, publish: bool = True, wait: bool = False
     ) -> Report:
         title = "{}: System information".format(self.name)
-        content = """### User timestamp
-```
-{user_time}
-```
-
-### OS
-```
-{os}
-```
-
-Release: `{os_release}`
-
-### Processor
-```
-{machine}
-```
-
-### Python
-```
-{python_version}
-```""".format(
-            user_time=int(time.time()),
-            os=self.system_information.os,
-            os_release=self.system_information.os_release,
-            machine=self.system_information.machine,
-            python_version=self.system_information.python_version,
-        )
-        report = Report(title=title, content=content, tags=self.system_tags())
+        fields = {
+            "user_time": int(time.time()),
+            "os": self.system_information.os,
+            "os_release": self.system_information.os_release,
+            "machine": self.system_information.machine,
+            "python_version": self.system_information.python_version,
+        }
+        report_tags = self.system_tags()
         if tags is not None:
-            report.tags.extend(tags)
-        report.tags.append("type:system")
+            report_tags.extend(tags)
+        report_tags.append("type:system")
+        report = Report(
+            title=title, tags=report_tags, fields=fields, renderer=render_system
+        )
 
         if publish:
             self.publish(report, wait=wait)
@@ -218,49 +881,32 @@ Release: `{os_release}`
 
     def error_report(
         self,
-        error: Exception,
+        error: BaseException,
         tags: Optional[List[str]] = None,
         publish: bool = True,
         wait: bool = False,
     ) -> Report:
         title = "{} - {}".format(self.name, type(error).__name__)
-        error_content = """### User timestamp
-```
-{user_time}
-```
-
-### Exception summary
-```
-{error_summary}
-```
-
-### Traceback
-```
-{error_traceback}
-```""".format(
-            user_time=int(time.time()),
-            error_summary=repr(error),
-            error_traceback="".join(
-                traceback.format_exception(
-                    etype=type(error),
-                    value=error,
-                    tb=error.__traceback__,
-                )
+        fields = {
+            "user_time": int(time.time()),
+            "exception": repr(error),
+            "traceback": "".join(
+                traceback.format_exception(type(error), error, error.__traceback__)
             ),
-        )
-        if tags is None:
-            tags = []
-
-        tags.extend(["type:error", "error:{}".format(error.__class__.__name__)])
+        }
+        report_tags = [] if tags is None else list(tags)
+        report_tags.extend(["type:error", "error:{}".format(error.__class__.__name__)])
         try:
-            tags.append(
+            report_tags.append(
                 "error_full:{}.{}".format(error.__module__, error.__class__.__name__),
             )
         except Exception:
             pass
-        tags.extend(self.system_tags())
+        report_tags.extend(self.system_tags())
 
-        report = Report(title=title, content=error_content, tags=tags)
+        report = Report(
+            title=title, tags=report_tags, fields=fields, renderer=render_error
+        )
 
         if publish:
             self.publish(report, wait=wait)
@@ -280,18 +926,274 @@ Release: `{os_release}`
         """
         if title is None:
             title = "Environment variables"
-        if tags is None:
-            tags = []
-        tags.append("type:env")
+        report_tags = [] if tags is None else list(tags)
+        report_tags.append("type:env")
 
         env_vars = ["{}={}".format(key, value) for key, value in os.environ.items()]
-        content = "```\n{}\n```".format("\n".join(env_vars))
 
-        report = Report(title=title, content=content, tags=tags)
+        report = Report(
+            title=title,
+            tags=report_tags,
+            fields={"lines": env_vars},
+            renderer=render_lines,
+        )
         if publish:
             self.publish(report, wait=wait)
         return report
 
+    def memory_report(
+        self,
+        trigger: str = TRIGGER_API,
+        tags: Optional[List[str]] = None,
+        publish: bool = True,
+        wait: bool = False,
+    ) -> Report:
+        """
+        Generates (and optionally publishes) a report on this process's memory usage: its RSS,
+        garbage collector statistics and, if tracemalloc is tracing, the top allocation sites since
+        the previous memory report.
+
+        Snapshotting and diffing take time proportional to the number of live allocations. To keep
+        that work off your own threads, use watch_memory and request reports from its monitor.
+        """
+        title = "{}: Memory".format(self.name)
+        fields = {
+            "user_time": int(time.time()),
+            "trigger": trigger,
+            "rss_bytes": rss_bytes(),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "gc": gc_stats(),
+            "allocations": self.allocation_tracker.summary(),
+        }
+
+        report_tags = [] if tags is None else list(tags)
+        report_tags.append("type:memory")
+        report_tags.append("trigger:{}".format(trigger))
+        report_tags.extend(self.system_tags())
+
+        report = Report(
+            title=title, tags=report_tags, fields=fields, renderer=render_memory
+        )
+        if publish:
+            self.publish(report, wait=wait)
+
+        return report
+
+    def watch_memory(
+        self,
+        rss_threshold_bytes: Optional[int] = None,
+        signum: Optional[int] = None,
+        trace_allocations: bool = False,
+        tags: Optional[List[str]] = None,
+        poll_interval_seconds: float = 1.0,
+        cooldown_seconds: float = 300.0,
+    ) -> MemoryMonitor:
+        """
+        Starts a background monitor which publishes memory reports when its request() method is
+        called, when the process receives the signal signum (if given), and when the process's RSS
+        exceeds rss_threshold_bytes (if given, at most once every cooldown_seconds). Reports are
+        generated on the monitor's thread.
+
+        If trace_allocations is True, starts tracemalloc so that reports include the top allocation
+        sites. Note that tracing allocations slows down your program.
+        """
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.memory_monitor is not None:
+            self.memory_monitor.stop()
+        self.memory_monitor = MemoryMonitor(
+            lambda trigger: self.memory_report(trigger=trigger, tags=tags),
+            rss_threshold_bytes=rss_threshold_bytes,
+            poll_interval_seconds=poll_interval_seconds,
+            cooldown_seconds=cooldown_seconds,
+        )
+        self.memory_monitor.start()
+        if signum is not None:
+            self.memory_monitor.install_signal_handler(signum)
+        return self.memory_monitor
+
+    def resource_report(
+        self,
+        fields: Dict[str, Any],
+        tags: Optional[List[str]] = None,
+        publish: bool = True,
+        wait: bool = False,
+    ) -> Report:
+        """
+        Generates (and optionally publishes) a report summarizing this process's resource usage over
+        a period, from the fields produced by a humbug.resources.ResourceSampler.
+        """
+        title = "{}: Resource usage".format(self.name)
+        report_tags = [] if tags is None else list(tags)
+        report_tags.append("type:resource")
+        report_tags.extend(self.system_tags())
+
+        report = Report(
+            title=title, tags=report_tags, fields=fields, renderer=render_resource
+        )
+        if publish:
+            self.publish(report, wait=wait)
+
+        return report
+
+    def start_resource_heartbeat(
+        self,
+        interval_seconds: float = 10.0,
+        period_seconds: float = 300.0,
+        tags: Optional[List[str]] = None,
+    ) -> ResourceSampler:
+        """
+        Starts a background sampler which records CPU usage, RSS, open file descriptors, thread
+        count and garbage collections every interval_seconds, and publishes a resource_report
+        summarizing them every period_seconds. Call stop() on the returned sampler to stop it.
+        """
+        if self.resource_sampler is not None:
+            self.resource_sampler.stop()
+        self.resource_sampler = ResourceSampler(
+            lambda fields: self.resource_report(fields, tags=tags),
+            interval_seconds=interval_seconds,
+            period_seconds=period_seconds,
+        )
+        self.resource_sampler.start()
+        return self.resource_sampler
+
+    def loop_stall_report(
+        self,
+        fields: Dict[str, Any],
+        tags: Optional[List[str]] = None,
+        publish: bool = True,
+        wait: bool = False,
+    ) -> Report:
+        """
+        Generates (and optionally publishes) a report that an asyncio event loop was blocked, from
+        the fields produced by a humbug.loop_monitor.LoopMonitor.
+        """
+        title = "{}: Event loop stalled".format(self.name)
+        report_tags = [] if tags is None else list(tags)
+        report_tags.append("type:loop_stall")
+        report_tags.extend(self.system_tags())
+
+        report = Report(
+            title=title, tags=report_tags, fields=fields, renderer=render_loop_stall
+        )
+        if publish:
+            self.publish(report, wait=wait)
+
+        return report
+
+    def monitor_event_loop(
+        self,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        stall_threshold_seconds: float = 1.0,
+        probe_interval_seconds: float = 0.1,
+        min_report_interval_seconds: float = 60.0,
+        tags: Optional[List[str]] = None,
+    ) -> LoopMonitor:
+        """
+        Starts monitoring an asyncio event loop (by default, the running loop) for stalls. Whenever
+        the loop is blocked for longer than stall_threshold_seconds, a loop_stall_report with the
+        stack of the code blocking it is published, at most once every
+        min_report_interval_seconds. Call stop() on the returned monitor to stop monitoring.
+        """
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        if self.loop_monitor is not None:
+            self.loop_monitor.stop()
+        self.loop_monitor = LoopMonitor(
+            loop,
+            lambda fields: self.loop_stall_report(fields, tags=tags),
+            probe_interval_seconds=probe_interval_seconds,
+            stall_threshold_seconds=stall_threshold_seconds,
+            min_report_interval_seconds=min_report_interval_seconds,
+        )
+        self.loop_monitor.start()
+        return self.loop_monitor
+
+    def requests_report(
+        self,
+        fields: Dict[str, Any],
+        tags: Optional[List[str]] = None,
+        publish: bool = True,
+        wait: bool = False,
+    ) -> Report:
+        """
+        Generates (and optionally publishes) a report summarizing the requests a web application
+        served over a period, from the fields produced by a humbug.middleware.RequestMetrics.
+        """
+        title = "{}: Requests".format(self.name)
+        report_tags = [] if tags is None else list(tags)
+        report_tags.append("type:requests")
+        report_tags.extend(self.system_tags())
+
+        report = Report(
+            title=title, tags=report_tags, fields=fields, renderer=render_requests
+        )
+        if publish:
+            self.publish(report, wait=wait)
+
+        return report
+
+    def _request_metrics(
+        self,
+        flush_interval_seconds: float,
+        max_routes: int,
+        tags: Optional[List[str]],
+    ) -> RequestMetrics:
+        metrics = RequestMetrics(
+            lambda fields: self.requests_report(fields, tags=tags),
+            flush_interval_seconds=flush_interval_seconds,
+            max_routes=max_routes,
+        )
+        shutdown.coordinator.register_hook(metrics.flush)
+        return metrics
+
+    def _capture_request_exception(self, error: BaseException, tags: List[str]) -> None:
+        self._exception_queue().capture(error, [*tags, *self._scoped_tags.get()])
+
+    def wsgi_middleware(
+        self,
+        app: Callable,
+        flush_interval_seconds: float = 60.0,
+        max_routes: int = 100,
+        route: Optional[Callable[[Dict[str, Any]], str]] = None,
+        tags: Optional[List[str]] = None,
+    ) -> HumbugWSGIMiddleware:
+        """
+        Wraps a WSGI application in middleware which aggregates the latency and response status of
+        its requests per route, and publishes them as a requests_report every
+        flush_interval_seconds and when the process shuts down. Exceptions the application does not
+        handle are reported as error reports tagged with their route.
+
+        Reports are built and published in the background, so requests never wait on them. See
+        humbug.middleware for route and max_routes.
+        """
+        return HumbugWSGIMiddleware(
+            app,
+            self._request_metrics(flush_interval_seconds, max_routes, tags),
+            self._capture_request_exception,
+            route=route,
+            tags=tags,
+        )
+
+    def asgi_middleware(
+        self,
+        app: Callable,
+        flush_interval_seconds: float = 60.0,
+        max_routes: int = 100,
+        route: Optional[Callable[[Dict[str, Any]], str]] = None,
+        tags: Optional[List[str]] = None,
+    ) -> HumbugASGIMiddleware:
+        """
+        The ASGI equivalent of wsgi_middleware. Only HTTP requests are measured.
+        """
+        return HumbugASGIMiddleware(
+            app,
+            self._request_metrics(flush_interval_seconds, max_routes, tags),
+            self._capture_request_exception,
+            route=route,
+            tags=tags,
+        )
+
     def packages_report(
         self,
         title: Optional[str] = None,
@@ -305,15 +1207,18 @@ Release: `{os_release}`
         """
         if title is None:
             title = "Available packages"
-        if tags is None:
-            tags = []
-        tags.append("type:dependencies")
+        report_tags = [] if tags is None else list(tags)
+        report_tags.append("type:dependencies")
 
         available_packages = [
             str(package_info) for package_info in pkg_resources.working_set
         ]
-        content = "```\n{}\n```".format("\n".join(available_packages))
-        report = Report(title, content, tags)
+        report = Report(
+            title=title,
+            tags=report_tags,
+            fields={"lines": available_packages},
+            renderer=render_lines,
+        )
         if publish:
             self.publish(report, wait=wait)
         return report
@@ -326,17 +1231,16 @@ Release: `{os_release}`
         publish: bool = True,
         wait: bool = False,
     ) -> Report:
-        if tags is None:
-            tags = []
+        report_tags = [] if tags is None else list(tags)
         for component in reports:
-            tags.extend(component.tags)
+            report_tags.extend(component.tags)
 
         if title is None:
             title = "Composite report"
 
         content = "\n\n- - -\n\n".join(component.content for component in reports)
 
-        report = Report(title=title, content=content, tags=tags)
+        report = Report(title=title, content=content, tags=report_tags)
         if publish:
             self.publish(report, wait=wait)
         return report
@@ -349,30 +1253,18 @@ Release: `{os_release}`
         wait: bool = False,
     ) -> Report:
         title = "{} - Logging error - {}".format(self.name, record.module)
-        error_content = """### User timestamp
-```
-{user_time}
-```
-
-### Module name
-```
-{module_name}
-```
-
-### Error message
-```
-{error_message}
-```""".format(
-            user_time=int(time.time()),
-            module_name=record.module,
-            error_message=record.getMessage(),
-        )
-        if tags is None:
-            tags = []
-        tags.append("type:logging")
-        tags.extend(self.system_tags())
+        fields = {
+            "user_time": int(time.time()),
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        report_tags = [] if tags is None else list(tags)
+        report_tags.append("type:logging")
+        report_tags.extend(self.system_tags())
 
-        report = Report(title=title, content=error_content, tags=tags)
+        report = Report(
+            title=title, tags=report_tags, fields=fields, renderer=render_logging
+        )
 
         if publish:
             self.publish(report, wait=wait)
@@ -386,45 +1278,149 @@ Release: `{os_release}`
         tags: Optional[List[str]] = None,
         publish: bool = True,
         wait: bool = False,
-    ) -> Report:
+    ) -> Optional[Report]:
+        """
+        Generates (and optionally publishes) a report that a feature of your tool was used with the
+        given parameters. If reports are to be published but this reporter's client is sampled out
+        of feature reports, no report is generated and None is returned.
+
+        Parameter values are truncated to MAX_PARAMETER_VALUE_LENGTH characters. If the reporter
+        has a parameter_limiter which has tagged values as "other" or truncated tags, the report
+        records how many it has so far, per key.
+        """
+        if publish and self.sampler is not None and not self.sampler.keep("feature"):
+            return None
+
         title = "Feature used: {name}".format(name=feature_name)
 
-        parameters_content = "\n".join(
-            [
-                "- `{parameter_name}` = `{parameter_value}`".format(
-                    parameter_name=key, parameter_value=value
-                )
+        fields: Dict[str, Any] = {
+            "user_time": int(time.time()),
+            "feature": feature_name,
+            "parameters": {
+                str(key): bounded_str(value, MAX_PARAMETER_VALUE_LENGTH)
                 for key, value in parameters.items()
-            ]
+            },
+        }
+
+        report_tags = [] if tags is None else list(tags)
+        report_tags.append("type:feature")
+        report_tags.append("feature:{}".format(feature_name))
+        report_tags.extend(self.system_tags())
+        report_tags.extend(self.parameter_tags(parameters))
+        if self.parameter_limiter is not None:
+            limits = self.parameter_limiter.counts()
+            if limits["dropped"] or limits["truncated"]:
+                fields["parameter_limits"] = limits
+
+        report = Report(
+            title=title, tags=report_tags, fields=fields, renderer=render_feature
         )
 
-        content = """### User timestamp
-```
-{user_time}
-```
+        if publish:
+            if self.session_timeline is not None and not wait:
+                if self.session_timeline.record(feature_name, parameters, tags):
+                    self.session_summary_report()
+            else:
+                self.publish(report, wait=wait)
 
-### Information
+        return report
 
-Feature: {name}
+    def parameter_tags(self, parameters: Dict[str, Any]) -> List[str]:
+        """
+        Tags describing the given feature parameters, subject to this reporter's parameter_limiter.
+        """
+        if self.parameter_limiter is None:
+            return [
+                "parameter:{}={}".format(key, value)
+                for key, value in parameters.items()
+            ]
+        return [
+            self.parameter_limiter.tag(key, value) for key, value in parameters.items()
+        ]
 
-{parameters_content}
-""".format(
-            user_time=int(time.time()),
-            name=feature_name,
-            parameters_content=parameters_content,
-        )
+    def slow_call_report(
+        self,
+        function_name: str,
+        duration_seconds: float,
+        threshold_seconds: float,
+        parameters: Dict[str, Any],
+        stacks: Optional[List[Tuple[Stack, int]]] = None,
+        sample_interval_seconds: float = 0.0,
+        tags: Optional[List[str]] = None,
+        publish: bool = True,
+        wait: bool = False,
+    ) -> Report:
+        """
+        Generates (and optionally publishes) a report that a call to the given function took longer
+        than threshold_seconds, with a profile of the stacks it was sampled in. Only the first
+        MAX_EVENT_PARAMETERS parameters are reported, and their values are truncated to
+        MAX_PARAMETER_VALUE_LENGTH characters.
+        """
+        title = "{}: Slow call: {}".format(self.name, function_name)
+        report_parameters = {
+            str(key): bounded_str(value, MAX_PARAMETER_VALUE_LENGTH)
+            for key, value in list(parameters.items())[:MAX_EVENT_PARAMETERS]
+        }
+        fields = {
+            "user_time": int(time.time()),
+            "function": function_name,
+            "duration_ms": int(duration_seconds * 1000),
+            "threshold_ms": int(threshold_seconds * 1000),
+            "parameters": report_parameters,
+            "sample_interval_ms": int(sample_interval_seconds * 1000),
+            "profile": [
+                {"stack": list(stack), "count": count} for stack, count in stacks or []
+            ],
+        }
 
-        if tags is None:
-            tags = []
-        tags.append("type:feature")
-        tags.append("feature:{}".format(feature_name))
-        tags.extend(self.system_tags())
-        tags.extend(
-            ["parameter:{}={}".format(key, value) for key, value in parameters.items()]
+        report_tags = [] if tags is None else list(tags)
+        report_tags.append("type:slow_call")
+        report_tags.append("function:{}".format(function_name))
+        report_tags.extend(self.system_tags())
+        report_tags.extend(self.parameter_tags(report_parameters))
+
+        report = Report(
+            title=title, tags=report_tags, fields=fields, renderer=render_slow_call
         )
+        if publish:
+            self.publish(report, wait=wait)
 
-        report = Report(title=title, content=content, tags=tags)
+        return report
 
+    def session_summary_report(
+        self,
+        tags: Optional[List[str]] = None,
+        publish: bool = True,
+        wait: bool = False,
+    ) -> Optional[Report]:
+        """
+        Generates (and optionally publishes) a report summarizing the feature usage recorded in the
+        session timeline since the last summary. Returns None if the reporter is not in session
+        summary mode or if nothing has been recorded.
+        """
+        if self.session_timeline is None:
+            return None
+        fields = self.session_timeline.drain()
+        if fields is None:
+            return None
+
+        title = "{}: Session summary".format(self.name)
+        report_tags = self.system_tags()
+        if tags is not None:
+            report_tags.extend(tags)
+        report_tags.append("type:session_summary")
+        report_tags.extend(
+            "feature:{}".format(feature) for feature in fields["features"]
+        )
+        # Tags passed to the feature reports which were recorded in the timeline.
+        report_tags.extend(fields["tags"])
+
+        report = Report(
+            title=title,
+            tags=report_tags,
+            fields=fields,
+            renderer=render_session_summary,
+        )
         if publish:
             self.publish(report, wait=wait)
 
@@ -436,9 +1432,17 @@ Feature: {name}
     ) -> Callable:
         @wraps(callable)
         def wrapped_callable(*args, **kwargs):
-            parameters = {**kwargs}
+            if self.sampler is not None and not self.sampler.keep("feature"):
+                return callable(*args, **kwargs)
+
+            parameters = {
+                key: bounded_str(value, MAX_PARAMETER_VALUE_LENGTH)
+                for key, value in kwargs.items()
+            }
             for i, arg in enumerate(args):
-                parameters["arg.{}".format(i)] = str(arg)
+                parameters["arg.{}".format(i)] = bounded_str(
+                    arg, MAX_PARAMETER_VALUE_LENGTH
+                )
 
             self.feature_report(callable.__name__, parameters)
 
@@ -446,6 +1450,47 @@ Feature: {name}
 
         return wrapped_callable
 
+    def record_slow_calls(
+        self,
+        threshold_seconds: float = 1.0,
+        tags: Optional[List[str]] = None,
+        sampler: Optional[StackSampler] = None,
+    ) -> Callable[[Callable], Callable]:
+        """
+        Decorator which publishes a slow_call_report whenever a call to the decorated function takes
+        at least threshold_seconds. Calls are profiled by the given stack sampler (by default, the
+        process-wide one - see humbug.profiling). Calls which finish under the threshold cost two
+        clock reads and take no locks.
+        """
+        if sampler is None:
+            sampler = shared_sampler()
+
+        def decorator(callable: Callable) -> Callable:
+            def on_slow(
+                duration: float,
+                args: Tuple[Any, ...],
+                kwargs: Dict[str, Any],
+                stacks: List[Tuple[Stack, int]],
+            ) -> None:
+                if self.sampler is not None and not self.sampler.keep("slow_call"):
+                    return
+                parameters = {**kwargs}
+                for i, arg in enumerate(args):
+                    parameters["arg.{}".format(i)] = arg
+                self.slow_call_report(
+                    callable.__name__,
+                    duration,
+                    threshold_seconds,
+                    parameters,
+                    stacks=stacks,
+                    sample_interval_seconds=sampler.interval_seconds,
+                    tags=tags,
+                )
+
+            return sampler.watch(callable, threshold_seconds, on_slow)
+
+        return decorator
+
     def record_errors(
         self,
         callable: Callable,
@@ -502,6 +1547,81 @@ Feature: {name}
 
             self.is_excepthook_set = True
 
+    def _exception_queue(self) -> ExceptionQueue:
+        if self.exception_queue is None:
+            self.exception_queue = ExceptionQueue(self._report_captured_exception)
+            shutdown.coordinator.register_hook(self.exception_queue.flush)
+        return self.exception_queue
+
+    def _report_captured_exception(self, error: BaseException, tags: List[str]) -> None:
+        self.error_report(error, tags=tags)
+
+    def setup_thread_excepthook(self, tags: Optional[List[str]] = None) -> None:
+        """
+        Reports exceptions which are raised but not handled in threads other than the main thread.
+        The hook only queues the exception; its report is built and published in the background.
+        Only one hook will be added, no matter how many times you call this method.
+
+        threading.excepthook was added in Python 3.8. On earlier versions, this method does nothing
+        and exceptions in threads are not reported.
+
+        Docs: https://docs.python.org/3/library/threading.html#threading.excepthook
+        """
+        if not hasattr(threading, "excepthook"):
+            return
+        if not self.is_thread_excepthook_set:
+            original_excepthook = threading.excepthook
+            exception_queue = self._exception_queue()
+            hook_tags = ["site:thread"]
+            if tags is not None:
+                hook_tags.extend(tags)
+
+            def _hook(args):
+                if args.exc_value is not None:
+                    exception_queue.capture(
+                        args.exc_value, [*hook_tags, *self._scoped_tags.get()]
+                    )
+                original_excepthook(args)
+
+            threading.excepthook = _hook
+
+            self.is_thread_excepthook_set = True
+
+    def setup_loop_exception_handler(
+        self,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        tags: Optional[List[str]] = None,
+    ) -> None:
+        """
+        Reports exceptions which are not handled by asyncio tasks and callbacks running on the given
+        event loop (by default, the running loop). The handler only queues the exception, so the
+        loop is never blocked by reporting; the loop's previous exception handler is still called.
+        Only one handler will be added to each loop, no matter how many times you call this method.
+
+        Docs: https://docs.python.org/3/library/asyncio-eventloop.html#error-handling-api
+        """
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        if loop in self._handled_loops:
+            return
+        original_handler = loop.get_exception_handler()
+        exception_queue = self._exception_queue()
+        handler_tags = ["site:asyncio"]
+        if tags is not None:
+            handler_tags.extend(tags)
+
+        def _handler(loop, context):
+            error = context.get("exception")
+            if isinstance(error, BaseException):
+                exception_queue.capture(error, list(handler_tags))
+            if original_handler is None:
+                loop.default_exception_handler(context)
+            else:
+                original_handler(loop, context)
+
+        loop.set_exception_handler(_handler)
+        self._handled_loops.add(loop)
+
     def setup_notebook_excepthook(self, tags: Optional[List[str]] = None) -> None:
         """
         Excepthook for ipython, works with jupiter notebook.
@@ -566,26 +1686,37 @@ class Reporter(HumbugReporter):
         if self.bugout_journal_id is None:
             return
 
-        json = {"title": report.title, "content": report.content, "tags": report.tags}
+        json = {
+            "title": report.title,
+            "content": report.content,
+            "tags": list(report.tags),
+        }
         headers = {
             "Authorization": "Bearer {}".format(self.bugout_token),
         }
         url = "{}/journals/{}/entries".format(self.url, self.bugout_journal_id)
 
-        try:
-            report.tags = list(set(report.tags))
-            if wait or self.executor is None:
-                requests.post(
-                    url=url, headers=headers, json=json, timeout=self.timeout_seconds
-                )
-            else:
-                report_future = self.executor.submit(
-                    requests.post,
-                    url=url,
-                    headers=headers,
-                    json=json,
-                    timeout=self.timeout_seconds,
-                )
-                self.report_futures.append(report_future)
-        except Exception:
-            pass
+        self._deliver(
+            Delivery(
+                url=url,
+                headers=headers,
+                body=json,
+                timeout=self.timeout_seconds,
+                priority=report_priority(report),
+                idempotency_key=report.report_id,
+                redactor=self.redactor,
+            ),
+            wait=wait,
+        )
+
+
+_reporters: "weakref.WeakSet[HumbugReporter]" = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    for reporter in list(_reporters):
+        reporter._after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
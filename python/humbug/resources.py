@@ -0,0 +1,214 @@
+"""
+This module implements the background sampler behind Humbug's periodic resource usage reports.
+"""
+from dataclasses import dataclass
+import gc
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+import weakref
+
+from .memory import rss_bytes
+
+
+def open_file_descriptors() -> Optional[int]:
+    """
+    Number of file descriptors this process has open, or None if it cannot be determined on this
+    platform.
+    """
+    for directory in ("/proc/self/fd", "/dev/fd"):
+        try:
+            # Listing the directory takes a file descriptor of its own.
+            return len(os.listdir(directory)) - 1
+        except OSError:
+            continue
+    return None
+
+
+@dataclass
+class MetricSummary:
+    """
+    Minimum, mean, and maximum of the values observed for a single metric.
+    """
+
+    samples: int = 0
+    total: float = 0.0
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
+
+    def observe(self, value: Optional[float]) -> None:
+        if value is None:
+            return
+        self.samples += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def summary(self) -> Optional[Dict[str, Any]]:
+        if self.samples == 0:
+            return None
+        return {
+            "min": self.minimum,
+            "mean": self.total / self.samples,
+            "max": self.maximum,
+        }
+
+
+class GCMonitor:
+    """
+    GCMonitor counts garbage collections per generation and measures their pause times, using
+    gc.callbacks.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._started: Optional[float] = None
+        self._installed = False
+        self._collections: List[int] = [0] * len(gc.get_count())
+        self._pause = 0.0
+        self._max_pause = 0.0
+
+    def reset(self) -> Dict[str, Any]:
+        """
+        Returns the collections (per generation) and pause times observed since the last reset, and
+        starts over.
+        """
+        with self._lock:
+            observed = {
+                "collections": self._collections,
+                "pause_ms": self._pause * 1000,
+                "max_pause_ms": self._max_pause * 1000,
+            }
+            self._collections = [0] * len(self._collections)
+            self._pause = 0.0
+            self._max_pause = 0.0
+        return observed
+
+    def install(self) -> None:
+        if not self._installed:
+            gc.callbacks.append(self._callback)
+            self._installed = True
+
+    def uninstall(self) -> None:
+        if self._installed:
+            gc.callbacks.remove(self._callback)
+            self._installed = False
+
+    def _callback(self, phase: str, info: Dict[str, Any]) -> None:
+        if phase == "start":
+            self._started = time.perf_counter()
+            return
+        if self._started is None:
+            return
+        pause = time.perf_counter() - self._started
+        self._started = None
+        with self._lock:
+            generation = info.get("generation", 0)
+            if 0 <= generation < len(self._collections):
+                self._collections[generation] += 1
+            self._pause += pause
+            self._max_pause = max(self._max_pause, pause)
+
+
+class ResourceSampler:
+    """
+    ResourceSampler samples this process's CPU usage, RSS, open file descriptors and thread count
+    every interval_seconds from a background daemon thread. Every period_seconds, it calls
+    on_period with a summary of the period: the CPU time used, the minimum, mean and maximum of each
+    sampled metric, and the garbage collections (and their pause times) that happened during the
+    period.
+
+    Each sample costs a few system calls, and garbage collections are timed from gc.callbacks, so
+    the sampler adds little overhead at the default interval.
+
+    The sampler thread does not survive a fork. In a forked child, call start() to restart it.
+    """
+
+    def __init__(
+        self,
+        on_period: Callable[[Dict[str, Any]], Any],
+        interval_seconds: float = 10.0,
+        period_seconds: float = 300.0,
+    ) -> None:
+        self.on_period = on_period
+        self.interval_seconds = interval_seconds
+        self.period_seconds = max(period_seconds, interval_seconds)
+        self.gc_monitor = GCMonitor()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        _samplers.add(self)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self.gc_monitor.install()
+        self._thread = threading.Thread(
+            target=self._run, name="humbug_resource_sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops sampling. The summary of the current, partial period is discarded.
+        """
+        self._stopped.set()
+        self.gc_monitor.uninstall()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._run_period()
+
+    def _run_period(self) -> None:
+        started_at = int(time.time())
+        period_start = time.monotonic()
+        cpu_start = time.process_time()
+        self.gc_monitor.reset()
+
+        cpu_percent = MetricSummary()
+        rss = MetricSummary()
+        file_descriptors = MetricSummary()
+        threads = MetricSummary()
+
+        last_wall, last_cpu = period_start, cpu_start
+        while time.monotonic() - period_start < self.period_seconds:
+            if self._stopped.wait(self.interval_seconds):
+                return
+            wall, cpu = time.monotonic(), time.process_time()
+            if wall > last_wall:
+                cpu_percent.observe(100 * (cpu - last_cpu) / (wall - last_wall))
+            last_wall, last_cpu = wall, cpu
+            rss.observe(rss_bytes())
+            file_descriptors.observe(open_file_descriptors())
+            threads.observe(threading.active_count())
+
+        fields = {
+            "started_at": started_at,
+            "duration_ms": int((last_wall - period_start) * 1000),
+            "cpu_seconds": last_cpu - cpu_start,
+            "cpu_percent": cpu_percent.summary(),
+            "rss_bytes": rss.summary(),
+            "open_file_descriptors": file_descriptors.summary(),
+            "threads": threads.summary(),
+            "gc": self.gc_monitor.reset(),
+        }
+        try:
+            self.on_period(fields)
+        except Exception:
+            pass
+
+    def _after_fork_in_child(self) -> None:
+        self._thread = None
+
+
+_samplers: "weakref.WeakSet[ResourceSampler]" = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    for sampler in list(_samplers):
+        sampler._after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,56 @@
+"""
+This module implements deterministic, hash-based sampling of Humbug reports.
+"""
+import hashlib
+from typing import Dict, List, Optional
+
+SAMPLE_RATE_TAG_PREFIX = "sample_rate:"
+
+
+def sample_fraction(key: str, salt: str = "") -> float:
+    """
+    Maps a key (for example, a client ID) to a number in [0, 1). The same key and salt always map
+    to the same number, and different keys are spread uniformly over the interval.
+    """
+    digest = hashlib.sha256("{}:{}".format(salt, key).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+
+class Sampler:
+    """
+    Sampler decides, once and for all, which types of reports are kept for a given sampling key.
+
+    rates maps report types (the value of a report's "type:" tag, e.g. "feature") to the fraction
+    of sampling keys for which reports of that type should be kept. Types without a rate are always
+    kept. Because the decision depends only on the key, a client (or session) that is sampled in
+    is sampled in for every report it generates, so its journey stays intact.
+    """
+
+    def __init__(self, key: str, rates: Dict[str, float], salt: str = "") -> None:
+        self.key = key
+        self.rates = {
+            report_type: min(1.0, max(0.0, rate)) for report_type, rate in rates.items()
+        }
+        fraction = sample_fraction(key, salt)
+        self._kept = {
+            report_type: fraction < rate for report_type, rate in self.rates.items()
+        }
+        self._tags = {
+            report_type: ["{}{}".format(SAMPLE_RATE_TAG_PREFIX, rate)]
+            for report_type, rate in self.rates.items()
+            if rate < 1.0
+        }
+
+    def keep(self, report_type: Optional[str]) -> bool:
+        if report_type is None:
+            return True
+        return self._kept.get(report_type, True)
+
+    def tags(self, report_type: Optional[str]) -> List[str]:
+        """
+        Tags recording the sample rate applied to reports of the given type, so that counts can be
+        scaled back up on the backend. Types which are not sampled get no tags.
+        """
+        if report_type is None:
+            return []
+        return self._tags.get(report_type, [])
@@ -0,0 +1,105 @@
+"""
+This module implements the serializers Humbug uses to encode report payloads for the wire.
+
+JSON is encoded with orjson if it is installed and with the standard library otherwise. MessagePack
+encoding requires the msgpack package and an endpoint (for example, a local collector) which
+accepts it - the Bugout API accepts JSON.
+"""
+from abc import ABC, abstractmethod
+import json
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None  # type: ignore
+
+try:
+    import msgpack  # type: ignore
+except ImportError:
+    msgpack = None  # type: ignore
+
+
+# Hosts (and their subdomains) which only accept JSON request bodies.
+JSON_ONLY_HOSTS = ("bugout.dev",)
+
+
+class Serializer(ABC):
+    """
+    Encodes request bodies as bytes of a single content type.
+    """
+
+    name = "serializer"
+    content_type = "application/octet-stream"
+
+    @abstractmethod
+    def dumps(self, body: Dict[str, Any]) -> bytes:
+        pass
+
+
+class JSONSerializer(Serializer):
+    """
+    Encodes request bodies as compact JSON, using orjson when it is available. Bodies which orjson
+    cannot encode (for example, integers with more than 64 bits) fall back to the standard library.
+    """
+
+    name = "json"
+    content_type = "application/json"
+
+    def __init__(self, use_orjson: bool = True) -> None:
+        self.use_orjson = use_orjson and orjson is not None
+
+    def dumps(self, body: Dict[str, Any]) -> bytes:
+        if self.use_orjson:
+            try:
+                return orjson.dumps(body, default=str)
+            except TypeError:
+                pass
+        return json.dumps(body, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class MsgpackSerializer(Serializer):
+    """
+    Encodes request bodies as MessagePack. Requires the msgpack package.
+    """
+
+    name = "msgpack"
+    content_type = "application/msgpack"
+
+    def __init__(self) -> None:
+        if msgpack is None:
+            raise ImportError("MsgpackSerializer requires msgpack: pip install msgpack")
+
+    def dumps(self, body: Dict[str, Any]) -> bytes:
+        return msgpack.packb(body, default=str, use_bin_type=True)
+
+
+def check_endpoint(serializer: Serializer, url: str) -> None:
+    """
+    Raises ValueError if url belongs to an API which only accepts JSON and serializer does not
+    encode JSON - deliveries which such an API rejects would otherwise be dropped without notice.
+    """
+    if serializer.content_type == JSONSerializer.content_type:
+        return
+    host = (urlparse(url).hostname or "").lower()
+    for json_only_host in JSON_ONLY_HOSTS:
+        if host == json_only_host or host.endswith("." + json_only_host):
+            raise ValueError(
+                "{} only accepts JSON, so it cannot be used with the {} serializer".format(
+                    url, serializer.name
+                )
+            )
+
+
+_default_serializer: Optional[Serializer] = None
+
+
+def default_serializer() -> Serializer:
+    """
+    The serializer used for deliveries which do not specify one: JSON.
+    """
+    global _default_serializer
+    if _default_serializer is None:
+        _default_serializer = JSONSerializer()
+    return _default_serializer
@@ -0,0 +1,281 @@
+"""
+This module implements Humbug's process-wide shutdown coordinator.
+
+Rather than having every reporter block interpreter shutdown on its own, all dispatchers register
+with a single coordinator which flushes them in parallel against one global deadline. Error reports
+are sent first. Anything that cannot be sent before the deadline is either written to a spool
+directory (from which it can be replayed later) or dropped.
+"""
+import atexit
+from collections import deque
+from dataclasses import dataclass
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+import uuid
+import weakref
+
+from .dispatch import Delivery, Dispatcher, send
+
+DEFAULT_SHUTDOWN_TIMEOUT_SECONDS = 3.0
+SHUTDOWN_TIMEOUT_ENV = "HUMBUG_SHUTDOWN_TIMEOUT"
+SPOOL_DIRECTORY_ENV = "HUMBUG_SPOOL_DIR"
+SPOOL_FILE_PREFIX = "humbug-spool-"
+
+
+@dataclass
+class FlushResult:
+    """
+    The outcome of a flush. attempted counts the deliveries whose requests were started, and sent
+    counts those whose requests had succeeded by the time the flush returned. Deliveries which were
+    never attempted are either spooled or dropped.
+    """
+
+    attempted: int = 0
+    sent: int = 0
+    spooled: int = 0
+    dropped: int = 0
+
+
+def _timeout_from_environment() -> float:
+    raw_timeout = os.environ.get(SHUTDOWN_TIMEOUT_ENV)
+    if raw_timeout is None:
+        return DEFAULT_SHUTDOWN_TIMEOUT_SECONDS
+    try:
+        return max(0.0, float(raw_timeout))
+    except ValueError:
+        return DEFAULT_SHUTDOWN_TIMEOUT_SECONDS
+
+
+class ShutdownCoordinator:
+    """
+    ShutdownCoordinator flushes all registered dispatchers against a single deadline.
+    """
+
+    def __init__(
+        self,
+        timeout_seconds: Optional[float] = None,
+        spool_directory: Optional[str] = None,
+        max_workers: int = 4,
+    ) -> None:
+        if timeout_seconds is None:
+            timeout_seconds = _timeout_from_environment()
+        if spool_directory is None:
+            spool_directory = os.environ.get(SPOOL_DIRECTORY_ENV)
+        self.timeout_seconds = timeout_seconds
+        self.spool_directory = spool_directory
+        self.max_workers = max_workers
+        self._dispatchers: "weakref.WeakSet[Dispatcher]" = weakref.WeakSet()
+        self._hooks: List["weakref.WeakMethod[Callable[[], Any]]"] = []
+        self._after_hooks: List["weakref.WeakMethod[Callable[[], Any]]"] = []
+        self._lock = threading.Lock()
+
+    def register(self, dispatcher: Dispatcher) -> None:
+        with self._lock:
+            self._dispatchers.add(dispatcher)
+
+    def unregister(self, dispatcher: Dispatcher) -> None:
+        with self._lock:
+            self._dispatchers.discard(dispatcher)
+
+    def register_hook(self, hook: Callable[[], Any], after: bool = False) -> None:
+        """
+        Registers a bound method which is called at the start of every flush, so that reports which
+        are buffered in memory can be published before pending deliveries are collected. If after
+        is True, the method is instead called at the end of every flush, once all deliveries have
+        been sent, spooled, or dropped. Only a weak reference to the method's object is kept.
+        """
+        with self._lock:
+            if after:
+                self._after_hooks.append(weakref.WeakMethod(hook))
+            else:
+                self._hooks.append(weakref.WeakMethod(hook))
+
+    @staticmethod
+    def _call_hooks(hooks: List["weakref.WeakMethod[Callable[[], Any]]"]) -> None:
+        for hook in hooks:
+            method = hook()
+            if method is None:
+                continue
+            try:
+                method()
+            except Exception:
+                pass
+
+    def flush(self, timeout_seconds: Optional[float] = None) -> FlushResult:
+        """
+        Sends every pending delivery from every registered dispatcher, error reports first, using up
+        to max_workers parallel connections. Returns once everything has been sent or the deadline
+        has passed. Deliveries which were never attempted are spooled if a spool directory is
+        configured and dropped otherwise.
+
+        The calling thread sends deliveries itself, alongside up to max_workers - 1 extra threads.
+        When the flush runs at exit, Python 3.12 may refuse to start those threads, in which case
+        the calling thread sends everything on its own.
+        """
+        if timeout_seconds is None:
+            timeout_seconds = self.timeout_seconds
+        deadline = time.monotonic() + timeout_seconds
+
+        with self._lock:
+            self._hooks = [hook for hook in self._hooks if hook() is not None]
+            self._after_hooks = [
+                hook for hook in self._after_hooks if hook() is not None
+            ]
+            hooks = list(self._hooks)
+            after_hooks = list(self._after_hooks)
+        self._call_hooks(hooks)
+
+        with self._lock:
+            dispatchers = list(self._dispatchers)
+
+        deliveries: List[Delivery] = []
+        for dispatcher in dispatchers:
+            deliveries.extend(dispatcher.drain())
+        # sorted is stable, so deliveries of equal priority keep their submission order.
+        queue: Deque[Delivery] = deque(
+            sorted(deliveries, key=lambda delivery: delivery.priority)
+        )
+        queue_lock = threading.Lock()
+        result = FlushResult()
+        # Set once the flush returns, so that requests which complete after the deadline do not
+        # change a result the caller already has.
+        finished = False
+
+        def worker() -> None:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                with queue_lock:
+                    if not queue:
+                        return
+                    delivery = queue.popleft()
+                    result.attempted += 1
+                delivery.timeout = min(delivery.timeout, remaining)
+                try:
+                    send(delivery)
+                except Exception:
+                    continue
+                with queue_lock:
+                    if not finished:
+                        result.sent += 1
+
+        workers: List[threading.Thread] = []
+        for _ in range(min(self.max_workers, len(queue)) - 1):
+            thread = threading.Thread(
+                target=worker, name="humbug_shutdown", daemon=True
+            )
+            try:
+                thread.start()
+            except RuntimeError:
+                # "can't create new thread at interpreter shutdown"
+                break
+            workers.append(thread)
+        worker()
+        for thread in workers:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+        # Give reports which were already in flight when the flush started a chance to complete.
+        for dispatcher in dispatchers:
+            dispatcher.flush(max(0.0, deadline - time.monotonic()))
+
+        with queue_lock:
+            leftovers = list(queue)
+            queue.clear()
+            finished = True
+        if leftovers:
+            if self.spool_directory is not None and spool(
+                self.spool_directory, leftovers
+            ):
+                result.spooled = len(leftovers)
+            else:
+                result.dropped = len(leftovers)
+
+        self._call_hooks(after_hooks)
+        return result
+
+
+def spool(directory: str, deliveries: List[Delivery]) -> bool:
+    """
+    Writes the given deliveries to a new file in the spool directory. Request headers are not
+    written to disk, so that access tokens never end up in the spool, but idempotency keys are.
+    Returns True on success.
+    """
+    try:
+        os.makedirs(directory, exist_ok=True)
+        spool_file = os.path.join(
+            directory, "{}{}.jsonl".format(SPOOL_FILE_PREFIX, uuid.uuid4())
+        )
+        with open(spool_file, "w") as ofp:
+            for delivery in deliveries:
+                delivery.redact()
+                item = {"url": delivery.url, "body": delivery.body}
+                if delivery.idempotency_key is not None:
+                    item["idempotency_key"] = delivery.idempotency_key
+                print(json.dumps(item), file=ofp)
+    except Exception:
+        return False
+    return True
+
+
+def read_spool(
+    directory: str, remove: bool = True
+) -> Iterator[Tuple[str, Dict[str, Any], Optional[str]]]:
+    """
+    Yields (url, body, idempotency key) triples for every delivery stored in the spool directory.
+    If remove is True, each spool file is deleted once it has been read in full.
+    """
+    if not os.path.isdir(directory):
+        return
+    for filename in sorted(os.listdir(directory)):
+        if not filename.startswith(SPOOL_FILE_PREFIX):
+            continue
+        spool_file = os.path.join(directory, filename)
+        try:
+            with open(spool_file) as ifp:
+                items = [json.loads(line) for line in ifp if line.strip()]
+        except Exception:
+            continue
+        for item in items:
+            yield item["url"], item["body"], item.get("idempotency_key")
+        if remove:
+            try:
+                os.remove(spool_file)
+            except OSError:
+                pass
+
+
+coordinator = ShutdownCoordinator()
+atexit.register(coordinator.flush)
+
+_multiprocessing_finalizer_registered = False
+
+
+def _register_multiprocessing_finalizer(_: ShutdownCoordinator) -> None:
+    multiprocessing_util = sys.modules["multiprocessing.util"]
+    multiprocessing_util.Finalize(None, coordinator.flush, exitpriority=0)
+
+
+def _after_fork_in_child() -> None:
+    global _multiprocessing_finalizer_registered
+    coordinator._lock = threading.Lock()
+
+    # Processes started by multiprocessing exit through os._exit, which skips atexit handlers. They
+    # do run multiprocessing's own finalizers, so we flush from one of those instead. Finalizers are
+    # cleared when a multiprocessing child starts, which is why the finalizer itself is registered
+    # by an after-fork callback. The flag is inherited by grandchildren, whose after-fork registry
+    # already contains the callback.
+    multiprocessing_util = sys.modules.get("multiprocessing.util")
+    if multiprocessing_util is not None and not _multiprocessing_finalizer_registered:
+        multiprocessing_util.register_after_fork(
+            coordinator, _register_multiprocessing_finalizer
+        )
+        _multiprocessing_finalizer_registered = True
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
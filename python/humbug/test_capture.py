@@ -0,0 +1,45 @@
+import threading
+import unittest
+
+from . import capture
+
+
+class TestExceptionQueue(unittest.TestCase):
+    def test_exceptions_are_handled_in_background(self):
+        handled = []
+        done = threading.Event()
+
+        def on_exception(error, tags):
+            handled.append((error, tags, threading.current_thread()))
+            done.set()
+
+        queue = capture.ExceptionQueue(on_exception)
+        error = ValueError("background")
+        queue.capture(error, ["site:test"])
+        self.assertTrue(done.wait(5))
+        handled_error, tags, thread = handled[0]
+        self.assertIs(handled_error, error)
+        self.assertListEqual(tags, ["site:test"])
+        self.assertIsNot(thread, threading.current_thread())
+
+    def test_oldest_exceptions_are_dropped(self):
+        handled = []
+        release = threading.Event()
+
+        def on_exception(error, tags):
+            release.wait(5)
+            handled.append(str(error))
+
+        queue = capture.ExceptionQueue(on_exception, max_pending=2)
+        # The background thread may pick up the first exception before the others are captured.
+        for i in range(4):
+            queue.capture(ValueError(str(i)), [])
+        self.assertGreaterEqual(queue.dropped, 1)
+        release.set()
+        queue.flush()
+        self.assertIn("3", handled)
+        self.assertNotIn("1", handled)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from . import cardinality
+
+
+class TestCardinalityLimiter(unittest.TestCase):
+    def test_budget_collapses_to_other(self):
+        limiter = cardinality.CardinalityLimiter(max_distinct_values=2)
+        tags = [limiter.tag("path", "/tmp/{}".format(i)) for i in range(4)]
+        self.assertListEqual(
+            tags,
+            [
+                "parameter:path=/tmp/0",
+                "parameter:path=/tmp/1",
+                "parameter:path=other",
+                "parameter:path=other",
+            ],
+        )
+        # Values already within the budget keep their tag.
+        self.assertEqual(limiter.tag("path", "/tmp/0"), "parameter:path=/tmp/0")
+        self.assertEqual(limiter.dropped["path"], 2)
+
+    def test_allowlist(self):
+        limiter = cardinality.CardinalityLimiter(allowlists={"mode": ["fast", "slow"]})
+        self.assertEqual(limiter.tag("mode", "fast"), "parameter:mode=fast")
+        self.assertEqual(limiter.tag("mode", "turbo"), "parameter:mode=other")
+        self.assertEqual(limiter.tag("other_key", "turbo"), "parameter:other_key=turbo")
+        self.assertEqual(limiter.dropped["mode"], 1)
+
+    def test_bucketers(self):
+        limiter = cardinality.CardinalityLimiter(
+            bucketers={
+                "size": cardinality.numeric_buckets([10, 100]),
+                "user": cardinality.hash_value,
+            }
+        )
+        self.assertEqual(limiter.tag("size", 5), "parameter:size=<10")
+        self.assertEqual(limiter.tag("size", "50"), "parameter:size=10-100")
+        self.assertEqual(limiter.tag("size", 500), "parameter:size=>=100")
+        self.assertEqual(limiter.tag("size", "lots"), "parameter:size=other")
+        self.assertEqual(
+            limiter.tag("user", "neeraj"),
+            "parameter:user={}".format(cardinality.hash_value("neeraj")),
+        )
+
+    def test_max_tag_length(self):
+        limiter = cardinality.CardinalityLimiter(max_tag_length=20)
+        tag = limiter.tag("object", "x" * 100)
+        self.assertEqual(len(tag), 20)
+        self.assertEqual(limiter.truncated["object"], 1)
+        self.assertDictEqual(
+            limiter.counts(), {"dropped": {}, "truncated": {"object": 1}}
+        )
+
+    def test_bounded_str(self):
+        self.assertEqual(cardinality.bounded_str("x" * 1000, 10), "x" * 10)
+        self.assertEqual(cardinality.bounded_str(12345, 3), "123")
+        self.assertEqual(cardinality.bounded_str(b"abcdef", 20), "b'abcdef'"[:20])
+        large = list(range(10**6))
+        self.assertEqual(cardinality.bounded_str(large, 100), "[0, 1, 2, 3, 4, 5, ...]")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from . import dedup
+
+
+class TestDedupCache(unittest.TestCase):
+    def test_least_recently_used_keys_are_evicted(self):
+        cache = dedup.DedupCache(max_entries=2)
+        cache.add("a")
+        cache.add("b")
+        self.assertIn("a", cache)
+        cache.add("c")
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_keys_expire(self):
+        cache = dedup.DedupCache(ttl_seconds=60)
+        now = time.time()
+        with patch.object(dedup.time, "time", return_value=now):
+            cache.add("a")
+            self.assertIn("a", cache)
+        with patch.object(dedup.time, "time", return_value=now + 61):
+            self.assertNotIn("a", cache)
+        self.assertEqual(len(cache), 0)
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache", "delivered.json")
+            cache = dedup.DedupCache(ttl_seconds=60, path=path)
+            now = time.time()
+            with patch.object(dedup.time, "time", return_value=now - 120):
+                cache.add("expired")
+            cache.add("a")
+            cache.save()
+
+            reloaded = dedup.DedupCache(ttl_seconds=60, path=path)
+            self.assertIn("a", reloaded)
+            self.assertNotIn("expired", reloaded)
+            self.assertEqual(len(reloaded), 1)
+
+    def test_missing_or_corrupt_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "delivered.json")
+            self.assertEqual(len(dedup.DedupCache(path=path)), 0)
+            with open(path, "w") as ofp:
+                ofp.write("not json")
+            self.assertEqual(len(dedup.DedupCache(path=path)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,384 @@
+from collections import deque
+import os
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import requests
+
+from . import dispatch
+
+
+class TestDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = dispatch.Dispatcher(thread_name="humbug_test_dispatcher")
+
+    def delivery(self, priority=dispatch.PRIORITY_DEFAULT, **kwargs):
+        return dispatch.Delivery(
+            url="http://localhost/humbug/reports",
+            headers={},
+            body=kwargs,
+            timeout=1.0,
+            priority=priority,
+        )
+
+    def blocked_dispatcher(self, **kwargs):
+        """
+        Returns a single-worker dispatcher whose worker is busy until self.release is set.
+        """
+        dispatcher = dispatch.Dispatcher(
+            thread_name="humbug_test_lanes", max_workers=1, **kwargs
+        )
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        started = threading.Event()
+
+        def blocking_send(delivery, *args):
+            if delivery.body.get("n") != "blocker":
+                return
+            started.set()
+            self.release.wait()
+
+        with patch.object(dispatch, "send", side_effect=blocking_send):
+            dispatcher.submit(self.delivery(n="blocker"))
+            started.wait(5)
+        return dispatcher
+
+    def test_submit_sends_in_background(self):
+        with patch.object(dispatch, "send") as send:
+            self.dispatcher.submit(self.delivery(n=1))
+            self.dispatcher.submit(self.delivery(n=2))
+            self.assertTrue(self.dispatcher.flush(timeout=5))
+        self.assertEqual([call[0][0].body["n"] for call in send.call_args_list], [1, 2])
+        self.assertEqual(self.dispatcher.pending(), 0)
+
+    def test_thread_buffers(self):
+        dispatcher = dispatch.Dispatcher(
+            thread_name="humbug_test_buffers", thread_buffers=True
+        )
+        sent = []
+
+        def record_send(delivery, *args):
+            if delivery.body.get("buffered"):
+                sent.append(delivery.body["n"])
+
+        def produce(thread_index):
+            for i in range(50):
+                dispatcher.submit(self.delivery(n=(thread_index, i), buffered=True))
+
+        with patch.object(dispatch, "send", side_effect=record_send):
+            threads = [threading.Thread(target=produce, args=(i,)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertTrue(dispatcher.flush(timeout=5))
+        self.assertEqual(len(sent), 400)
+        self.assertEqual(len(set(sent)), 400)
+        self.assertEqual(dispatcher.pending(), 0)
+        self.assertEqual(dispatcher.stats()[dispatch.PRIORITY_DEFAULT].submitted, 400)
+
+    def test_flush_while_draining(self):
+        dispatcher = dispatch.Dispatcher(
+            thread_name="humbug_test_flush_while_draining",
+            max_workers=1,
+            thread_buffers=True,
+        )
+        merging = threading.Event()
+        resume = threading.Event()
+        # Keeps the worker from completing the delivery until pending() has been read.
+        release = threading.Event()
+        self.addCleanup(resume.set)
+        self.addCleanup(release.set)
+
+        class PausingBuffer(deque):
+            # Pauses the drainer after it has taken the deliveries out of this buffer, but before
+            # it has added them to the lanes.
+            paused = False
+
+            def popleft(self):
+                if not self and not PausingBuffer.paused:
+                    PausingBuffer.paused = True
+                    merging.set()
+                    resume.wait(5)
+                return super().popleft()
+
+        buffer = PausingBuffer()
+        dispatcher._local.buffer = buffer
+        dispatcher._buffers.append((threading.current_thread(), buffer))
+        sent = []
+        pending = []
+        flushed = []
+
+        def blocking_send(delivery, *args):
+            release.wait(5)
+            sent.append(delivery)
+
+        def flush():
+            pending.append(dispatcher.pending())
+            flushed.append(dispatcher.flush(timeout=5))
+
+        with patch.object(dispatch, "send", side_effect=blocking_send):
+            dispatcher.submit(self.delivery(n=1))
+            self.assertTrue(merging.wait(5))
+            flusher = threading.Thread(target=flush)
+            flusher.start()
+            # The delivery is in neither the buffer nor a lane, so pending() and the flush must
+            # wait for the drainer rather than report that nothing is pending.
+            flusher.join(0.1)
+            self.assertEqual(pending, [])
+            resume.set()
+            deadline = time.monotonic() + 5
+            while not pending and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(pending, [1])
+            self.assertEqual(flushed, [])
+            release.set()
+            flusher.join(5)
+        self.assertEqual(flushed, [True])
+        self.assertEqual(len(sent), 1)
+
+    def test_thread_buffer_drainer_restarts(self):
+        dispatcher = dispatch.Dispatcher(
+            thread_name="humbug_test_drainer",
+            thread_buffers=True,
+            idle_timeout_seconds=0.05,
+        )
+        sent = threading.Semaphore(0)
+
+        def record_send(delivery, *args):
+            if delivery.body.get("drained"):
+                sent.release()
+
+        with patch.object(dispatch, "send", side_effect=record_send):
+            dispatcher.submit(self.delivery(n=1, drained=True))
+            self.assertTrue(sent.acquire(timeout=5))
+            deadline = time.monotonic() + 5
+            while dispatcher._drainer is not None and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertIsNone(dispatcher._drainer)
+            # The next submission starts a new drainer, without waiting for a flush.
+            dispatcher.submit(self.delivery(n=2, drained=True))
+            self.assertTrue(sent.acquire(timeout=5))
+
+    def test_worker_start_failure(self):
+        dispatcher = dispatch.Dispatcher(thread_name="humbug_test_start_failure")
+        with patch.object(
+            dispatch.threading.Thread,
+            "start",
+            side_effect=RuntimeError("can't create new thread at interpreter shutdown"),
+        ):
+            dispatcher.submit(self.delivery(n=1))
+        # The delivery stays queued, and no worker is counted for the thread that never started.
+        self.assertEqual(dispatcher.workers(), 0)
+        self.assertEqual(dispatcher.pending(), 1)
+        self.assertEqual([delivery.body for delivery in dispatcher.drain()], [{"n": 1}])
+
+    def test_flush_times_out(self):
+        release = threading.Event()
+        with patch.object(dispatch, "send", side_effect=lambda *_: release.wait()):
+            self.dispatcher.submit(self.delivery(n=1))
+            self.assertFalse(self.dispatcher.flush(timeout=0.05))
+            release.set()
+            self.assertTrue(self.dispatcher.flush(timeout=5))
+
+    def test_workers_scale_up_and_down(self):
+        dispatcher = dispatch.Dispatcher(
+            thread_name="humbug_test_autoscaling",
+            max_workers=3,
+            idle_timeout_seconds=0.05,
+        )
+        self.assertEqual(dispatcher.workers(), 0)
+        release = threading.Event()
+        with patch.object(dispatch, "send", side_effect=lambda *_: release.wait()):
+            for i in range(10):
+                dispatcher.submit(self.delivery(n=i))
+            self.assertEqual(dispatcher.workers(), 3)
+            release.set()
+            self.assertTrue(dispatcher.flush(timeout=5))
+
+        deadline = time.monotonic() + 5
+        while dispatcher.workers() > 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(dispatcher.workers(), 0)
+
+    def test_fast_sends_do_not_scale_up(self):
+        dispatcher = dispatch.Dispatcher(
+            thread_name="humbug_test_autoscaling", max_workers=3
+        )
+        with patch.object(dispatch, "send"):
+            for i in range(5):
+                dispatcher.submit(self.delivery(n=i))
+                self.assertTrue(dispatcher.flush(timeout=5))
+        self.assertEqual(dispatcher.workers(), 1)
+
+    def test_errors_are_sent_first(self):
+        dispatcher = self.blocked_dispatcher()
+        dispatcher.submit(self.delivery(n="feature"))
+        dispatcher.submit(self.delivery(dispatch.PRIORITY_LOGGING, n="log"))
+        dispatcher.submit(self.delivery(dispatch.PRIORITY_ERROR, n="error"))
+        with patch.object(dispatch, "send") as send:
+            self.release.set()
+            self.assertTrue(dispatcher.flush(timeout=5))
+        self.assertEqual(
+            [call[0][0].body["n"] for call in send.call_args_list],
+            ["error", "log", "feature"],
+        )
+        stats = dispatcher.stats()
+        self.assertEqual(stats[dispatch.PRIORITY_ERROR].sent, 1)
+        self.assertEqual(stats[dispatch.PRIORITY_DEFAULT].sent, 2)
+        self.assertGreater(stats[dispatch.PRIORITY_DEFAULT].max_latency, 0)
+
+    def test_lowest_priority_is_shed_first(self):
+        dispatcher = self.blocked_dispatcher(max_pending=2)
+        dispatcher.submit(self.delivery(n="feature-1"))
+        dispatcher.submit(self.delivery(n="feature-2"))
+        dispatcher.submit(self.delivery(dispatch.PRIORITY_ERROR, n="error"))
+        dispatcher.submit(self.delivery(n="feature-3"))
+        self.assertEqual(
+            [delivery.body["n"] for delivery in dispatcher.drain()],
+            ["error", "feature-2"],
+        )
+        stats = dispatcher.stats()
+        self.assertEqual(stats[dispatch.PRIORITY_DEFAULT].shed, 2)
+        self.assertEqual(stats[dispatch.PRIORITY_ERROR].shed, 0)
+
+    @unittest.skipUnless(hasattr(os, "register_at_fork"), "requires os.fork")
+    def test_dispatcher_resets_in_forked_child(self):
+        dispatcher = self.blocked_dispatcher()
+        dispatcher.submit(self.delivery(n="parent"))
+
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                if dispatcher.pending() == 0 and dispatcher.workers() == 0:
+                    with patch.object(dispatch, "send") as send:
+                        dispatcher.submit(self.delivery(n="child"))
+                        if dispatcher.flush(timeout=5) and send.call_count == 1:
+                            status = 0
+            finally:
+                os._exit(status)
+
+        _, wait_status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(wait_status), 0)
+        self.assertEqual(dispatcher.pending(), 2)
+
+    def test_drain_leaves_in_flight_delivery(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocking_send(delivery, *args):
+            # Workers left over from other tests may also send while send is patched.
+            if delivery.body.get("n") != 1:
+                return
+            started.set()
+            release.wait()
+
+        with patch.object(dispatch, "send", side_effect=blocking_send):
+            self.dispatcher.submit(self.delivery(n=1))
+            started.wait(5)
+            self.dispatcher.submit(self.delivery(n=2))
+            drained = self.dispatcher.drain()
+            release.set()
+            self.assertTrue(self.dispatcher.flush(timeout=5))
+        self.assertEqual([delivery.body["n"] for delivery in drained], [2])
+
+    def test_latency_estimator(self):
+        estimator = dispatch.LatencyEstimator(window=100, min_samples=10)
+        self.assertIsNone(estimator.quantile(0.99))
+        for i in range(200):
+            estimator.observe(i / 100)
+        self.assertEqual(len(estimator), 100)
+        self.assertAlmostEqual(estimator.quantile(0.5), 1.5)
+        self.assertAlmostEqual(estimator.quantile(0.99), 1.99)
+
+    def test_adaptive_timeouts(self):
+        dispatcher = dispatch.Dispatcher(
+            thread_name="humbug_test_adaptive", adaptive_timeouts=True
+        )
+        timeouts = []
+
+        def record_timeout(delivery, *args):
+            if delivery.body.get("adaptive"):
+                timeouts.append(args[1])
+
+        with patch.object(dispatch, "send", side_effect=record_timeout):
+            for i in range(30):
+                delivery = self.delivery(n=i, adaptive=True)
+                delivery.timeout = 10.0
+                dispatcher.submit(delivery)
+                self.assertTrue(dispatcher.flush(timeout=5))
+        # Until enough latencies have been observed, deliveries use their own timeouts.
+        self.assertEqual(timeouts[0], 10.0)
+        self.assertEqual(timeouts[-1], dispatcher.min_timeout_seconds)
+
+        # Timeouts are only adaptive if the dispatcher opts in.
+        for _ in range(30):
+            self.dispatcher._latencies.observe(0.001)
+        self.assertEqual(self.dispatcher.timeout(self.delivery()), 1.0)
+
+    def test_failed_sends_are_not_latency_samples(self):
+        def fail(delivery, *args):
+            raise ConnectionError()
+
+        with patch.object(dispatch, "send", side_effect=fail):
+            self.dispatcher.submit(self.delivery(n=1))
+            self.assertTrue(self.dispatcher.flush(timeout=5))
+        self.assertEqual(len(self.dispatcher._latencies), 0)
+
+    def test_error_status_raises(self):
+        response = requests.Response()
+        response.status_code = 503
+        on_sent = []
+        delivery = self.delivery(n=1)
+        delivery.on_sent = on_sent.append
+        with patch.object(dispatch.requests, "post", return_value=response):
+            with self.assertRaises(requests.HTTPError):
+                dispatch.send(delivery)
+        self.assertListEqual(on_sent, [])
+
+    def test_hedged_error_delivery(self):
+        dispatcher = dispatch.Dispatcher(
+            thread_name="humbug_test_hedge", hedge_errors=True
+        )
+        for _ in range(30):
+            dispatcher._latencies.observe(0.01)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        calls = []
+
+        def first_call_hangs(delivery, *args):
+            calls.append(delivery.body["n"])
+            if len(calls) == 1:
+                release.wait(5)
+
+        with patch.object(dispatch, "send", side_effect=first_call_hangs):
+            dispatcher.submit(self.delivery(priority=dispatch.PRIORITY_ERROR, n=1))
+            self.assertTrue(dispatcher.flush(timeout=2))
+        self.assertListEqual(calls, [1, 1])
+        stats = dispatcher.stats()[dispatch.PRIORITY_ERROR]
+        self.assertEqual(stats.hedged, 1)
+        self.assertEqual(stats.sent, 1)
+        self.assertLessEqual(dispatcher.workers(), dispatcher.max_workers)
+
+    def test_fast_error_delivery_is_not_hedged(self):
+        dispatcher = dispatch.Dispatcher(
+            thread_name="humbug_test_hedge", hedge_errors=True
+        )
+        for _ in range(30):
+            dispatcher._latencies.observe(0.05)
+        calls = []
+        with patch.object(
+            dispatch, "send", side_effect=lambda delivery, *args: calls.append(1)
+        ):
+            dispatcher.submit(self.delivery(priority=dispatch.PRIORITY_ERROR, n=1))
+            self.assertTrue(dispatcher.flush(timeout=2))
+            time.sleep(0.1)
+        self.assertListEqual(calls, [1])
+        self.assertEqual(dispatcher.stats()[dispatch.PRIORITY_ERROR].hedged, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
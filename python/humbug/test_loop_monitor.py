@@ -0,0 +1,69 @@
+import asyncio
+import time
+import unittest
+
+from . import loop_monitor
+
+
+def block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+class TestLoopMonitor(unittest.TestCase):
+    def run_monitored(self, coroutine_function, **kwargs):
+        self.stalls = []
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        monitor = loop_monitor.LoopMonitor(
+            loop,
+            self.stalls.append,
+            probe_interval_seconds=0.01,
+            stall_threshold_seconds=0.05,
+            **kwargs
+        )
+        monitor.start()
+        self.addCleanup(monitor.stop)
+        loop.run_until_complete(coroutine_function())
+        monitor.stop()
+        return monitor
+
+    def test_stall_is_reported_with_stack(self):
+        async def main():
+            await asyncio.sleep(0.05)
+            block_the_loop(0.2)
+            await asyncio.sleep(0.05)
+
+        monitor = self.run_monitored(main)
+        self.assertEqual(len(self.stalls), 1)
+        stall = self.stalls[0]
+        self.assertGreaterEqual(stall["blocked_ms"], 50)
+        self.assertEqual(stall["threshold_ms"], 50)
+        self.assertTrue(
+            any(label.startswith("block_the_loop (") for label in stall["stack"])
+        )
+        histogram = monitor.histogram()
+        self.assertGreater(histogram["probes"], 0)
+        self.assertGreaterEqual(histogram["max_lag_ms"], 150)
+        self.assertGreater(histogram["buckets_ms"]["100-500"], 0)
+
+    def test_stall_reports_are_rate_limited(self):
+        async def main():
+            for _ in range(2):
+                await asyncio.sleep(0.05)
+                block_the_loop(0.15)
+            await asyncio.sleep(0.05)
+
+        self.run_monitored(main, min_report_interval_seconds=60)
+        self.assertEqual(len(self.stalls), 1)
+
+    def test_no_stall(self):
+        async def main():
+            await asyncio.sleep(0.2)
+
+        monitor = self.run_monitored(main)
+        self.assertListEqual(self.stalls, [])
+        self.assertLess(monitor.histogram()["max_lag_ms"], 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import signal
+import threading
+import tracemalloc
+import unittest
+
+from . import memory
+
+
+class TestMeasurements(unittest.TestCase):
+    @unittest.skipUnless(os.path.exists("/proc/self/statm"), "requires procfs")
+    def test_rss_bytes(self):
+        rss = memory.rss_bytes()
+        self.assertGreater(rss, 0)
+        self.assertGreater(memory.peak_rss_bytes(), 0)
+
+    def test_gc_stats(self):
+        stats = memory.gc_stats()
+        self.assertEqual(len(stats["counts"]), len(stats["generations"]))
+
+
+class TestAllocationTracker(unittest.TestCase):
+    def setUp(self):
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+
+    def test_summary_is_bounded_diff(self):
+        tracker = memory.AllocationTracker(top_n=3)
+        first = tracker.summary()
+        self.assertFalse(first["compared_to_previous"])
+
+        allocations = [bytearray(1000) for _ in range(1000)]
+        second = tracker.summary()
+        self.assertTrue(second["compared_to_previous"])
+        self.assertLessEqual(len(second["top_by_size"]), 3)
+        self.assertLessEqual(len(second["top_by_count"]), 3)
+        top = second["top_by_size"][0]
+        self.assertTrue(top["location"].startswith(__file__))
+        self.assertGreaterEqual(top["size_diff"], 1000 * 1000)
+        del allocations
+
+    def test_not_tracing(self):
+        tracemalloc.stop()
+        self.assertIsNone(memory.AllocationTracker().summary())
+
+
+class TestMemoryMonitor(unittest.TestCase):
+    def setUp(self):
+        self.triggered = []
+        self.event = threading.Event()
+
+        def on_trigger(trigger):
+            self.triggered.append((trigger, threading.current_thread()))
+            self.event.set()
+
+        self.on_trigger = on_trigger
+
+    def monitor(self, **kwargs):
+        monitor = memory.MemoryMonitor(
+            self.on_trigger, poll_interval_seconds=0.01, **kwargs
+        )
+        monitor.start()
+        self.addCleanup(monitor.stop)
+        return monitor
+
+    def test_request_runs_off_calling_thread(self):
+        monitor = self.monitor()
+        monitor.request()
+        monitor.request()
+        self.assertTrue(self.event.wait(5))
+        trigger, thread = self.triggered[0]
+        self.assertEqual(trigger, memory.TRIGGER_API)
+        self.assertIsNot(thread, threading.current_thread())
+        monitor.stop()
+        monitor._thread.join(5)
+        self.assertEqual(len(self.triggered), 1)
+
+    @unittest.skipUnless(hasattr(signal, "SIGUSR2"), "requires SIGUSR2")
+    def test_signal(self):
+        previous = signal.getsignal(signal.SIGUSR2)
+        self.addCleanup(signal.signal, signal.SIGUSR2, previous)
+        monitor = self.monitor()
+        monitor.install_signal_handler(signal.SIGUSR2)
+        os.kill(os.getpid(), signal.SIGUSR2)
+        self.assertTrue(self.event.wait(5))
+        self.assertEqual(self.triggered[0][0], memory.TRIGGER_SIGNAL)
+
+    @unittest.skipUnless(os.path.exists("/proc/self/statm"), "requires procfs")
+    def test_rss_threshold_respects_cooldown(self):
+        monitor = self.monitor(rss_threshold_bytes=1, cooldown_seconds=60)
+        self.assertTrue(self.event.wait(5))
+        monitor.stop()
+        monitor._thread.join(5)
+        self.assertListEqual(
+            [trigger for trigger, _ in self.triggered], [memory.TRIGGER_RSS]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
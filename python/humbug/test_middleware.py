@@ -0,0 +1,257 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from . import middleware
+
+
+class TestDefaultRoute(unittest.TestCase):
+    def test_identifiers_are_replaced(self):
+        self.assertEqual(
+            middleware.default_route("GET", "/api/v1/users/42/posts"),
+            "GET /api/v1/users/{id}/posts",
+        )
+        self.assertEqual(
+            middleware.default_route(
+                "DELETE", "/sessions/3f2b8c1e-4d5a-4b6c-9e7f-0a1b2c3d4e5f"
+            ),
+            "DELETE /sessions/{id}",
+        )
+        self.assertEqual(
+            middleware.default_route("GET", "/reports/2024-01-31"),
+            "GET /reports/{id}",
+        )
+        self.assertEqual(middleware.default_route("POST", "/"), "POST /")
+
+
+class TestRequestMetrics(unittest.TestCase):
+    def test_flush(self):
+        flushed = []
+        metrics = middleware.RequestMetrics(flushed.append, flush_interval_seconds=3600)
+        self.addCleanup(metrics.stop)
+        metrics.observe("GET /", 3, 200)
+        metrics.observe("GET /", 30, 200)
+        metrics.observe("GET /", 12000, 503)
+        metrics.observe("POST /", 7, 201)
+        metrics.flush()
+
+        self.assertEqual(len(flushed), 1)
+        fields = flushed[0]
+        self.assertEqual(fields["requests"], 4)
+        self.assertEqual(list(fields["routes"]), ["GET /", "POST /"])
+        stats = fields["routes"]["GET /"]
+        self.assertEqual(stats["count"], 3)
+        self.assertEqual(stats["max_ms"], 12000)
+        self.assertAlmostEqual(stats["mean_ms"], 4011)
+        self.assertDictEqual(stats["buckets_ms"], {"<5": 1, "25-50": 1, ">=10000": 1})
+        self.assertDictEqual(stats["statuses"], {"200": 2, "503": 1})
+
+        # Nothing was observed since the last flush.
+        metrics.flush()
+        self.assertEqual(len(flushed), 1)
+
+    def test_max_routes(self):
+        flushed = []
+        metrics = middleware.RequestMetrics(
+            flushed.append, flush_interval_seconds=3600, max_routes=2
+        )
+        self.addCleanup(metrics.stop)
+        for route in ("GET /a", "GET /b", "GET /c", "GET /a"):
+            metrics.observe(metrics.limit_route(route), 1, 200)
+        metrics.flush()
+        self.assertDictEqual(
+            {route: stats["count"] for route, stats in flushed[0]["routes"].items()},
+            {"GET /a": 2, "GET /b": 1, "other": 1},
+        )
+
+    def test_background_flush(self):
+        done = threading.Event()
+        flushed = []
+
+        def on_flush(fields):
+            flushed.append(fields)
+            done.set()
+
+        metrics = middleware.RequestMetrics(on_flush, flush_interval_seconds=0.01)
+        self.addCleanup(metrics.stop)
+        metrics.observe("GET /", 1, 200)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(flushed[0]["requests"], 1)
+
+
+def wsgi_app(environ, start_response):
+    if environ["PATH_INFO"] == "/fail":
+        raise ValueError("failed")
+    start_response("404 Not Found", [("Content-Type", "text/plain")])
+    return [b"not found"]
+
+
+class TestWSGIMiddleware(unittest.TestCase):
+    def setUp(self):
+        self.flushed = []
+        self.captured = []
+        self.metrics = middleware.RequestMetrics(
+            self.flushed.append, flush_interval_seconds=3600
+        )
+        self.addCleanup(self.metrics.stop)
+        self.app = middleware.HumbugWSGIMiddleware(
+            wsgi_app,
+            self.metrics,
+            lambda error, tags: self.captured.append((error, tags)),
+            tags=["service:test"],
+        )
+
+    def test_status_is_recorded(self):
+        statuses = []
+        body = self.app(
+            {"REQUEST_METHOD": "GET", "PATH_INFO": "/users/42"},
+            lambda status, headers, exc_info=None: statuses.append(status),
+        )
+        self.assertEqual(list(body), [b"not found"])
+        self.assertEqual(statuses, ["404 Not Found"])
+        # The request is only observed once the server closes the response.
+        self.metrics.flush()
+        self.assertEqual(self.flushed, [])
+        body.close()
+        self.metrics.flush()
+        stats = self.flushed[0]["routes"]["GET /users/{id}"]
+        self.assertDictEqual(stats["statuses"], {"404": 1})
+        self.assertEqual(self.captured, [])
+
+    def test_unhandled_exception(self):
+        with self.assertRaises(ValueError):
+            self.app(
+                {"REQUEST_METHOD": "POST", "PATH_INFO": "/fail"},
+                lambda status, headers, exc_info=None: None,
+            )
+        self.assertEqual(len(self.captured), 1)
+        error, tags = self.captured[0]
+        self.assertIsInstance(error, ValueError)
+        self.assertEqual(tags, ["site:wsgi", "service:test", "route:POST /fail"])
+        self.metrics.flush()
+        self.assertDictEqual(
+            self.flushed[0]["routes"]["POST /fail"]["statuses"], {"500": 1}
+        )
+
+    def test_generator_app(self):
+        closed = []
+
+        def generator_app(environ, start_response):
+            # Like many frameworks' streaming responses, this application only calls
+            # start_response once its body is iterated.
+            try:
+                time.sleep(0.03)
+                start_response("201 Created", [("Content-Type", "text/plain")])
+                yield b"created"
+            finally:
+                closed.append(True)
+
+        app = middleware.HumbugWSGIMiddleware(
+            generator_app, self.metrics, lambda error, tags: None
+        )
+        body = app(
+            {"REQUEST_METHOD": "POST", "PATH_INFO": "/users"},
+            lambda status, headers, exc_info=None: None,
+        )
+        self.assertEqual(list(body), [b"created"])
+        body.close()
+        body.close()
+        self.assertEqual(closed, [True])
+        self.metrics.flush()
+        stats = self.flushed[0]["routes"]["POST /users"]
+        self.assertEqual(stats["count"], 1)
+        self.assertDictEqual(stats["statuses"], {"201": 1})
+        self.assertGreaterEqual(stats["max_ms"], 30)
+
+    def test_exception_while_iterating(self):
+        def failing_app(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            yield b"partial"
+            raise ValueError("failed while streaming")
+
+        app = middleware.HumbugWSGIMiddleware(
+            failing_app,
+            self.metrics,
+            lambda error, tags: self.captured.append((error, tags)),
+        )
+        body = app(
+            {"REQUEST_METHOD": "GET", "PATH_INFO": "/stream"},
+            lambda status, headers, exc_info=None: None,
+        )
+        chunks = []
+        with self.assertRaises(ValueError):
+            for chunk in body:
+                chunks.append(chunk)
+        body.close()
+        self.assertEqual(chunks, [b"partial"])
+        self.assertEqual(len(self.captured), 1)
+        error, tags = self.captured[0]
+        self.assertEqual(str(error), "failed while streaming")
+        self.assertEqual(tags, ["site:wsgi", "route:GET /stream"])
+        self.metrics.flush()
+        self.assertDictEqual(
+            self.flushed[0]["routes"]["GET /stream"]["statuses"], {"500": 1}
+        )
+
+
+async def asgi_app(scope, receive, send):
+    if scope["type"] != "http":
+        return
+    if scope["path"] == "/fail":
+        raise ValueError("failed")
+    await send({"type": "http.response.start", "status": 201, "headers": []})
+    await send({"type": "http.response.body", "body": b"created"})
+
+
+class TestASGIMiddleware(unittest.TestCase):
+    def setUp(self):
+        self.flushed = []
+        self.captured = []
+        self.metrics = middleware.RequestMetrics(
+            self.flushed.append, flush_interval_seconds=3600
+        )
+        self.addCleanup(self.metrics.stop)
+        self.app = middleware.HumbugASGIMiddleware(
+            asgi_app,
+            self.metrics,
+            lambda error, tags: self.captured.append((error, tags)),
+        )
+
+    def call(self, scope):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(self.app(scope, receive, send))
+        return messages
+
+    def test_status_is_recorded(self):
+        messages = self.call({"type": "http", "method": "PUT", "path": "/items/7"})
+        self.assertEqual(messages[0]["type"], "http.response.start")
+        self.metrics.flush()
+        stats = self.flushed[0]["routes"]["PUT /items/{id}"]
+        self.assertDictEqual(stats["statuses"], {"201": 1})
+
+    def test_unhandled_exception(self):
+        with self.assertRaises(ValueError):
+            self.call({"type": "http", "method": "GET", "path": "/fail"})
+        error, tags = self.captured[0]
+        self.assertEqual(tags, ["site:asgi", "route:GET /fail"])
+        self.metrics.flush()
+        self.assertDictEqual(
+            self.flushed[0]["routes"]["GET /fail"]["statuses"], {"500": 1}
+        )
+
+    def test_other_connections_are_not_measured(self):
+        self.call({"type": "lifespan"})
+        self.metrics.flush()
+        self.assertEqual(self.flushed, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
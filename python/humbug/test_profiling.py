@@ -0,0 +1,73 @@
+import sys
+import time
+import unittest
+from unittest.mock import patch
+
+from . import profiling
+
+
+def busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class TestStackSampler(unittest.TestCase):
+    def setUp(self):
+        self.sampler = profiling.StackSampler(
+            interval_seconds=0.001, idle_timeout_seconds=0.05
+        )
+        self.slow_calls = []
+
+        def on_slow(duration, args, kwargs, stacks):
+            self.slow_calls.append((duration, args, kwargs, stacks))
+
+        self.on_slow = on_slow
+
+    def test_fast_call_is_not_reported(self):
+        watched = self.sampler.watch(busy, 1.0, self.on_slow)
+        watched(0.001)
+        self.assertListEqual(self.slow_calls, [])
+
+    def test_slow_call_is_profiled(self):
+        watched = self.sampler.watch(busy, 0.05, self.on_slow)
+        # Wait for the sampling thread to start before the profiled call.
+        watched(0)
+        time.sleep(0.01)
+        watched(0.1)
+
+        self.assertEqual(len(self.slow_calls), 1)
+        duration, args, kwargs, stacks = self.slow_calls[0]
+        self.assertGreaterEqual(duration, 0.1)
+        self.assertTupleEqual(args, (0.1,))
+        self.assertGreater(len(stacks), 0)
+        stack, count = stacks[0]
+        self.assertGreater(count, 0)
+        self.assertTrue(stack[0].startswith("busy ("))
+        self.assertEqual(self.sampler._samples, {})
+
+    def test_fast_calls_are_not_sampled(self):
+        watched = self.sampler.watch(busy, 1.0, self.on_slow)
+        scans = []
+        current_frames = sys._current_frames
+
+        def counting_current_frames():
+            scans.append(1)
+            return current_frames()
+
+        with patch.object(profiling.sys, "_current_frames", counting_current_frames):
+            for _ in range(20):
+                watched(0.005)
+        self.assertListEqual(scans, [])
+        self.assertEqual(self.sampler._active, {})
+
+    def test_sampling_thread_stops_when_idle(self):
+        watched = self.sampler.watch(busy, 1.0, self.on_slow)
+        watched(0)
+        self.assertTrue(self.sampler._running)
+        time.sleep(0.2)
+        self.assertFalse(self.sampler._running)
+
+
+if __name__ == "__main__":
+    unittest.main()
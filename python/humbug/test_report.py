@@ -1,7 +1,13 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import tracemalloc
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
-from . import consent, report
+from . import cardinality, consent, dedup, dispatch, profiling, report
 
 
 class TestReporter(unittest.TestCase):
@@ -25,9 +31,14 @@ class TestReporter(unittest.TestCase):
         content = "e"
         report = self.reporter.custom_report(title, content, tags, publish=False)
         self.assertEqual(report.title, title)
-        self.assertListEqual(report.tags, tags)
+        self.assertTupleEqual(report.tags, tuple(tags))
         self.assertEqual(report.content, content)
 
+    def test_report_is_compact(self):
+        report_instance = report.Report(title="a", content="b", tags=["c", "d", "c"])
+        self.assertFalse(hasattr(report_instance, "__dict__"))
+        self.assertTupleEqual(report_instance.tags, ("c", "d"))
+
     def test_compound_report_successful(self):
         title = "a"
         tags = ["b", "c", "d"]
@@ -70,6 +81,46 @@ class TestReporter(unittest.TestCase):
             },
         )
 
+    def test_deliveries_are_redacted(self):
+        sample_report = report.Report(
+            title="GITHUB_TOKEN=abc",
+            content='File "/home/alice/main.py"',
+            tags=["parameter:password=hunter2"],
+        )
+        for redact in (True, False):
+            reporter = report.HumbugReporter(
+                name="TestReporter",
+                consent=self.consent,
+                bugout_token="token",
+                mode=report.Modes.SYNCHRONOUS,
+                redact=redact,
+            )
+            with patch.object(dispatch.requests, "post") as post:
+                reporter.publish(sample_report)
+            body = json.loads(post.call_args[1]["data"])
+            if redact:
+                self.assertEqual(body["title"], "GITHUB_TOKEN=[REDACTED]")
+                self.assertEqual(body["content"], 'File "/home/[REDACTED]/main.py"')
+                self.assertIn("parameter:password=[REDACTED]", body["tags"])
+            else:
+                self.assertEqual(body["title"], "GITHUB_TOKEN=abc")
+
+    def test_post_body_without_markdown(self):
+        self.reporter.markdown = False
+        feature_report = self.reporter.feature_report(
+            "test_feature", {"population": "A"}, publish=False
+        )
+        body = self.reporter._post_body(feature_report)
+        self.assertDictEqual(
+            json.loads(body["content"]),
+            {
+                "user_time": feature_report.fields["user_time"],
+                "feature": "test_feature",
+                "parameters": {"population": "A"},
+            },
+        )
+        self.assertIn("Feature: test_feature", feature_report.content)
+
     def test_feature_report(self):
         report = self.reporter.feature_report(
             "test_feature", {"population": "A", "version": "2"}, publish=False
@@ -78,6 +129,49 @@ class TestReporter(unittest.TestCase):
         self.assertTrue("parameter:{}={}".format("population", "A") in report.tags)
         self.assertTrue("parameter:{}={}".format("version", "2") in report.tags)
 
+    def test_caller_tags_are_not_modified(self):
+        tags = ["custom"]
+        self.reporter.feature_report("test_feature", {}, tags=tags, publish=False)
+        self.reporter.error_report(ValueError(), tags=tags, publish=False)
+        self.reporter.logging_report(
+            logging.makeLogRecord({"msg": "a"}), tags=tags, publish=False
+        )
+        self.reporter.env_report(tags=tags, publish=False)
+        self.reporter.compound_report([], tags=tags, publish=False)
+        self.assertEqual(tags, ["custom"])
+
+    def test_system_tags_follow_session(self):
+        tags = self.reporter.system_tags()
+        tags.append("modified")
+        self.assertNotIn("modified", self.reporter.system_tags())
+        self.reporter.session_id = "new-session"
+        self.assertIn("session:new-session", self.reporter.system_tags())
+
+    def test_feature_report_with_parameter_limiter(self):
+        self.reporter.parameter_limiter = cardinality.CardinalityLimiter(
+            max_distinct_values=1
+        )
+        self.reporter.feature_report("test_feature", {"path": "a"}, publish=False)
+        report = self.reporter.feature_report(
+            "test_feature", {"path": "b"}, publish=False
+        )
+        self.assertTrue("parameter:path=other" in report.tags)
+        self.assertEqual(report.fields["parameters"], {"path": "b"})
+        self.assertDictEqual(
+            report.fields["parameter_limits"], {"dropped": {"path": 1}, "truncated": {}}
+        )
+        self.assertIn("`path`: 1 value(s) tagged as other", report.content)
+
+    def test_record_call_truncates_arguments(self):
+        @self.reporter.record_call
+        def load(rows, name=None):
+            return len(rows)
+
+        load(list(range(10**6)), name="n" * 1000)
+        parameters = self.reporter.publish.call_args[0][0].fields["parameters"]
+        self.assertEqual(parameters["arg.0"], "[0, 1, 2, 3, 4, 5, ...]")
+        self.assertEqual(len(parameters["name"]), report.MAX_PARAMETER_VALUE_LENGTH)
+
     def test_record_call(self):
         @self.reporter.record_call
         def the_answer(life, universe=None, everything=None):
@@ -97,6 +191,293 @@ class TestReporter(unittest.TestCase):
         self.assertTrue("parameter:arg.0=1" in report.tags)
         self.assertTrue("parameter:everything=lol" in report.tags)
 
+    def test_record_slow_calls(self):
+        sampler = profiling.StackSampler(interval_seconds=0.001)
+
+        @self.reporter.record_slow_calls(threshold_seconds=0.05, sampler=sampler)
+        def the_question(seconds, tries=None):
+            time.sleep(seconds)
+            return 42
+
+        self.assertEqual(the_question(0), 42)
+        self.reporter.publish.assert_not_called()
+
+        self.assertEqual(the_question(0.1, tries="x" * 1000), 42)
+        self.reporter.publish.assert_called_once()
+        report = self.reporter.publish.call_args[0][0]
+        self.assertTrue("type:slow_call" in report.tags)
+        self.assertTrue("function:the_question" in report.tags)
+        self.assertTrue("parameter:arg.0=0.1" in report.tags)
+        self.assertGreaterEqual(report.fields["duration_ms"], 100)
+        self.assertEqual(report.fields["threshold_ms"], 50)
+        self.assertEqual(len(report.fields["parameters"]["tries"]), 100)
+        self.assertTrue("Slow call: the_question" in report.title)
+        self.assertTrue("### Profile" in report.content)
+
+    def test_memory_report(self):
+        report = self.reporter.memory_report(publish=False)
+        self.assertTrue("type:memory" in report.tags)
+        self.assertTrue("trigger:api" in report.tags)
+        self.assertEqual(
+            report.fields["allocations"] is None, not tracemalloc.is_tracing()
+        )
+        self.assertTrue("### Garbage collector" in report.content)
+
+    def test_resource_heartbeat(self):
+        published = threading.Event()
+        self.reporter.publish.side_effect = lambda *args, **kwargs: published.set()
+        sampler = self.reporter.start_resource_heartbeat(
+            interval_seconds=0.01, period_seconds=0.02
+        )
+        self.addCleanup(sampler.stop)
+        self.assertTrue(published.wait(5))
+        report = self.reporter.publish.call_args[0][0]
+        self.assertTrue("type:resource" in report.tags)
+        self.assertTrue("source:TestReporter" in report.tags)
+        self.assertTrue("### Usage" in report.content)
+
+    def test_monitor_event_loop(self):
+        async def main():
+            self.reporter.monitor_event_loop(
+                stall_threshold_seconds=0.05, probe_interval_seconds=0.01
+            )
+            await asyncio.sleep(0.05)
+            time.sleep(0.2)
+            await asyncio.sleep(0.05)
+            self.reporter.loop_monitor.stop()
+
+        asyncio.run(main())
+        self.reporter.publish.assert_called_once()
+        report = self.reporter.publish.call_args[0][0]
+        self.assertTrue("type:loop_stall" in report.tags)
+        self.assertTrue("### Event loop thread stack" in report.content)
+
+    @unittest.skipUnless(
+        hasattr(threading, "excepthook"), "requires threading.excepthook"
+    )
+    def test_thread_excepthook(self):
+        original_excepthook = threading.excepthook
+        threading.excepthook = lambda args: None
+        self.addCleanup(setattr, threading, "excepthook", original_excepthook)
+        published = threading.Event()
+        self.reporter.publish.side_effect = lambda *args, **kwargs: published.set()
+        self.reporter.setup_thread_excepthook(tags=["custom"])
+
+        def fail():
+            raise ValueError("in a thread")
+
+        thread = threading.Thread(target=fail)
+        thread.start()
+        thread.join()
+        self.assertTrue(published.wait(5))
+        report = self.reporter.publish.call_args[0][0]
+        self.assertTrue("error:ValueError" in report.tags)
+        self.assertTrue("site:thread" in report.tags)
+        self.assertTrue("custom" in report.tags)
+
+    def test_loop_exception_handler(self):
+        def fail():
+            raise ValueError("in a callback")
+
+        async def main():
+            self.reporter.setup_loop_exception_handler()
+            self.reporter.setup_loop_exception_handler()
+            asyncio.get_running_loop().call_soon(fail)
+            await asyncio.sleep(0)
+
+        with self.assertLogs("asyncio"):
+            asyncio.run(main())
+        self.reporter.wait()
+        self.reporter.publish.assert_called_once()
+        report = self.reporter.publish.call_args[0][0]
+        self.assertTrue("error:ValueError" in report.tags)
+        self.assertTrue("site:asyncio" in report.tags)
+
+    def test_wsgi_middleware(self):
+        def app(environ, start_response):
+            if environ["PATH_INFO"] == "/fail":
+                raise ValueError("in a request")
+            start_response("200 OK", [])
+            return [b"ok"]
+
+        wrapped = self.reporter.wsgi_middleware(app, flush_interval_seconds=3600)
+        self.addCleanup(wrapped.metrics.stop)
+        for path in ("/users/1", "/fail"):
+            try:
+                body = wrapped(
+                    {"REQUEST_METHOD": "GET", "PATH_INFO": path},
+                    lambda status, headers, exc_info=None: None,
+                )
+                list(body)
+                body.close()
+            except ValueError:
+                pass
+        self.reporter.wait()
+        error_report = self.reporter.publish.call_args[0][0]
+        self.assertTrue("error:ValueError" in error_report.tags)
+        self.assertTrue("route:GET /fail" in error_report.tags)
+
+        wrapped.metrics.flush()
+        requests_report = self.reporter.publish.call_args[0][0]
+        self.assertTrue("type:requests" in requests_report.tags)
+        self.assertEqual(requests_report.fields["requests"], 2)
+        self.assertTrue("| `GET /users/{id}` | 1 |" in requests_report.content)
+
+    def test_report_ids(self):
+        first = report.Report(title="a", content="b", tags=["c"])
+        second = report.Report(title="a", content="b", tags=["c"])
+        self.assertEqual(first.report_id, first.report_id)
+        self.assertNotEqual(first.report_id, second.report_id)
+        self.assertEqual(
+            report.Report(title="a", report_id="custom").report_id, "custom"
+        )
+
+    def test_dedup_cache(self):
+        reporter = report.HumbugReporter(
+            name="TestReporter",
+            consent=self.consent,
+            bugout_token="token",
+            mode=report.Modes.SYNCHRONOUS,
+            dedup_cache=dedup.DedupCache(),
+        )
+        custom_report = report.Report(title="a", content="b")
+        with patch.object(dispatch.requests, "post") as post:
+            post.return_value.ok = True
+            reporter.publish(custom_report)
+            reporter.publish(custom_report)
+            reporter.publish(report.Report(title="a", content="b"))
+        self.assertEqual(post.call_count, 2)
+        headers = post.call_args_list[0][1]["headers"]
+        self.assertEqual(headers["Idempotency-Key"], custom_report.report_id)
+
+    def test_tags_scope(self):
+        with self.reporter.tags_scope("request:1"):
+            with self.reporter.tags_scope("route:/a", "tenant:x"):
+                nested = self.reporter._post_body(report.Report(title="a"))
+            outer = self.reporter._post_body(report.Report(title="a"))
+        outside = self.reporter._post_body(report.Report(title="a"))
+        self.assertListEqual(
+            nested["tags"],
+            ["humbug-unit-test", "request:1", "route:/a", "tenant:x"],
+        )
+        self.assertListEqual(outer["tags"], ["humbug-unit-test", "request:1"])
+        self.assertListEqual(outside["tags"], ["humbug-unit-test"])
+
+    def test_tags_scope_is_isolated_across_tasks_and_threads(self):
+        scoped = {}
+
+        async def request(request_id):
+            with self.reporter.tags_scope("request:{}".format(request_id)):
+                await asyncio.sleep(0.01)
+                scoped[request_id] = self.reporter.scoped_tags()
+
+        async def main():
+            await asyncio.gather(request(1), request(2))
+
+        with self.reporter.tags_scope("main"):
+            asyncio.run(main())
+            thread = threading.Thread(
+                target=lambda: scoped.update(thread=self.reporter.scoped_tags())
+            )
+            thread.start()
+            thread.join()
+
+        self.assertTupleEqual(scoped[1], ("main", "request:1"))
+        self.assertTupleEqual(scoped[2], ("main", "request:2"))
+        self.assertTupleEqual(scoped["thread"], ())
+
+    def test_session_summary(self):
+        reporter = report.HumbugReporter(
+            name="TestReporter",
+            consent=self.consent,
+            session_summary=True,
+            session_summary_max_events=3,
+        )
+        reporter.publish = MagicMock()
+
+        reporter.feature_report("first", {"a": "1"})
+        reporter.feature_report("second", {}, tags=["plan:pro"])
+        reporter.publish.assert_not_called()
+
+        reporter.error_report(Exception("Errors are published immediately"))
+        reporter.publish.assert_called_once()
+
+        reporter.feature_report("first", {"a": "2"})
+        self.assertEqual(reporter.publish.call_count, 2)
+        summary = reporter.publish.call_args[0][0]
+        self.assertTrue("type:session_summary" in summary.tags)
+        self.assertTrue("feature:first" in summary.tags)
+        self.assertTrue("feature:second" in summary.tags)
+        self.assertListEqual(summary.fields["counts"], [2, 1])
+        self.assertTrue("plan:pro" in summary.tags)
+        self.assertListEqual(summary.fields["tags"], ["plan:pro"])
+        self.assertTrue("- `plan:pro`" in summary.content)
+
+        reporter.feature_report("third", {})
+        reporter.wait()
+        self.assertEqual(reporter.publish.call_count, 3)
+        self.assertListEqual(
+            reporter.publish.call_args[0][0].fields["features"], ["third"]
+        )
+
+    def test_shared_dispatcher(self):
+        reporters = [
+            report.HumbugReporter(
+                name="TestReporter{}".format(i),
+                consent=self.consent,
+                dispatcher=report.shared_dispatcher(),
+            )
+            for i in range(3)
+        ]
+        self.assertIs(reporters[0].dispatcher, report.shared_dispatcher())
+        self.assertIs(reporters[1].dispatcher, reporters[2].dispatcher)
+
+    def test_new_session_after_fork(self):
+        reporter = report.HumbugReporter(
+            name="TestReporter",
+            consent=self.consent,
+            session_summary=True,
+            new_session_on_fork=True,
+        )
+        reporter.publish = MagicMock()
+        session_id = reporter.session_id
+        reporter.feature_report("parent", {})
+
+        reporter._after_fork_in_child()
+
+        self.assertNotEqual(reporter.session_id, session_id)
+        self.assertIsNone(reporter.session_summary_report())
+
+    def test_sampled_out_client(self):
+        reporter = report.HumbugReporter(
+            name="TestReporter",
+            consent=self.consent,
+            client_id="client",
+            sample_rates={"feature": 0.0},
+        )
+        reporter.publish = MagicMock()
+
+        @reporter.record_call
+        def the_answer():
+            return 42
+
+        self.assertEqual(the_answer(), 42)
+        self.assertIsNone(reporter.feature_report("test_feature", {}))
+        reporter.publish.assert_not_called()
+        self.assertIsNotNone(reporter.feature_report("test_feature", {}, publish=False))
+
+    def test_sample_rate_tags(self):
+        reporter = report.HumbugReporter(
+            name="TestReporter",
+            consent=self.consent,
+            client_id="client",
+            sample_rates={"feature": 1.0, "system": 0.5},
+        )
+        feature_report = reporter.feature_report("test_feature", {}, publish=False)
+        system_report = reporter.system_report(publish=False)
+        self.assertNotIn("sample_rate:1.0", reporter._post_body(feature_report)["tags"])
+        self.assertIn("sample_rate:0.5", reporter._post_body(system_report)["tags"])
+
     def test_record_errors(self):
         @self.reporter.record_errors
         def broken():
@@ -0,0 +1,62 @@
+import gc
+import threading
+import unittest
+
+from . import resources
+
+
+class TestMetricSummary(unittest.TestCase):
+    def test_summary(self):
+        summary = resources.MetricSummary()
+        self.assertIsNone(summary.summary())
+        for value in (3, None, 1, 2):
+            summary.observe(value)
+        self.assertDictEqual(summary.summary(), {"min": 1, "mean": 2.0, "max": 3})
+
+
+class TestGCMonitor(unittest.TestCase):
+    def test_collections_are_counted(self):
+        monitor = resources.GCMonitor()
+        monitor.install()
+        self.addCleanup(monitor.uninstall)
+        gc.collect()
+        observed = monitor.reset()
+        self.assertGreaterEqual(observed["collections"][2], 1)
+        self.assertGreaterEqual(observed["max_pause_ms"], 0)
+        self.assertEqual(sum(monitor.reset()["collections"]), 0)
+
+    def test_uninstall(self):
+        monitor = resources.GCMonitor()
+        monitor.install()
+        monitor.uninstall()
+        self.assertNotIn(monitor._callback, gc.callbacks)
+
+
+class TestResourceSampler(unittest.TestCase):
+    def test_period_summary(self):
+        periods = []
+        done = threading.Event()
+
+        def on_period(fields):
+            periods.append(fields)
+            done.set()
+
+        sampler = resources.ResourceSampler(
+            on_period, interval_seconds=0.01, period_seconds=0.05
+        )
+        sampler.start()
+        self.addCleanup(sampler.stop)
+        self.assertTrue(done.wait(5))
+        sampler.stop()
+
+        fields = periods[0]
+        self.assertGreaterEqual(fields["duration_ms"], 50)
+        self.assertGreaterEqual(fields["threads"]["min"], 2)
+        for key in ("cpu_percent", "rss_bytes", "open_file_descriptors"):
+            if fields[key] is not None:
+                self.assertLessEqual(fields[key]["min"], fields[key]["max"])
+        self.assertNotIn(sampler.gc_monitor._callback, gc.callbacks)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from . import sampling
+
+
+class TestSampler(unittest.TestCase):
+    def test_sample_fraction_is_deterministic(self):
+        self.assertEqual(
+            sampling.sample_fraction("client", "tool"),
+            sampling.sample_fraction("client", "tool"),
+        )
+        self.assertNotEqual(
+            sampling.sample_fraction("client", "tool"),
+            sampling.sample_fraction("client", "other tool"),
+        )
+
+    def test_sample_rate_is_respected(self):
+        kept = sum(
+            sampling.Sampler(str(i), {"feature": 0.25}).keep("feature")
+            for i in range(10000)
+        )
+        self.assertTrue(2250 < kept < 2750)
+
+    def test_sampling_is_nested(self):
+        for i in range(1000):
+            sampler = sampling.Sampler(str(i), {"feature": 0.1, "system": 0.5})
+            if sampler.keep("feature"):
+                self.assertTrue(sampler.keep("system"))
+
+    def test_unsampled_types(self):
+        sampler = sampling.Sampler("client", {"feature": 0.0, "system": 1.0})
+        self.assertFalse(sampler.keep("feature"))
+        self.assertTrue(sampler.keep("system"))
+        self.assertTrue(sampler.keep("error"))
+        self.assertTrue(sampler.keep(None))
+        self.assertListEqual(sampler.tags("feature"), ["sample_rate:0.0"])
+        self.assertListEqual(sampler.tags("system"), [])
+        self.assertListEqual(sampler.tags("error"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
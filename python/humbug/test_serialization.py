@@ -0,0 +1,93 @@
+import json
+import unittest
+from unittest.mock import patch
+
+from . import dispatch, serialization
+from .consent import HumbugConsent
+from .report import HumbugReporter, Modes
+
+
+class TestSerializers(unittest.TestCase):
+    def setUp(self):
+        self.body = {"title": "a", "content": "b\nc", "tags": ["d", "é"]}
+
+    def test_json(self):
+        for serializer in (
+            serialization.JSONSerializer(),
+            serialization.JSONSerializer(use_orjson=False),
+        ):
+            encoded = serializer.dumps(self.body)
+            self.assertIsInstance(encoded, bytes)
+            self.assertDictEqual(json.loads(encoded), self.body)
+            self.assertNotIn(b" ", encoded)
+
+    def test_json_falls_back_to_stdlib(self):
+        body = {"count": 2**70}
+        self.assertDictEqual(
+            json.loads(serialization.JSONSerializer().dumps(body)), body
+        )
+
+    @unittest.skipIf(serialization.msgpack is None, "requires msgpack")
+    def test_msgpack(self):
+        serializer = serialization.MsgpackSerializer()
+        encoded = serializer.dumps(self.body)
+        self.assertDictEqual(serialization.msgpack.unpackb(encoded), self.body)
+
+    @unittest.skipIf(serialization.msgpack is not None, "msgpack is installed")
+    def test_msgpack_requires_msgpack(self):
+        with self.assertRaises(ImportError):
+            serialization.MsgpackSerializer()
+
+    def test_serializer_is_abstract(self):
+        with self.assertRaises(TypeError):
+            serialization.Serializer()  # type: ignore
+
+    def test_json_only_endpoints(self):
+        class BinarySerializer(serialization.Serializer):
+            name = "binary"
+
+            def dumps(self, body):
+                return repr(body).encode("utf-8")
+
+        for url in (
+            "https://spire.bugout.dev",
+            "https://Spire.Bugout.dev/humbug/reports",
+            "https://bugout.dev",
+        ):
+            with self.assertRaises(ValueError):
+                serialization.check_endpoint(BinarySerializer(), url)
+            serialization.check_endpoint(serialization.JSONSerializer(), url)
+        for url in ("http://localhost:8080", "https://notbugout.dev"):
+            serialization.check_endpoint(BinarySerializer(), url)
+
+        consent = HumbugConsent(True)
+        with self.assertRaises(ValueError):
+            HumbugReporter(
+                "test", consent, mode=Modes.SYNCHRONOUS, serializer=BinarySerializer()
+            )
+        reporter = HumbugReporter(
+            "test",
+            consent,
+            mode=Modes.SYNCHRONOUS,
+            url="http://localhost:8080",
+            serializer=BinarySerializer(),
+        )
+        self.assertEqual(reporter.serializer.name, "binary")
+
+    def test_send_encodes_body(self):
+        delivery = dispatch.Delivery(
+            url="http://localhost/humbug/reports",
+            headers={"Authorization": "Bearer secret"},
+            body=self.body,
+            timeout=1.0,
+        )
+        with patch.object(dispatch.requests, "post") as post:
+            dispatch.send(delivery)
+        kwargs = post.call_args[1]
+        self.assertEqual(kwargs["headers"]["Content-Type"], "application/json")
+        self.assertEqual(kwargs["headers"]["Authorization"], "Bearer secret")
+        self.assertDictEqual(json.loads(kwargs["data"]), self.body)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,247 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from . import dispatch, redaction, shutdown
+
+
+class TestShutdownCoordinator(unittest.TestCase):
+    def setUp(self):
+        self.coordinator = shutdown.ShutdownCoordinator(
+            timeout_seconds=5, spool_directory=None, max_workers=1
+        )
+        self.dispatcher = dispatch.Dispatcher(
+            thread_name="humbug_test_shutdown", max_workers=1
+        )
+        self.coordinator.register(self.dispatcher)
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def block_dispatcher(self):
+        """
+        Occupies the dispatcher's worker so that subsequent deliveries stay pending.
+        """
+
+        def blocking_send(delivery, *args):
+            # Workers left over from other tests may also send while send is patched.
+            if delivery.body.get("title") != "blocker":
+                return
+            self.started.set()
+            self.release.wait()
+
+        with patch.object(dispatch, "send", side_effect=blocking_send):
+            self.dispatcher.submit(self.delivery("blocker"))
+            self.started.wait(5)
+
+    def delivery(self, title, priority=dispatch.PRIORITY_DEFAULT):
+        return dispatch.Delivery(
+            url="http://localhost/humbug/reports",
+            headers={"Authorization": "Bearer secret"},
+            body={"title": title},
+            timeout=1.0,
+            priority=priority,
+            idempotency_key="key-{}".format(title),
+        )
+
+    def test_flush_sends_errors_first(self):
+        self.block_dispatcher()
+        self.dispatcher.submit(self.delivery("feature"))
+        self.dispatcher.submit(self.delivery("error", dispatch.PRIORITY_ERROR))
+        with patch.object(shutdown, "send") as send:
+            result = self.coordinator.flush(timeout_seconds=0.2)
+        self.assertEqual(
+            [call[0][0].body["title"] for call in send.call_args_list],
+            ["error", "feature"],
+        )
+        self.assertEqual(result.attempted, 2)
+        self.assertEqual(result.sent, 2)
+        self.assertEqual(result.dropped, 0)
+
+    def test_flush_counts_failed_sends(self):
+        self.block_dispatcher()
+        self.dispatcher.submit(self.delivery("feature"))
+        with patch.object(shutdown, "send", side_effect=ConnectionError):
+            result = self.coordinator.flush(timeout_seconds=0.2)
+        self.assertEqual(result.attempted, 1)
+        self.assertEqual(result.sent, 0)
+
+    def test_flush_runs_hooks_first(self):
+        dispatcher = self.dispatcher
+        delivery = self.delivery("summary")
+
+        class Buffer:
+            def publish(self):
+                dispatcher.submit(delivery)
+
+        buffer = Buffer()
+        self.coordinator.register_hook(buffer.publish)
+        self.block_dispatcher()
+        with patch.object(shutdown, "send") as send:
+            self.coordinator.flush(timeout_seconds=0.2)
+        self.assertEqual(
+            [call[0][0].body["title"] for call in send.call_args_list], ["summary"]
+        )
+
+    def test_flush_runs_after_hooks_last(self):
+        events = []
+
+        class Cache:
+            def save(self):
+                events.append("save")
+
+        cache = Cache()
+        self.coordinator.register_hook(cache.save, after=True)
+        self.block_dispatcher()
+        self.dispatcher.submit(self.delivery("feature"))
+        with patch.object(
+            shutdown, "send", side_effect=lambda delivery: events.append("send")
+        ):
+            self.coordinator.flush(timeout_seconds=0.2)
+        self.assertListEqual(events, ["send", "save"])
+
+    def test_flush_respects_deadline(self):
+        self.block_dispatcher()
+        for i in range(3):
+            self.dispatcher.submit(self.delivery("feature-{}".format(i)))
+
+        def unresponsive_send(delivery):
+            # Requests to an unresponsive server time out after the delivery's timeout, which the
+            # coordinator caps at the time left before the deadline.
+            self.release.wait(delivery.timeout)
+            raise TimeoutError()
+
+        with patch.object(shutdown, "send", side_effect=unresponsive_send):
+            result = self.coordinator.flush(timeout_seconds=0.1)
+        self.assertEqual(result.attempted, 1)
+        self.assertEqual(result.sent, 0)
+        self.assertEqual(result.dropped, 2)
+
+    def test_flush_spools_leftovers(self):
+        self.block_dispatcher()
+        self.dispatcher.submit(self.delivery("feature"))
+        with tempfile.TemporaryDirectory() as spool_directory:
+            self.coordinator.spool_directory = spool_directory
+            result = self.coordinator.flush(timeout_seconds=0)
+            self.assertEqual(result.spooled, 1)
+            spooled = list(shutdown.read_spool(spool_directory))
+            self.assertEqual(
+                spooled,
+                [
+                    (
+                        "http://localhost/humbug/reports",
+                        {"title": "feature"},
+                        "key-feature",
+                    )
+                ],
+            )
+            self.assertEqual(list(shutdown.read_spool(spool_directory)), [])
+
+    def test_spooled_deliveries_are_redacted(self):
+        self.block_dispatcher()
+        delivery = self.delivery("feature")
+        delivery.body = {"title": "token=abc", "content": "", "tags": []}
+        delivery.redactor = redaction.Redactor()
+        self.dispatcher.submit(delivery)
+        with tempfile.TemporaryDirectory() as spool_directory:
+            self.coordinator.spool_directory = spool_directory
+            self.coordinator.flush(timeout_seconds=0)
+            [(_, body, _)] = shutdown.read_spool(spool_directory)
+        self.assertEqual(body["title"], "token=[REDACTED]")
+
+
+class TestExitWithPendingReports(unittest.TestCase):
+    def setUp(self):
+        received = self.received = set()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                # Slow enough that reports are still pending when the process exits.
+                time.sleep(0.02)
+                received.add(self.headers["Idempotency-Key"])
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def exit_with_pending_reports(self, timeout_seconds):
+        """
+        Runs a process which publishes 18 reports from three reporters, and a session summary from
+        a fourth reporter at exit, and exits while the reports are pending. Returns the process's
+        stderr and the number of reports it spooled.
+        """
+        script = textwrap.dedent(
+            """
+            import sys
+            from humbug.consent import HumbugConsent
+            from humbug.report import HumbugReporter
+
+            def reporter(name, **kwargs):
+                return HumbugReporter(
+                    name, HumbugConsent(True), bugout_token="t", url=sys.argv[1], **kwargs
+                )
+
+            reporters = [reporter("exit-{}".format(i), max_workers=1) for i in range(3)]
+            for reporter_ in reporters:
+                for n in range(6):
+                    reporter_.custom_report("report {}".format(n), "content")
+            summary = reporter("summary", session_summary=True)
+            summary.feature_report("feature", {"a": "b"})
+            """
+        )
+        spool_directory = tempfile.mkdtemp()
+        env = dict(
+            os.environ,
+            HUMBUG_SPOOL_DIR=spool_directory,
+            HUMBUG_SHUTDOWN_TIMEOUT=str(timeout_seconds),
+        )
+        process = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                script,
+                "http://127.0.0.1:{}".format(self.server.server_address[1]),
+            ],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            timeout=60,
+        )
+        self.assertEqual(process.returncode, 0, process.stderr)
+        spooled = len(list(shutdown.read_spool(spool_directory)))
+        return process.stderr, spooled
+
+    def test_reports_are_sent_at_exit(self):
+        stderr, spooled = self.exit_with_pending_reports(timeout_seconds=30)
+        self.assertNotIn("Traceback", stderr)
+        self.assertEqual(spooled, 0)
+        self.assertEqual(len(self.received), 19)
+
+    def test_reports_are_spooled_at_exit(self):
+        stderr, spooled = self.exit_with_pending_reports(timeout_seconds=0.05)
+        self.assertNotIn("Traceback", stderr)
+        self.assertEqual(len(self.received) + spooled, 19)
+        self.assertGreater(spooled, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
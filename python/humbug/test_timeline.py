@@ -0,0 +1,83 @@
+import json
+import threading
+import unittest
+
+from . import timeline
+
+
+class TestSessionTimeline(unittest.TestCase):
+    def test_record_and_drain(self):
+        session_timeline = timeline.SessionTimeline(max_events=3)
+        self.assertFalse(session_timeline.record("a", {"x": 1}))
+        self.assertFalse(session_timeline.record("b", {}))
+        self.assertTrue(session_timeline.record("a", {"x": 2}))
+
+        fields = session_timeline.drain()
+        self.assertIsNotNone(fields)
+        self.assertListEqual(fields["features"], ["a", "b"])
+        self.assertListEqual(fields["counts"], [2, 1])
+        events = timeline.decompress_events(fields["events"])
+        self.assertListEqual(
+            [(event[0], event[2]) for event in events],
+            [(0, {"x": "1"}), (1, {}), (0, {"x": "2"})],
+        )
+        self.assertEqual(len(session_timeline), 0)
+        self.assertIsNone(session_timeline.drain())
+
+    def test_tags(self):
+        session_timeline = timeline.SessionTimeline()
+        session_timeline.record("a", {}, ["user:1", "plan:pro"])
+        session_timeline.record("a", {})
+        session_timeline.record("b", {}, ["plan:pro", "plan:pro"])
+        fields = session_timeline.drain()
+        self.assertListEqual(fields["tags"], ["user:1", "plan:pro"])
+        self.assertListEqual(
+            [event[3] for event in timeline.decompress_events(fields["events"])],
+            [[0, 1], [], [1]],
+        )
+
+    def test_parameters_are_bounded(self):
+        session_timeline = timeline.SessionTimeline()
+        session_timeline.record(
+            "a", {str(i): "v" * 1000 for i in range(timeline.MAX_EVENT_PARAMETERS + 5)}
+        )
+        fields = session_timeline.drain()
+        parameters = timeline.decompress_events(fields["events"])[0][2]
+        self.assertEqual(len(parameters), timeline.MAX_EVENT_PARAMETERS)
+        self.assertTrue(
+            all(
+                len(value) == timeline.MAX_PARAMETER_VALUE_LENGTH
+                for value in parameters.values()
+            )
+        )
+
+    def test_offsets_are_monotonic_across_threads(self):
+        session_timeline = timeline.SessionTimeline(max_events=10000)
+
+        def record():
+            for _ in range(500):
+                session_timeline.record("a", {})
+
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        events = timeline.decompress_events(session_timeline.drain()["events"])
+        self.assertEqual(len(events), 4000)
+        self.assertTrue(all(event[1] >= 0 for event in events))
+
+    def test_events_are_compressed(self):
+        session_timeline = timeline.SessionTimeline()
+        for i in range(200):
+            session_timeline.record("feature", {"mode": "fast"})
+        fields = session_timeline.drain()
+        self.assertIsInstance(fields["events"], str)
+        uncompressed = json.dumps(
+            timeline.decompress_events(fields["events"]), separators=(",", ":")
+        )
+        self.assertLess(len(fields["events"]), len(uncompressed) / 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
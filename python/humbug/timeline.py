@@ -0,0 +1,134 @@
+"""
+This module implements the in-memory session timeline which Humbug reporters use to summarize
+feature usage in a single report per session.
+"""
+import base64
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import zlib
+
+from .cardinality import bounded_str
+
+MAX_EVENT_PARAMETERS = 10
+MAX_PARAMETER_VALUE_LENGTH = 100
+
+
+class SessionTimeline:
+    """
+    Records feature usage events compactly.
+
+    Feature names and tags are interned, so that each event only stores the index of its feature,
+    the number of milliseconds since the previous event, a small set of parameters, and the indices
+    of its tags. When the timeline is drained, its events are compressed (see compress_events).
+    """
+
+    def __init__(self, max_events: int = 1000) -> None:
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.started_at = int(time.time())
+        self._started = time.monotonic()
+        self._last_offset_ms = 0
+        self._features: List[str] = []
+        self._feature_indices: Dict[str, int] = {}
+        self._counts: List[int] = []
+        self._tags: List[str] = []
+        self._tag_indices: Dict[str, int] = {}
+        self._events: List[Tuple[int, int, Dict[str, str], List[int]]] = []
+
+    def clear(self) -> None:
+        """
+        Discards all recorded events. This is safe to call in a forked child even if another thread
+        held the timeline's lock at the time of the fork.
+        """
+        self._lock = threading.Lock()
+        self._reset()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def record(
+        self,
+        feature: str,
+        parameters: Dict[str, Any],
+        tags: Optional[Sequence[str]] = None,
+    ) -> bool:
+        """
+        Records a single event, with the tags its feature report would have carried. Returns True
+        if the timeline is full after recording the event.
+        """
+        event_parameters = {
+            str(key): bounded_str(value, MAX_PARAMETER_VALUE_LENGTH)
+            for key, value in list(parameters.items())[:MAX_EVENT_PARAMETERS]
+        }
+        with self._lock:
+            # The offset is measured with the lock held, so that events are recorded in the order of
+            # their offsets and the time since the previous event is never negative.
+            offset_ms = int((time.monotonic() - self._started) * 1000)
+            feature_index = self._feature_indices.get(feature)
+            if feature_index is None:
+                feature_index = len(self._features)
+                self._feature_indices[feature] = feature_index
+                self._features.append(feature)
+                self._counts.append(0)
+            self._counts[feature_index] += 1
+            tag_indices = []
+            for tag in dict.fromkeys(tags or ()):
+                tag_index = self._tag_indices.get(tag)
+                if tag_index is None:
+                    tag_index = len(self._tags)
+                    self._tag_indices[tag] = tag_index
+                    self._tags.append(tag)
+                tag_indices.append(tag_index)
+            self._events.append(
+                (
+                    feature_index,
+                    offset_ms - self._last_offset_ms,
+                    event_parameters,
+                    tag_indices,
+                )
+            )
+            self._last_offset_ms = offset_ms
+            return len(self._events) >= self.max_events
+
+    def drain(self) -> Optional[Dict[str, Any]]:
+        """
+        Returns the recorded timeline as structured report fields and starts a new timeline. Returns
+        None if no events have been recorded. The events are compressed into the "events" field, and
+        can be read back with decompress_events.
+        """
+        with self._lock:
+            if not self._events:
+                return None
+            fields = {
+                "started_at": self.started_at,
+                "duration_ms": int((time.monotonic() - self._started) * 1000),
+                "features": self._features,
+                "counts": self._counts,
+                "tags": self._tags,
+            }
+            events = self._events
+            self._reset()
+        fields["events"] = compress_events(events)
+        return fields
+
+
+def compress_events(events: List[Tuple[int, int, Dict[str, str], List[int]]]) -> str:
+    """
+    Encodes a list of timeline events as compact JSON, compressed with zlib and encoded in base64
+    so that it can be carried in a report's content.
+    """
+    encoded = json.dumps(events, separators=(",", ":")).encode("utf-8")
+    return base64.b64encode(zlib.compress(encoded, 9)).decode("ascii")
+
+
+def decompress_events(data: str) -> List[List[Any]]:
+    """
+    Decodes the events of a session summary report, as [feature index, milliseconds since previous
+    event, parameters, tag indices] lists. Tag indices refer to the report's "tags" field.
+    """
+    return json.loads(zlib.decompress(base64.b64decode(data)).decode("utf-8"))
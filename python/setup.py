@@ -9,6 +9,7 @@ setup(
     version="0.2.6",
     packages=find_packages(),
     package_data={"humbug": ["py.typed"]},
+    python_requires=">=3.7",
     install_requires=["requests"],
     extras_require={
         "dev": [
@@ -20,6 +21,8 @@ setup(
             "types-dataclasses",
         ],
         "distribute": ["setuptools", "twine", "wheel"],
+        "orjson": ["orjson"],
+        "msgpack": ["msgpack"],
     },
     description="Humbug: Do you build developer tools? Humbug helps you know your users.",
     long_description=long_description,
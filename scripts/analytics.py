@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+Offline analytics over Humbug reports exported from Bugout as JSON lines (one entry per line, each
+with at least "created_at" and "tags").
+
+Exports are loaded into columnar NumPy arrays: creation timestamps, interned session and client IDs,
+and the tags of every entry as interned tag IDs in compressed sparse row form. The columns are
+written to a cache directory and memory-mapped on subsequent runs, so that parsing only happens
+once per export.
+
+Install requirements:
+    pip3 install numpy
+"""
+import argparse
+from array import array
+from datetime import datetime, timezone
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+DEFAULT_CACHE_DIR = os.path.join(".humbug_scripts", "analytics")
+COLUMNS = ["timestamps", "sessions", "clients", "tag_offsets", "tag_ids"]
+SECONDS_PER_WEEK = 7 * 24 * 60 * 60
+
+
+def parse_timestamp(created_at):
+    """
+    Converts an ISO 8601 creation time (as exported by Bugout) into seconds since the epoch. Times
+    without a UTC offset are assumed to be in UTC.
+    """
+    if created_at.endswith("Z"):
+        created_at = created_at[:-1] + "+00:00"
+    try:
+        parsed = datetime.fromisoformat(created_at)
+    except ValueError:
+        from dateutil.parser import parse as parse_date
+
+        parsed = parse_date(created_at)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class Vocabulary:
+    """
+    Interns strings as consecutive integer IDs.
+    """
+
+    def __init__(self, values=None):
+        self.values = list(values or [])
+        self.ids = {value: i for i, value in enumerate(self.values)}
+
+    def intern(self, value):
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = len(self.values)
+            self.ids[value] = value_id
+            self.values.append(value)
+        return value_id
+
+    def __len__(self):
+        return len(self.values)
+
+
+class Reports:
+    """
+    Columnar representation of a set of exported reports.
+
+    For entry i, timestamps[i] is its creation time in seconds since the epoch, sessions[i] and
+    clients[i] are interned IDs of its session:* and client:* tags (-1 if it has none), and its tag
+    IDs are tag_ids[tag_offsets[i]:tag_offsets[i + 1]].
+    """
+
+    def __init__(self, columns, tags, sessions, clients):
+        self.timestamps = columns["timestamps"]
+        self.sessions = columns["sessions"]
+        self.clients = columns["clients"]
+        self.tag_offsets = columns["tag_offsets"]
+        self.tag_ids = columns["tag_ids"]
+        self.tags = tags
+        self.session_names = sessions
+        self.client_names = clients
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def tag_entries(self):
+        """
+        Index of the entry that each element of tag_ids belongs to.
+        """
+        return np.repeat(
+            np.arange(len(self), dtype=np.int64), np.diff(self.tag_offsets)
+        )
+
+    def prefix_mask(self, prefix):
+        """
+        Boolean array over the tag vocabulary marking tags which start with the given prefix.
+        """
+        return np.fromiter(
+            (tag.startswith(prefix) for tag in self.tags.values),
+            dtype=bool,
+            count=len(self.tags),
+        )
+
+    def tag_per_entry(self, prefix):
+        """
+        For every entry, the ID of its first tag starting with the given prefix (-1 if none).
+        """
+        matches = self.prefix_mask(prefix)[self.tag_ids]
+        result = np.full(len(self), -1, dtype=np.int64)
+        entries = self.tag_entries()[matches]
+        # Assignments are applied in order, so reversing makes the first matching tag win.
+        result[entries[::-1]] = self.tag_ids[matches][::-1]
+        return result
+
+
+def load_export(paths):
+    """
+    Parses JSON lines exports into columns.
+    """
+    tags = Vocabulary()
+    sessions = Vocabulary()
+    clients = Vocabulary()
+    timestamps = array("d")
+    session_column = array("q")
+    client_column = array("q")
+    tag_offsets = array("q", [0])
+    tag_ids = array("q")
+
+    for path in paths:
+        with open(path, "rb") as ifp:
+            for line in ifp:
+                if not line.strip():
+                    continue
+                entry = loads(line)
+                timestamps.append(parse_timestamp(entry["created_at"]))
+                session_id = -1
+                client_id = -1
+                for tag in entry.get("tags", []):
+                    tag_ids.append(tags.intern(tag))
+                    if tag.startswith("session:"):
+                        session_id = sessions.intern(tag[len("session:") :])
+                    elif tag.startswith("client:"):
+                        client_id = clients.intern(tag[len("client:") :])
+                session_column.append(session_id)
+                client_column.append(client_id)
+                tag_offsets.append(len(tag_ids))
+
+    columns = {
+        "timestamps": np.frombuffer(timestamps, dtype=np.float64),
+        "sessions": np.frombuffer(session_column, dtype=np.int64),
+        "clients": np.frombuffer(client_column, dtype=np.int64),
+        "tag_offsets": np.frombuffer(tag_offsets, dtype=np.int64),
+        "tag_ids": np.frombuffer(tag_ids, dtype=np.int64),
+    }
+    return Reports(columns, tags, sessions, clients)
+
+
+def cache_key(paths):
+    """
+    Identifies a set of exports by their paths, sizes, and modification times.
+    """
+    digest = hashlib.sha256()
+    for path in sorted(os.path.abspath(path) for path in paths):
+        stat = os.stat(path)
+        digest.update(
+            "{}:{}:{}\n".format(path, stat.st_size, stat.st_mtime_ns).encode()
+        )
+    return digest.hexdigest()[:16]
+
+
+def load(paths, cache_dir):
+    """
+    Loads the given exports, memory-mapping the columns from the cache if they have been parsed
+    before and writing them to the cache otherwise.
+    """
+    if cache_dir is None:
+        return load_export(paths)
+
+    directory = os.path.join(cache_dir, cache_key(paths))
+    vocabulary_file = os.path.join(directory, "vocabulary.json")
+    if os.path.exists(vocabulary_file):
+        columns = {
+            column: np.load(
+                os.path.join(directory, "{}.npy".format(column)), mmap_mode="r"
+            )
+            for column in COLUMNS
+        }
+        with open(vocabulary_file) as ifp:
+            vocabulary = json.load(ifp)
+        return Reports(
+            columns,
+            Vocabulary(vocabulary["tags"]),
+            Vocabulary(vocabulary["sessions"]),
+            Vocabulary(vocabulary["clients"]),
+        )
+
+    reports = load_export(paths)
+    os.makedirs(directory, exist_ok=True)
+    for column in COLUMNS:
+        np.save(
+            os.path.join(directory, "{}.npy".format(column)), getattr(reports, column)
+        )
+    # The vocabulary is written last: its presence marks the cache entry as complete.
+    with open(vocabulary_file, "w") as ofp:
+        json.dump(
+            {
+                "tags": reports.tags.values,
+                "sessions": reports.session_names.values,
+                "clients": reports.client_names.values,
+            },
+            ofp,
+        )
+    return reports
+
+
+def error_counts(reports):
+    """
+    Number of reports for each error_full:* tag, most frequent first.
+    """
+    matches = reports.prefix_mask("error_full:")[reports.tag_ids]
+    counts = np.bincount(reports.tag_ids[matches], minlength=len(reports.tags))
+    order = np.argsort(-counts, kind="stable")
+    return [
+        {"error": reports.tags.values[i][len("error_full:") :], "count": int(counts[i])}
+        for i in order
+        if counts[i] > 0
+    ]
+
+
+def feature_usage(reports, version_prefix):
+    """
+    Number of reports for each feature:* tag, broken down by the value of the entry's version tag.
+    """
+    features = reports.tag_per_entry("feature:")
+    versions = reports.tag_per_entry(version_prefix)
+    mask = features >= 0
+    # Tag IDs are re-numbered densely so that the counts matrix is only as large as the number of
+    # distinct features times the number of distinct versions. Entries without a version tag keep
+    # the ID -1 and are counted as "unknown".
+    feature_ids, feature_index = np.unique(features[mask], return_inverse=True)
+    version_ids, version_index = np.unique(versions[mask], return_inverse=True)
+    counts = np.bincount(
+        feature_index * len(version_ids) + version_index,
+        minlength=len(feature_ids) * len(version_ids),
+    ).reshape(len(feature_ids), len(version_ids))
+    rows = []
+    for i, j in zip(*np.nonzero(counts)):
+        version = "unknown"
+        if version_ids[j] >= 0:
+            version = reports.tags.values[version_ids[j]][len(version_prefix) :]
+        rows.append(
+            {
+                "feature": reports.tags.values[feature_ids[i]][len("feature:") :],
+                "version": version,
+                "count": int(counts[i, j]),
+            }
+        )
+    rows.sort(key=lambda row: (row["feature"], -row["count"]))
+    return rows
+
+
+def sessions_by_time(reports):
+    """
+    Returns (sessions, timestamps) of the entries which belong to a session, sorted by session
+    and then by creation time, along with the index of the first entry of each session.
+    """
+    mask = reports.sessions >= 0
+    sessions = np.asarray(reports.sessions)[mask]
+    timestamps = np.asarray(reports.timestamps)[mask]
+    order = np.lexsort((timestamps, sessions))
+    sessions = sessions[order]
+    timestamps = timestamps[order]
+    starts = np.flatnonzero(np.r_[True, sessions[1:] != sessions[:-1]])
+    return sessions, timestamps, starts
+
+
+def session_lengths(reports):
+    """
+    Distribution of session durations (seconds between the first and last report in a session) and
+    of the number of reports per session.
+    """
+    sessions, timestamps, starts = sessions_by_time(reports)
+    if len(sessions) == 0:
+        return {"sessions": 0}
+    ends = np.r_[starts[1:], len(sessions)] - 1
+    durations = timestamps[ends] - timestamps[starts]
+    events = ends - starts + 1
+    return {
+        "sessions": int(len(starts)),
+        "duration_seconds": summarize(durations),
+        "reports_per_session": summarize(events),
+    }
+
+
+def retention(reports):
+    """
+    Weekly retention cohorts. Clients are assigned to the week in which they first reported. For each
+    cohort, returns the number of its clients which reported in each subsequent week.
+    """
+    mask = reports.clients >= 0
+    clients = np.asarray(reports.clients)[mask]
+    if len(clients) == 0:
+        return []
+    weeks = (np.asarray(reports.timestamps)[mask] // SECONDS_PER_WEEK).astype(np.int64)
+    first_week = weeks.min()
+    weeks -= first_week
+    num_weeks = int(weeks.max()) + 1
+
+    # Distinct (client, week) pairs.
+    active = np.unique(clients * num_weeks + weeks)
+    active_clients = active // num_weeks
+    active_weeks = active % num_weeks
+
+    cohorts = np.full(len(reports.client_names), num_weeks, dtype=np.int64)
+    np.minimum.at(cohorts, active_clients, active_weeks)
+    client_cohorts = cohorts[active_clients]
+    offsets = active_weeks - client_cohorts
+    matrix = np.bincount(
+        client_cohorts * num_weeks + offsets, minlength=num_weeks * num_weeks
+    ).reshape(num_weeks, num_weeks)
+
+    rows = []
+    for cohort in range(num_weeks):
+        if matrix[cohort, 0] == 0:
+            continue
+        week_start = datetime.fromtimestamp(
+            int(first_week + cohort) * SECONDS_PER_WEEK, tz=timezone.utc
+        )
+        rows.append(
+            {
+                "cohort": week_start.date().isoformat(),
+                "clients": int(matrix[cohort, 0]),
+                "active_by_week": [
+                    int(count) for count in matrix[cohort, : num_weeks - cohort]
+                ],
+            }
+        )
+    return rows
+
+
+def gaps(reports, num_bins):
+    """
+    Distribution of the time between consecutive reports within a session, with a histogram over
+    logarithmically spaced bins.
+    """
+    sessions, timestamps, _ = sessions_by_time(reports)
+    same_session = sessions[1:] == sessions[:-1]
+    intervals = np.diff(timestamps)[same_session]
+    if len(intervals) == 0:
+        return {"gaps": 0}
+    positive = intervals[intervals > 0]
+    histogram = []
+    if len(positive) > 0 and positive.min() == positive.max():
+        # Every positive gap is the same, so logarithmic bins would all have zero width.
+        histogram = [
+            {
+                "from": float(positive.min()),
+                "to": float(positive.max()),
+                "count": int(len(positive)),
+            }
+        ]
+    elif len(positive) > 0:
+        edges = np.logspace(
+            np.log10(positive.min()), np.log10(positive.max()), num_bins + 1
+        )
+        counts, edges = np.histogram(positive, bins=edges)
+        histogram = [
+            {"from": float(low), "to": float(high), "count": int(count)}
+            for low, high, count in zip(edges[:-1], edges[1:], counts)
+        ]
+    return {
+        "gap_seconds": summarize(intervals),
+        "simultaneous": int(len(intervals) - len(positive)),
+        "histogram": histogram,
+    }
+
+
+def summarize(values):
+    percentiles = np.percentile(values, [50, 90, 99])
+    return {
+        "count": int(len(values)),
+        "mean": float(np.mean(values)),
+        "min": float(np.min(values)),
+        "p50": float(percentiles[0]),
+        "p90": float(percentiles[1]),
+        "p99": float(percentiles[2]),
+        "max": float(np.max(values)),
+    }
+
+
+parser = argparse.ArgumentParser(description="Humbug offline analytics")
+parser.add_argument("exports", nargs="+", help="JSON lines exports of Humbug reports")
+parser.add_argument(
+    "--cache-dir",
+    type=str,
+    default=DEFAULT_CACHE_DIR,
+    help="Directory in which parsed columns are cached (default: {})".format(
+        DEFAULT_CACHE_DIR
+    ),
+)
+parser.add_argument(
+    "--no-cache", action="store_true", help="Do not read or write the columnar cache"
+)
+parser.add_argument(
+    "-a",
+    "--analysis",
+    choices=["errors", "features", "sessions", "retention", "gaps", "all"],
+    default="all",
+    help="Analysis to run",
+)
+parser.add_argument(
+    "--version-prefix",
+    type=str,
+    default="version:",
+    help="Prefix of the tag which holds the version of your tool (default: version:)",
+)
+parser.add_argument(
+    "--bins", type=int, default=20, help="Number of bins in the gap histogram"
+)
+
+
+def main():
+    args = parser.parse_args()
+    cache_dir = None if args.no_cache else args.cache_dir
+    reports = load(args.exports, cache_dir)
+
+    analyses = {
+        "errors": lambda: error_counts(reports),
+        "features": lambda: feature_usage(reports, args.version_prefix),
+        "sessions": lambda: session_lengths(reports),
+        "retention": lambda: retention(reports),
+        "gaps": lambda: gaps(reports, args.bins),
+    }
+    if args.analysis == "all":
+        result = {name: analysis() for name, analysis in analyses.items()}
+        result["reports"] = len(reports)
+    else:
+        result = analyses[args.analysis]()
+    json.dump(result, sys.stdout, indent=2)
+    print("")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,39 @@
 """
 Visualizes a single journey using the Bugout API.
 
+If --cache is specified, downloaded entries are stored in a local SQLite cache (see
+journey_cache.py). Subsequent runs of the same query only download entries created since the last
+run, and --offline runs answer queries from the cache without contacting the Bugout API at all.
+
+If --bulk is specified, the query may cover many sessions (for example, every report from a
+release). Its entries are streamed once, grouped by their session:* tags (spilling to temporary
+files when there are more than --max-in-memory of them, see journey_bulk.py), and each session's
+timeline and gap statistics are written as a JSON line to --output.
+
 Install requirements:
     pip3 install bugout python-dateutil
 """
 import argparse
-from datetime import time
+import concurrent.futures
+import heapq
+import itertools
 import os
+import random
+import sys
+import time
 
 from bugout.app import Bugout
-from dateutil.parser import parse as parse_date
+
+from journey_bulk import SessionSorter
+from journey_cache import JourneyCache, parse_created_at
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got {}".format(value))
+    return number
+
 
 parser = argparse.ArgumentParser(description="Humbug journey visualizer")
 parser.add_argument(
@@ -35,10 +59,84 @@ parser.add_argument(
 parser.add_argument(
     "-N",
     "--batch-size",
-    type=int,
+    type=positive_int,
     default=500,
     help="Number of entries to download at a time",
 )
+parser.add_argument(
+    "-w",
+    "--workers",
+    type=positive_int,
+    default=4,
+    help="Number of batches to download concurrently",
+)
+parser.add_argument(
+    "-r",
+    "--retries",
+    type=int,
+    default=3,
+    help="Number of times to retry downloading a batch before giving up",
+)
+parser.add_argument(
+    "--cache",
+    type=str,
+    default=None,
+    help="Path to a local SQLite cache of downloaded entries",
+)
+parser.add_argument(
+    "--offline",
+    action="store_true",
+    help="Answer the query from the local cache without contacting the Bugout API (requires --cache)",
+)
+parser.add_argument(
+    "--bulk",
+    action="store_true",
+    help="Reconstruct the journey of every session matching the query as JSON lines",
+)
+parser.add_argument(
+    "-o",
+    "--output",
+    type=str,
+    default="-",
+    help="File to write bulk journeys to (default: stdout)",
+)
+parser.add_argument(
+    "--max-in-memory",
+    type=positive_int,
+    default=100000,
+    help="Number of entries to hold in memory in bulk mode before spilling them to disk",
+)
+parser.add_argument(
+    "--temp-dir",
+    type=str,
+    default=None,
+    help="Directory for the temporary files of bulk mode (default: the system temporary directory)",
+)
+
+
+def search(bugout_client, token, journal, query, limit, offset, retries):
+    """
+    Downloads a single batch of search results, retrying with jittered exponential backoff if the
+    request fails.
+    """
+    attempt = 0
+    while True:
+        try:
+            return bugout_client.search(
+                token, journal, query, limit=limit, offset=offset
+            )
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            attempt += 1
+            backoff = min(2**attempt, 30) * random.uniform(0.5, 1)
+            print(
+                "Batch at offset {} failed ({}), retrying in {:.1f}s".format(
+                    offset, e, backoff
+                ),
+                file=sys.stderr,
+            )
+            time.sleep(backoff)
 
 
 def render_entry(entry):
@@ -69,7 +167,8 @@ args = parser.parse_args()
 token = args.token
 if token is None:
     token = os.environ.get("BUGOUT_ACCESS_TOKEN")
-if token is None:
+# Offline runs answer the query from the cache, without contacting the Bugout API.
+if token is None and not args.offline:
     raise ValueError(
         "Please specify --token or set your BUGOUT_ACCESS_TOKEN environment variable"
     )
@@ -82,44 +181,179 @@ if journal is None:
         "Please specify --journal or set your BUGOUT_JOURNAL_ID environment variable"
     )
 
+if args.offline and args.cache is None:
+    raise ValueError("--offline requires --cache")
+
 
 query = " ".join(args.query)
 
 bugout_client = Bugout()
 
-limit = args.batch_size
-current_offset = 0
-results = bugout_client.search(
-    token, journal, query, limit=limit, offset=current_offset
-)
-entries = results.results
-total_results = results.total_results
-print("Total results:", total_results)
-print("")
-
-while len(entries) < total_results:
-    print(current_offset)
-    current_offset += limit
-    results = bugout_client.search(
-        token, journal, query, limit=limit, offset=current_offset
+
+def download(search_query, add_batch):
+    """
+    Downloads every result for the given search query, passing each batch of entries to add_batch
+    as it arrives. Batches may arrive in any order.
+    """
+    limit = args.batch_size
+    results = search(
+        bugout_client, token, journal, search_query, limit, 0, args.retries
+    )
+    total_results = results.total_results
+    if args.bulk:
+        print("Total results:", total_results, file=sys.stderr)
+    else:
+        print("Total results:", total_results)
+        print("")
+
+    add_batch(results.results)
+    downloaded = len(results.results)
+
+    # Once we know total_results, the remaining batches are downloaded concurrently. At most
+    # args.workers batches are in flight at any time.
+    offsets = iter(range(limit, total_results, limit))
+    pending = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        while True:
+            for offset in itertools.islice(offsets, args.workers - len(pending)):
+                pending.add(
+                    executor.submit(
+                        search,
+                        bugout_client,
+                        token,
+                        journal,
+                        search_query,
+                        limit,
+                        offset,
+                        args.retries,
+                    )
+                )
+            if not pending:
+                break
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                batch = future.result().results
+                add_batch(batch)
+                downloaded += len(batch)
+                print(
+                    "Downloaded {}/{} entries".format(downloaded, total_results),
+                    file=sys.stderr,
+                )
+
+
+def downloaded_timeline():
+    """
+    Downloads the journey and yields (timestamp, entry) pairs in order of creation.
+
+    Entries are pushed onto a heap ordered by creation time as each batch arrives. The counter
+    breaks ties between entries created at the same time. Only the download is concurrent: every
+    entry of the journey is held in memory until the last batch has arrived (see --bulk for queries
+    too large for that).
+    """
+    timeline = []
+    sequence = itertools.count()
+
+    def add_batch(entries):
+        for entry in entries:
+            heapq.heappush(
+                timeline, (parse_created_at(entry.created_at), next(sequence), entry)
+            )
+
+    download(query, add_batch)
+    while timeline:
+        timestamp, _, entry = heapq.heappop(timeline)
+        yield timestamp, entry
+
+
+def cached_timeline(cache):
+    """
+    Brings the local cache up to date with the query (unless running offline) and yields
+    (timestamp, entry) pairs for the journey from the cache in order of creation.
+    """
+    if not args.offline:
+        search_query = query
+        last_created_at = cache.last_sync(journal, query)
+        if last_created_at is not None:
+            # Entries created in the same instant as the last synced entry may not have been synced
+            # yet. Re-downloading the last synced entries is harmless, since the cache stores each
+            # entry once, keyed by its URL.
+            search_query = "{} created_at:>={}".format(query, last_created_at)
+
+        newest_entries = []
+
+        def add_batch(entries):
+            newest = cache.add_entries(journal, query, entries)
+            if newest is not None:
+                newest_entries.append(newest)
+
+        download(search_query, add_batch)
+        cache.record_sync(
+            journal,
+            query,
+            max(newest_entries, key=lambda newest: newest[1], default=None),
+        )
+
+    for entry in cache.timeline(journal, query):
+        yield entry.timestamp, entry
+
+
+def bulk_journeys():
+    """
+    Streams the query's entries into a SessionSorter and writes every session's journey to
+    args.output.
+    """
+    sorter = SessionSorter(max_in_memory=args.max_in_memory, temp_dir=args.temp_dir)
+    try:
+        if args.cache is not None:
+            for timestamp, entry in cached_timeline(JourneyCache(args.cache)):
+                sorter.add(entry, timestamp.timestamp())
+        else:
+
+            def add_batch(entries):
+                for entry in entries:
+                    sorter.add(entry)
+
+            download(query, add_batch)
+
+        if args.output == "-":
+            sessions = sorter.write(sys.stdout)
+        else:
+            with open(args.output, "w") as ofp:
+                sessions = sorter.write(ofp)
+    finally:
+        # Removes the sorted runs if the download or the output failed before every session was
+        # written.
+        sorter.cleanup()
+    print(
+        "Wrote {} sessions ({} entries, {} sorted runs spilled to disk)".format(
+            sessions, sorter.entries, sorter.spilled
+        ),
+        file=sys.stderr,
     )
-    entries.extend(results.results)
+    if sorter.without_session:
+        print(
+            "Skipped {} entries without a session tag".format(sorter.without_session),
+            file=sys.stderr,
+        )
 
-timestamped_entries = []
-for entry in entries:
-    entry_created_at_seconds = parse_date(entry.created_at)
-    timestamped_entries.append((entry_created_at_seconds, entry))
 
-timestamped_entries.sort(key=lambda i: i[0])
+if args.bulk:
+    bulk_journeys()
+    sys.exit(0)
 
-if timestamped_entries:
-    last_timestamp, last_entry = timestamped_entries[0]
-    render_entry(last_entry)
+if args.cache is not None:
+    cache = JourneyCache(args.cache)
+    timestamped_entries = cached_timeline(cache)
+else:
+    timestamped_entries = downloaded_timeline()
 
-    for timestamp, entry in timestamped_entries[1:]:
+last_timestamp = None
+for timestamp, entry in timestamped_entries:
+    if last_timestamp is not None:
         print("")
         print("    gap: {}".format(timestamp - last_timestamp))
         print("")
-        render_entry(entry)
-        last_timestamp = timestamp
-        last_entry = entry
+    render_entry(entry)
+    last_timestamp = timestamp
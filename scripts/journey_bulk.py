@@ -0,0 +1,240 @@
+"""
+Bulk reconstruction of many journeys at once for use by journey.py.
+
+Entries matching a query which covers many sessions (for example, every report from a release) are
+streamed through a SessionSorter once. It groups them by their session:* tag and orders each
+session's entries by creation time, spilling sorted runs to temporary files when more than
+max_in_memory entries are buffered and merging the runs at the end, so that the query's results
+never have to fit in memory at once. At most max_open_runs runs are merged at a time: if more were
+spilled, they are first merged into fewer, longer runs. Only a single session's timeline is held in
+memory while it is written out.
+
+Each session is written as one JSON line with its timeline and statistics of the gaps between its
+consecutive entries.
+"""
+from contextlib import ExitStack
+import heapq
+import itertools
+import json
+import os
+import tempfile
+
+from journey_cache import parse_timestamp
+
+try:
+    import orjson
+
+    def dumps(value):
+        return orjson.dumps(value).decode("utf-8")
+
+    loads = orjson.loads
+except ImportError:
+
+    def dumps(value):
+        return json.dumps(value, separators=(",", ":"))
+
+    loads = json.loads
+
+SESSION_PREFIX = "session:"
+
+
+def session_of(tags):
+    for tag in tags:
+        if tag.startswith(SESSION_PREFIX):
+            return tag[len(SESSION_PREFIX) :]
+    return None
+
+
+def quantile(sorted_values, q):
+    """
+    Returns the nearest-rank q-quantile of a non-empty sorted list.
+    """
+    index = min(int(q * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def gap_statistics(gaps):
+    """
+    Summarizes the gaps (in seconds) between consecutive entries of a session, or returns None if
+    the session has fewer than two entries.
+    """
+    if not gaps:
+        return None
+    ordered = sorted(gaps)
+    return {
+        "count": len(ordered),
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": sum(ordered) / len(ordered),
+        "median": quantile(ordered, 0.5),
+        "p90": quantile(ordered, 0.9),
+    }
+
+
+class SessionSorter:
+    """
+    Groups entries by session and orders them by creation time with an external merge sort.
+
+    Entries are buffered as (session, timestamp, sequence, created_at, title, entry_url, tags)
+    records. The sequence number breaks ties between entries of a session created at the same time,
+    so that they keep the order in which they were added.
+    """
+
+    def __init__(self, max_in_memory=100000, temp_dir=None, max_open_runs=64):
+        if max_in_memory < 1:
+            raise ValueError("max_in_memory must be at least 1")
+        if max_open_runs < 2:
+            raise ValueError("max_open_runs must be at least 2")
+        self.max_in_memory = max_in_memory
+        self.max_open_runs = max_open_runs
+        self.temp_dir = temp_dir
+        self.buffer = []
+        self.runs = []
+        self.spilled = 0
+        self.sequence = itertools.count()
+        self.entries = 0
+        self.without_session = 0
+
+    def add(self, entry, timestamp=None):
+        """
+        Adds an entry (with entry_url, title, created_at and tags attributes). timestamp is its
+        creation time in seconds since the epoch, and is parsed from created_at if not given.
+        Entries without a session:* tag are counted but otherwise ignored.
+        """
+        session = session_of(entry.tags)
+        if session is None:
+            self.without_session += 1
+            return
+        if timestamp is None:
+            timestamp = parse_timestamp(entry.created_at)
+        self.buffer.append(
+            (
+                session,
+                timestamp,
+                next(self.sequence),
+                entry.created_at,
+                entry.title,
+                entry.entry_url,
+                list(entry.tags),
+            )
+        )
+        self.entries += 1
+        if len(self.buffer) >= self.max_in_memory:
+            self.spill()
+
+    def spill(self):
+        """
+        Writes the buffered records to a temporary file as a sorted run.
+        """
+        if not self.buffer:
+            return
+        self.buffer.sort(key=lambda record: record[:3])
+        self.write_run(self.buffer)
+        self.spilled += 1
+        self.buffer = []
+
+    def write_run(self, records):
+        """
+        Writes sorted records to a new temporary file and adds it to the runs.
+        """
+        fd, path = tempfile.mkstemp(
+            prefix="journey-", suffix=".jsonl", dir=self.temp_dir
+        )
+        # The run is added before it is written, so that cleanup() removes it if writing fails.
+        self.runs.append(path)
+        with os.fdopen(fd, "w") as ofp:
+            for record in records:
+                ofp.write(dumps(record))
+                ofp.write("\n")
+
+    def merge_runs(self, paths):
+        """
+        Yields the records of the given runs in order.
+        """
+        with ExitStack() as stack:
+            run_files = [stack.enter_context(open(path)) for path in paths]
+            yield from heapq.merge(
+                *((loads(line) for line in run_file) for run_file in run_files),
+                key=lambda record: (record[0], record[1], record[2]),
+            )
+
+    def cleanup(self):
+        for path in self.runs:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.runs = []
+
+    def records(self):
+        """
+        Yields every record, ordered by session and then by creation time. If any runs were spilled,
+        they are merged with the remaining buffered records, max_open_runs at a time.
+        """
+        if not self.runs:
+            self.buffer.sort(key=lambda record: record[:3])
+            yield from self.buffer
+            return
+
+        self.spill()
+        while len(self.runs) > self.max_open_runs:
+            paths = self.runs[: self.max_open_runs]
+            self.write_run(self.merge_runs(paths))
+            for path in paths:
+                os.remove(path)
+            del self.runs[: len(paths)]
+        yield from self.merge_runs(self.runs)
+
+    def sessions(self):
+        """
+        Yields a summary, with its timeline, for every session. Sessions are yielded in order of
+        session ID.
+        """
+        try:
+            for session, records in itertools.groupby(
+                self.records(), key=lambda record: record[0]
+            ):
+                timeline = []
+                gaps = []
+                first_timestamp = None
+                last_timestamp = None
+                for _, timestamp, _, created_at, title, entry_url, tags in records:
+                    gap = None
+                    if last_timestamp is None:
+                        first_timestamp = timestamp
+                    else:
+                        gap = timestamp - last_timestamp
+                        gaps.append(gap)
+                    timeline.append(
+                        {
+                            "created_at": created_at,
+                            "title": title,
+                            "entry_url": entry_url,
+                            "tags": tags,
+                            "gap_seconds": gap,
+                        }
+                    )
+                    last_timestamp = timestamp
+                yield {
+                    "session": session,
+                    "entries": len(timeline),
+                    "start": timeline[0]["created_at"],
+                    "end": timeline[-1]["created_at"],
+                    "duration_seconds": last_timestamp - first_timestamp,
+                    "gaps": gap_statistics(gaps),
+                    "timeline": timeline,
+                }
+        finally:
+            self.cleanup()
+
+    def write(self, ofp):
+        """
+        Writes every session to the given file as a JSON line, and returns the number of sessions
+        written.
+        """
+        sessions = 0
+        for summary in self.sessions():
+            ofp.write(dumps(summary))
+            ofp.write("\n")
+            sessions += 1
+        return sessions
@@ -0,0 +1,271 @@
+"""
+Local SQLite cache of Bugout journal entries for use by journey.py.
+
+Entries are stored once, with their creation time parsed into a timestamp at insertion time, and
+are indexed by session, client, tag, and timestamp. Each search query that is synced into the cache
+remembers which entries it matched and the creation time of the newest of them, so that the next
+sync only needs to download entries created at or after that.
+
+Install requirements:
+    pip3 install python-dateutil
+"""
+from collections import namedtuple
+from datetime import datetime, timezone
+import sqlite3
+import time
+
+from dateutil.parser import parse as parse_date
+
+CachedEntry = namedtuple(
+    "CachedEntry", ["entry_url", "title", "created_at", "timestamp", "tags"]
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    entry_url TEXT PRIMARY KEY,
+    journal TEXT NOT NULL,
+    title TEXT,
+    created_at TEXT NOT NULL,
+    created_at_ts REAL NOT NULL,
+    session TEXT,
+    client TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_journal_ts ON entries (journal, created_at_ts);
+CREATE INDEX IF NOT EXISTS entries_session_ts ON entries (session, created_at_ts);
+CREATE INDEX IF NOT EXISTS entries_client_ts ON entries (client, created_at_ts);
+
+CREATE TABLE IF NOT EXISTS tags (
+    tag TEXT NOT NULL,
+    entry_url TEXT NOT NULL,
+    PRIMARY KEY (tag, entry_url)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tags_entry ON tags (entry_url);
+
+CREATE TABLE IF NOT EXISTS query_results (
+    journal TEXT NOT NULL,
+    query TEXT NOT NULL,
+    entry_url TEXT NOT NULL,
+    PRIMARY KEY (journal, query, entry_url)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS syncs (
+    journal TEXT NOT NULL,
+    query TEXT NOT NULL,
+    last_created_at TEXT,
+    last_created_at_ts REAL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (journal, query)
+);
+"""
+
+# Tags are fetched along with their entries, joined into a single column by this separator (the
+# ASCII unit separator, which does not appear in tags).
+TAG_SEPARATOR = "\x1f"
+
+# The columns of an entry row: entry_url, title, created_at, created_at_ts and its tags.
+ENTRY_COLUMNS = """
+    e.entry_url, e.title, e.created_at, e.created_at_ts,
+    (SELECT group_concat(t.tag, char(31)) FROM tags t WHERE t.entry_url = e.entry_url)
+"""
+
+
+def parse_created_at(created_at):
+    """
+    Parses a creation time (as returned by Bugout) into a timezone-aware datetime. Times without a
+    UTC offset are assumed to be in UTC, not in the local time zone. ISO 8601 times are parsed with
+    the standard library, which is much faster than dateutil.
+    """
+    if created_at.endswith("Z"):
+        created_at = created_at[:-1] + "+00:00"
+    try:
+        parsed = datetime.fromisoformat(created_at)
+    except ValueError:
+        parsed = parse_date(created_at)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def parse_timestamp(created_at):
+    """
+    Converts a creation time (as returned by Bugout) into seconds since the epoch (see
+    parse_created_at).
+    """
+    return parse_created_at(created_at).timestamp()
+
+
+def tag_value(tags, prefix):
+    for tag in tags:
+        if tag.startswith(prefix):
+            return tag[len(prefix) :]
+    return None
+
+
+class JourneyCache:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def is_synced(self, journal, query):
+        row = self.connection.execute(
+            "SELECT 1 FROM syncs WHERE journal = ? AND query = ?", (journal, query)
+        ).fetchone()
+        return row is not None
+
+    def last_sync(self, journal, query):
+        """
+        Returns the creation time (as the string Bugout returned it) of the newest entry matching
+        the given query the last time it was synced, or None if the query has never been synced or
+        matched no entries.
+        """
+        row = self.connection.execute(
+            "SELECT last_created_at FROM syncs WHERE journal = ? AND query = ?",
+            (journal, query),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def add_entries(self, journal, query, entries):
+        """
+        Stores a batch of search results in the cache and records that they match the given query.
+        Returns a (created_at, timestamp) pair for the newest entry in the batch, or None if the
+        batch was empty.
+        """
+        entry_rows = []
+        tag_rows = []
+        query_rows = []
+        newest = None
+        for entry in entries:
+            created_at_ts = parse_timestamp(entry.created_at)
+            entry_rows.append(
+                (
+                    entry.entry_url,
+                    journal,
+                    entry.title,
+                    entry.created_at,
+                    created_at_ts,
+                    tag_value(entry.tags, "session:"),
+                    tag_value(entry.tags, "client:"),
+                )
+            )
+            tag_rows.extend((tag, entry.entry_url) for tag in entry.tags)
+            query_rows.append((journal, query, entry.entry_url))
+            if newest is None or created_at_ts > newest[1]:
+                newest = (entry.created_at, created_at_ts)
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                entry_rows,
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO tags VALUES (?, ?)", tag_rows
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO query_results VALUES (?, ?, ?)", query_rows
+            )
+        return newest
+
+    def record_sync(self, journal, query, newest):
+        """
+        Records that the given query has been synced in full. newest is the (created_at, timestamp)
+        pair of the newest entry downloaded during the sync, or None if there were no new entries.
+
+        This must only be called once every batch of the sync has been stored, since the next sync
+        only downloads entries created at or after the newest one recorded here.
+        """
+        with self.connection:
+            if newest is None:
+                self.connection.execute(
+                    """
+                    INSERT INTO syncs VALUES (?, ?, NULL, NULL, ?)
+                    ON CONFLICT (journal, query) DO UPDATE SET synced_at = excluded.synced_at
+                    """,
+                    (journal, query, time.time()),
+                )
+            else:
+                self.connection.execute(
+                    """
+                    INSERT INTO syncs VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (journal, query) DO UPDATE SET
+                        last_created_at = excluded.last_created_at,
+                        last_created_at_ts = excluded.last_created_at_ts,
+                        synced_at = excluded.synced_at
+                    """,
+                    (journal, query, newest[0], newest[1], time.time()),
+                )
+
+    def timeline(self, journal, query):
+        """
+        Yields the cached entries matching the given query in order of creation.
+
+        If the query has been synced into the cache, the entries it matched are returned. Otherwise,
+        the query is interpreted as a list of tags (optionally prefixed with "#" or "tag:"), all of
+        which an entry must carry.
+        """
+        if self.is_synced(journal, query):
+            rows = self.connection.execute(
+                """
+                SELECT {}
+                FROM query_results q JOIN entries e ON e.entry_url = q.entry_url
+                WHERE q.journal = ? AND q.query = ?
+                ORDER BY e.created_at_ts
+                """.format(
+                    ENTRY_COLUMNS
+                ),
+                (journal, query),
+            )
+        else:
+            tags = []
+            for token in query.split():
+                if token.startswith("#"):
+                    token = token[1:]
+                elif token.startswith("tag:"):
+                    token = token[len("tag:") :]
+                tags.append(token)
+            rows = self.entries_with_tags(journal, tags)
+
+        for entry_url, title, created_at, created_at_ts, tags in rows:
+            yield CachedEntry(
+                entry_url,
+                title,
+                created_at,
+                datetime.fromtimestamp(created_at_ts, tz=timezone.utc),
+                tags.split(TAG_SEPARATOR) if tags else [],
+            )
+
+    def entries_with_tags(self, journal, tags):
+        """
+        Returns rows of ENTRY_COLUMNS for the cached entries which carry all the given tags, in order
+        of creation. Session and client tags are answered from the
+        dedicated session and client indexes.
+        """
+        conditions = ["e.journal = ?"]
+        parameters = [journal]
+        for tag in tags:
+            if tag.startswith("session:"):
+                conditions.append("e.session = ?")
+                parameters.append(tag[len("session:") :])
+            elif tag.startswith("client:"):
+                conditions.append("e.client = ?")
+                parameters.append(tag[len("client:") :])
+            else:
+                conditions.append(
+                    "EXISTS (SELECT 1 FROM tags t WHERE t.tag = ? AND t.entry_url = e.entry_url)"
+                )
+                parameters.append(tag)
+        return self.connection.execute(
+            """
+            SELECT {}
+            FROM entries e
+            WHERE {}
+            ORDER BY e.created_at_ts
+            """.format(
+                ENTRY_COLUMNS, " AND ".join(conditions)
+            ),
+            parameters,
+        )